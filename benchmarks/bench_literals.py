@@ -0,0 +1,70 @@
+# compares the conversion time of the --literals modes (see literals.py) on
+# the attribute-heavy corpus document, where half the attributes are
+# xs:int, and on the wide one, whose records have xs:int leaf values.
+#
+# Each mode converts the same parsed document into an N-Triples sink with a
+# plan of its own; the best of `repeat` runs is reported.
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+import rdfify2
+import xml2rdf
+import literals
+import sinks
+
+import corpus
+
+def timeMode(r, sdata, mode, repeat):
+    best = None
+    for i in xrange(repeat):
+        plan = xml2rdf.ConversionPlan(sdata, 'http://example.org/out', literal_mode=mode)
+        sink = sinks.NTriplesSink(cStringIO.StringIO())
+        start = time.time()
+        xml2rdf.parseXMLDocument(r, sink, sdata, 'http://example.org/out', plan)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, sink.count
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-r', '--records', type=int, default=20000)
+    argparser.add_argument('--repeat', type=int, default=3)
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        schema_loc = corpus.writeBenchSchema(directory)
+        documents = [
+            ('attributes', corpus.writeAttributeDocument(os.path.join(directory, 'attributes.xml'), schema_loc,
+                                                         args.records)),
+            ('wide', corpus.writeWideDocument(os.path.join(directory, 'wide.xml'), schema_loc, args.records)),
+        ]
+
+        print '{0:<12} {1:<10} {2:>10} {3:>10} {4:>10}'.format('document', 'literals', 'seconds', 'vs plain', 'triples')
+        for name, xml_loc in documents:
+            r = lxml.etree.parse(xml_loc).getroot()
+            sdata = rdfify2.SchemaData()
+            rdfify2.loadSchemata(rdflib.Graph(), sdata, r, None)
+            plain = None
+            for mode in literals.MODES:
+                elapsed, triples = timeMode(r, sdata, mode, args.repeat)
+                if plain is None:
+                    plain = elapsed
+                print '{0:<12} {1:<10} {2:>10.3f} {3:>9.0f}% {4:>10}'.format(name, mode, elapsed,
+                                                                       100.0 * elapsed / plain, triples)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
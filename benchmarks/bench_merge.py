@@ -0,0 +1,79 @@
+# compares the merge step of rdfify2.main before and after dropping the
+# serialize-to-tempfile-and-reparse round trip.
+#
+# Each variant runs in its own process, so peak RSS can be read off
+# getrusage; the reported memory is how far the merge raised that peak.
+
+import sys
+import os
+import time
+import resource
+import tempfile
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+import rdfify2
+
+import corpus
+
+def mergeViaTempfiles(g, s):
+    """The merge as rdfify2.main used to do it."""
+    stmp = tempfile.NamedTemporaryFile()
+    gtmp = tempfile.NamedTemporaryFile()
+
+    stmp.write(s.serialize(format='n3'))
+    gtmp.write(g.serialize(format='n3'))
+
+    stmp.flush()
+    gtmp.flush()
+
+    g = rdflib.Graph()
+    g.parse(stmp.name, format='n3')
+    g.parse(gtmp.name, format='n3')
+    return g
+
+def mergeInMemory(g, s):
+    return rdfify2.mergeGraphs(g, s)
+
+VARIANTS = {
+    'tempfile': mergeViaTempfiles,
+    'in-memory': mergeInMemory,
+}
+
+def runVariant(name, xml_loc, results):
+    r = lxml.etree.parse(xml_loc).getroot()
+    g, s = rdfify2.extractRDFGraphWithSchema(r, None, 'http://example.org/out')
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    merged = VARIANTS[name](g, s)
+    elapsed = time.time() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results.put((elapsed, rss_after - rss_before, len(merged)))
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-r', '--records', type=int, default=10000)
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    xml_loc = corpus.writeWideDocument(os.path.join(directory, 'bench.xml'), corpus.writeBenchSchema(directory), args.records)
+
+    print '{0:<10} {1:>10} {2:>14} {3:>10}'.format('merge', 'seconds', 'peak +KiB', 'triples')
+    for name in ('tempfile', 'in-memory'):
+        results = multiprocessing.Queue()
+        p = multiprocessing.Process(target=runVariant, args=(name, xml_loc, results))
+        p.start()
+        p.join()
+        if p.exitcode != 0:
+            sys.exit('{0} merge failed'.format(name))
+        elapsed, rss, triples = results.get()
+        print '{0:<10} {1:>10.3f} {2:>14} {3:>10}'.format(name, elapsed, rss, triples)
+
+if __name__ == "__main__":
+    main()
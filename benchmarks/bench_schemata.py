@@ -0,0 +1,67 @@
+# times loading a set of schemata the way rdfify2 used to (one
+# parseXMLSchema call per schema, each reducing the type map and rebuilding
+# the RDFS triples for everything loaded so far) against a single
+# xsd2rdfs.parseXMLSchemata call.
+
+import sys
+import os
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rdflib
+import rdfify2
+import xsd2rdfs
+
+import corpus
+
+def parseXMLSchemaLegacy(schema_loc, schema_graph, schema_data):
+    """xsd2rdfs.parseXMLSchema as it used to be."""
+    xsd2rdfs.parseXMLSchemaRecursive(schema_loc, schema_graph, schema_data)
+    xsd2rdfs.reduceSimpleTypeMap(schema_data.simpleTypeMap)
+
+    for k, v in schema_data.complexTypeMap.iteritems():
+        k_dec = xsd2rdfs.decomposeLongTagName(k)
+        n = xsd2rdfs.constructURIRef(k_dec[0], k_dec[1])
+        schema_graph.add((n, rdflib.namespace.RDF.type, rdflib.namespace.RDFS.Class))
+        if v:
+            v_dec = xsd2rdfs.decomposeLongTagName(v)
+            schema_graph.add((n, rdflib.namespace.RDFS.subClassOf, xsd2rdfs.constructURIRef(v_dec[0], v_dec[1])))
+
+    for typeMap in (schema_data.elementMap, schema_data.attributeMap):
+        for k, v in typeMap.iteritems():
+            k_dec = xsd2rdfs.decomposeLongTagName(k)
+            n = xsd2rdfs.constructURIRef(k_dec[0], k_dec[1])
+            xsd2rdfs.emitPropertyTriples(n, schema_data.simpleTypeMap.get(v, v), schema_graph)
+
+def loadLegacy(locs):
+    g = rdflib.Graph()
+    sdata = rdfify2.SchemaData()
+    for loc in locs:
+        parseXMLSchemaLegacy(loc, g, sdata)
+    return g
+
+def loadIncremental(locs):
+    g = rdflib.Graph()
+    sdata = rdfify2.SchemaData()
+    xsd2rdfs.parseXMLSchemata(locs, g, sdata)
+    return g
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-c', '--count', type=int, default=50, help='number of schemata')
+    argparser.add_argument('-d', '--definitions', type=int, default=40, help='definitions of each kind per schema')
+    args = argparser.parse_args()
+
+    locs = corpus.writeSchemata(tempfile.mkdtemp(), args.count, args.definitions)
+
+    print '{0:<12} {1:>10} {2:>10}'.format('loading', 'seconds', 'triples')
+    for name, load in (('per-schema', loadLegacy), ('incremental', loadIncremental)):
+        start = time.time()
+        g = load(locs)
+        print '{0:<12} {1:>10.3f} {2:>10}'.format(name, time.time() - start, len(g))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# compares building and serializing the document graph in rdflib's memory
+# store against the compact and disk-backed stores of graphstore.py.
+#
+# Each store runs in its own process, so peak RSS can be read off getrusage;
+# the reported memory is how far conversion and serialization raised that
+# peak.
+
+import sys
+import os
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdfify2
+import graphstore
+
+import corpus
+
+def storeSize(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+def runStore(store, xml_loc, directory, results):
+    path = os.path.join(directory, 'store.' + store)
+    r = lxml.etree.parse(xml_loc).getroot()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    g = graphstore.openGraph(store, path)
+    g, s = rdfify2.extractRDFGraphWithSchema(r, None, 'http://example.org/out', graph=g)
+    g.commit()
+    converted = time.time()
+    with open(os.path.join(directory, store + '.nt'), 'w') as f:
+        g.serialize(destination=f, format='nt')
+    serialized = time.time()
+    triples = len(g)
+    graphstore.closeGraph(g)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    size = storeSize(path) if store not in ('memory', 'compact') else 0
+    results.put((converted - start, serialized - converted, rss_after - rss_before, size, triples))
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('-r', '--records', type=int, default=20000)
+    argparser.add_argument('--store', action='append', default=None, choices=graphstore.STORES,
+                           help='stores to compare (default: memory, compact and sqlite)')
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        xml_loc = corpus.writeWideDocument(os.path.join(directory, 'bench.xml'), corpus.writeBenchSchema(directory), args.records)
+
+        print '{0:<10} {1:>10} {2:>10} {3:>12} {4:>14} {5:>12} {6:>10}'.format(
+            'store', 'convert s', 'write s', 'triples/s', 'peak +KiB', 'disk KiB', 'triples')
+        for store in args.store or ('memory', 'compact', 'sqlite'):
+            results = multiprocessing.Queue()
+            p = multiprocessing.Process(target=runStore, args=(store, xml_loc, directory, results))
+            p.start()
+            p.join()
+            if p.exitcode != 0:
+                print '{0:<10} failed'.format(store)
+                continue
+            convert, write, rss, size, triples = results.get()
+            print '{0:<10} {1:>10.3f} {2:>10.3f} {3:>12.0f} {4:>14} {5:>12} {6:>10}'.format(
+                store, convert, write, triples / (convert + write), rss, size / 1024, triples)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
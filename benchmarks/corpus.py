@@ -0,0 +1,140 @@
+# synthetic XML/XSD corpora for the benchmarks.
+#
+# Every document generator writes a document in the bench namespace that
+# references the schema written by writeBenchSchema through
+# xsi:schemaLocation (as an absolute path, since relative locations are
+# resolved against the working directory), and returns its location.
+
+import os
+
+ns_bench = 'http://example.org/bench'
+
+# attributes declared on top of b:id and b:ref, for attribute-heavy documents
+ATTRIBUTE_COUNT = 16
+
+# deep documents are made of chains of nested elements; libxml2 refuses to
+# nest deeper than 256 levels without its huge_tree option, which rdfify2
+# doesn't set
+MAX_CHAIN_DEPTH = 250
+
+def writeBenchSchema(directory):
+    """Writes the schema the benchmark documents refer to."""
+    loc = os.path.join(directory, 'bench.xsd')
+    with open(loc, 'w') as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="{0}" xmlns:b="{0}">\n'.format(ns_bench))
+        f.write('  <xs:complexType name="RecordType"><xs:sequence/></xs:complexType>\n')
+        f.write('  <xs:complexType name="NodeType"><xs:sequence/></xs:complexType>\n')
+        f.write('  <xs:element name="record" type="b:RecordType"/>\n')
+        f.write('  <xs:element name="node" type="b:NodeType"/>\n')
+        f.write('  <xs:element name="value" type="xs:int"/>\n')
+        f.write('  <xs:element name="label" type="xs:string"/>\n')
+        f.write('  <xs:attribute name="id" type="xs:ID"/>\n')
+        f.write('  <xs:attribute name="ref" type="xs:IDREF"/>\n')
+        for i in xrange(ATTRIBUTE_COUNT):
+            f.write('  <xs:attribute name="a{0}" type="{1}"/>\n'.format(i, 'xs:int' if i % 2 else 'xs:string'))
+        f.write('</xs:schema>\n')
+    return loc
+
+def _writeDocument(loc, schema_loc, write_body):
+    with open(loc, 'w') as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<root xmlns="{0}" xmlns:b="{0}" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="{0} {1}">\n'.format(ns_bench, schema_loc))
+        write_body(f)
+        f.write('</root>\n')
+    return loc
+
+def writeWideDocument(loc, schema_loc, records):
+    """Many small records directly under the root."""
+    def body(f):
+        for i in xrange(records):
+            f.write('<record b:id="r{0}"><value>{0}</value><label>record {0}</label><group><value>{1}</value></group></record>\n'.format(i, i % 7))
+    return _writeDocument(loc, schema_loc, body)
+
+def writeDeepDocument(loc, schema_loc, chains, depth = MAX_CHAIN_DEPTH):
+    """`chains` chains of `depth` nested elements, each level with a little
+       text and a leaf value."""
+    def body(f):
+        for i in xrange(chains):
+            for j in xrange(depth):
+                f.write('<node>level {0}<value>{0}</value>'.format(j))
+            f.write('</node>' * depth)
+            f.write('\n')
+    return _writeDocument(loc, schema_loc, body)
+
+def writeAttributeDocument(loc, schema_loc, records):
+    """Records that carry all their data in attributes."""
+    def body(f):
+        for i in xrange(records):
+            attrs = ' '.join('b:a{0}="{1}"'.format(j, i * j if j % 2 else 'v{0}'.format(i + j)) for j in xrange(ATTRIBUTE_COUNT))
+            f.write('<record {0}/>\n'.format(attrs))
+    return _writeDocument(loc, schema_loc, body)
+
+def writeReferenceDocument(loc, schema_loc, records, refs = 4):
+    """Records labelled with IDs, each referring to `refs` others."""
+    def body(f):
+        for i in xrange(records):
+            f.write('<record b:id="r{0}">'.format(i))
+            for j in xrange(1, refs + 1):
+                f.write('<link b:ref="r{0}"/>'.format((i * 7 + j * 13) % records))
+            f.write('</record>\n')
+    return _writeDocument(loc, schema_loc, body)
+
+def writeSchemata(directory, count, definitions):
+    """Writes `count` schemata, each importing the one before it, with
+       `definitions` simple types, complex types, elements and attributes
+       each. Returns their locations."""
+    locs = []
+    for i in xrange(count):
+        ns = 'http://example.org/bench/{0}'.format(i)
+        loc = os.path.join(directory, 'schema{0}.xsd'.format(i))
+        with open(loc, 'w') as f:
+            f.write('<?xml version="1.0"?>\n')
+            f.write('<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="{0}" xmlns:t="{0}"'.format(ns))
+            if i:
+                f.write(' xmlns:p="http://example.org/bench/{0}">\n'.format(i - 1))
+                f.write('  <xs:import namespace="http://example.org/bench/{0}" schemaLocation="schema{0}.xsd"/>\n'.format(i - 1))
+            else:
+                f.write('>\n')
+            for j in xrange(definitions):
+                # simple types derive from the previous schema's, down to xs:int
+                base = 'p:Simple{0}'.format(j) if i else 'xs:int'
+                f.write('  <xs:simpleType name="Simple{0}"><xs:restriction base="{1}"/></xs:simpleType>\n'.format(j, base))
+                base = 'p:Complex{0}'.format(j) if i else 't:Complex0'
+                f.write('  <xs:complexType name="Complex{0}"><xs:complexContent><xs:extension base="{1}"/></xs:complexContent></xs:complexType>\n'.format(j, base))
+                f.write('  <xs:element name="value{0}" type="t:Simple{0}"/>\n'.format(j))
+                f.write('  <xs:element name="item{0}" type="t:Complex{0}"/>\n'.format(j))
+                f.write('  <xs:attribute name="attr{0}" type="t:Simple{0}"/>\n'.format(j))
+            f.write('</xs:schema>\n')
+        locs.append(loc)
+    return locs
+
+def writeImportingSchema(directory, count, definitions):
+    """Writes the schemata of writeSchemata and a schema that imports each
+       of them directly. Returns the location of the importing schema."""
+    locs = writeSchemata(directory, count, definitions)
+    loc = os.path.join(directory, 'imports.xsd')
+    with open(loc, 'w') as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="{0}/imports">\n'.format(ns_bench))
+        for i, schema_loc in enumerate(locs):
+            f.write('  <xs:import namespace="http://example.org/bench/{0}" schemaLocation="{1}"/>\n'.format(i, os.path.basename(schema_loc)))
+        f.write('</xs:schema>\n')
+    return loc
+
+# document corpora by name: (generator, default size)
+DOCUMENTS = {
+    'wide': (writeWideDocument, 20000),
+    'deep': (writeDeepDocument, 100),
+    'attributes': (writeAttributeDocument, 10000),
+    'references': (writeReferenceDocument, 20000),
+}
+
+def writeDocumentCorpus(directory, name, scale = 1.0):
+    """Writes the named document corpus (and the bench schema) to
+       `directory`, scaled from its default size. Returns its location."""
+    generator, size = DOCUMENTS[name]
+    schema_loc = writeBenchSchema(directory)
+    return generator(os.path.join(directory, name + '.xml'), schema_loc, max(1, int(size * scale)))
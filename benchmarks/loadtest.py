@@ -0,0 +1,198 @@
+# load test for the conversion service (`rdfify2.py --serve`, see service.py).
+#
+# Starts a service on a free localhost port (or uses --url), and has
+# `concurrency` client threads POST a generated document to it until
+# `requests` conversions have succeeded. Clients that get 503 back off for
+# the Retry-After time and try again. Reports throughput, latency
+# percentiles and how often the service pushed back.
+#
+#   benchmarks/loadtest.py -c 8 -n 200 -j 2 --records 500
+
+import sys
+import os
+import json
+import time
+import shutil
+import signal
+import socket
+import httplib
+import urlparse
+import tempfile
+import argparse
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import corpus
+
+rdfify2_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rdfify2.py')
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def startService(port, jobs, max_pending, schema_loc):
+    argv = [sys.executable, rdfify2_path, '--serve', '127.0.0.1:{0}'.format(port), '-t', 'nt',
+            '-n', 'http://example.org/out', '--allow-schema', schema_loc]
+    if jobs:
+        argv += ['-j', str(jobs)]
+    if max_pending:
+        argv += ['--max-pending', str(max_pending)]
+    return subprocess.Popen(argv)
+
+def waitForService(url, process = None, timeout = 30):
+    parts = urlparse.urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('service exited with status {0}'.format(process.returncode))
+        try:
+            conn = httplib.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            conn.request('GET', '/status')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('service at {0} did not come up'.format(url))
+
+def getStatus(url):
+    parts = urlparse.urlparse(url)
+    conn = httplib.HTTPConnection(parts.hostname, parts.port)
+    conn.request('GET', '/status')
+    ret = json.loads(conn.getresponse().read())
+    conn.close()
+    return ret
+
+class LoadTest:
+    """Shared state of the client threads."""
+
+    def __init__(self, url, body, requests, output_type):
+        self.url = urlparse.urlparse(url)
+        self.body = body
+        self.remaining = requests
+        self.output_type = output_type
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.rejected = 0
+        self.errors = 0
+        self.response_bytes = 0
+
+    def take(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def client(self):
+        conn = None
+        while self.take():
+            start = time.time()
+            while True:
+                if conn is None:
+                    conn = httplib.HTTPConnection(self.url.hostname, self.url.port)
+                try:
+                    conn.request('POST', '/convert?format={0}'.format(self.output_type), self.body,
+                                 {'Content-Type': 'application/xml'})
+                    response = conn.getresponse()
+                    data = response.read()
+                except (socket.error, httplib.HTTPException):
+                    conn.close()
+                    conn = None
+                    with self.lock:
+                        self.errors += 1
+                    break
+                if response.getheader('connection', '').lower() == 'close':
+                    conn.close()
+                    conn = None
+                if response.status == 503:
+                    with self.lock:
+                        self.rejected += 1
+                    time.sleep(float(response.getheader('retry-after', '1')))
+                    continue
+                with self.lock:
+                    if response.status == 200:
+                        self.latencies.append(time.time() - start)
+                        self.response_bytes += len(data)
+                    else:
+                        self.errors += 1
+                break
+        if conn is not None:
+            conn.close()
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def main():
+    argparser = argparse.ArgumentParser(description='Load-test the rdfify2 conversion service on localhost.')
+    argparser.add_argument('--url', default=None, help='test a running service instead of starting one')
+    argparser.add_argument('-c', '--concurrency', type=int, default=8, help='client threads')
+    argparser.add_argument('-n', '--requests', type=int, default=200, help='conversions to run')
+    argparser.add_argument('-j', '--jobs', type=int, default=None, help='service worker processes')
+    argparser.add_argument('--max-pending', type=int, default=None, help='service --max-pending')
+    argparser.add_argument('--records', type=int, default=500, help='records per document')
+    argparser.add_argument('-t', '--output-type', default='nt')
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    process = None
+    try:
+        schema_loc = corpus.writeBenchSchema(directory)
+        xml_loc = corpus.writeWideDocument(os.path.join(directory, 'doc.xml'), schema_loc, args.records)
+        with open(xml_loc) as f:
+            body = f.read()
+
+        url = args.url
+        if url is None:
+            port = freePort()
+            process = startService(port, args.jobs, args.max_pending, schema_loc)
+            url = 'http://127.0.0.1:{0}'.format(port)
+        waitForService(url, process)
+
+        test = LoadTest(url, body, args.requests, args.output_type)
+        threads = [threading.Thread(target=test.client) for i in xrange(args.concurrency)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        report = {
+            'requests': len(test.latencies),
+            'errors': test.errors,
+            'rejected_503': test.rejected,
+            'concurrency': args.concurrency,
+            'document_bytes': len(body),
+            'seconds': elapsed,
+            'requests_per_second': len(test.latencies) / elapsed,
+            'response_mib_per_second': test.response_bytes / elapsed / (1 << 20),
+            'latency_seconds': {
+                'p50': percentile(test.latencies, 0.5),
+                'p90': percentile(test.latencies, 0.9),
+                'p99': percentile(test.latencies, 0.99),
+                'max': max(test.latencies) if test.latencies else None,
+            },
+            'service': getStatus(url),
+        }
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+        if test.errors:
+            sys.exit(1)
+    finally:
+        if process is not None:
+            # the service shuts its worker pool down on SIGINT
+            process.send_signal(signal.SIGINT)
+            process.wait()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# benchmark suite: runs the converters over the synthetic corpora of
+# corpus.py and reports wall time, triples/sec and peak RSS per case, as JSON
+# so that results from different releases can be compared.
+#
+#   benchmarks/suite.py -o results.json
+#   benchmarks/suite.py -o new.json --compare results.json
+#
+# Each case runs in its own (forked) process after its input has been
+# written, so the peak RSS of one case doesn't hide in that of another; the
+# reported peak includes the interpreter and imported modules, which
+# `rss_start_kib` gives for reference.
+
+import sys
+import os
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+import rdfify2
+import xml2rdf
+import xsd2rdfs
+
+import corpus
+
+RESULTS_VERSION = 1
+
+output_namespace = 'http://example.org/out'
+
+def peakRSS():
+    # KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def benchDocument(xml_loc):
+    """xml2rdf.parseXMLDocument on a parsed document with its schemata
+       loaded; only the conversion is timed."""
+    r = lxml.etree.parse(xml_loc, lxml.etree.XMLParser(huge_tree=True)).getroot()
+    s = rdflib.Graph()
+    sdata = rdfify2.SchemaData()
+    rdfify2.loadSchemata(s, sdata, r, None)
+
+    g = rdflib.Graph()
+    start = time.time()
+    xml2rdf.parseXMLDocument(r, g, sdata, output_namespace)
+    return time.time() - start, len(g)
+
+def benchSchema(schema_loc):
+    """xsd2rdfs.parseXMLSchema on a schema and its imports."""
+    s = rdflib.Graph()
+    sdata = rdfify2.SchemaData()
+    start = time.time()
+    xsd2rdfs.parseXMLSchema(schema_loc, s, sdata)
+    return time.time() - start, len(s)
+
+def benchMain(xml_loc, output_type = 'nt'):
+    """rdfify2.main on a document, from parsing to serialized output."""
+    out = tempfile.NamedTemporaryFile(suffix='.' + output_type, delete=False)
+    out.close()
+    argv = sys.argv
+    sys.argv = ['rdfify2.py', '-n', output_namespace, '-t', output_type, '-o', out.name, xml_loc]
+    try:
+        start = time.time()
+        rdfify2.main()
+        elapsed = time.time() - start
+    finally:
+        sys.argv = argv
+
+    try:
+        if output_type == 'nt':
+            # rdflib writes one triple per line
+            with open(out.name) as f:
+                triples = sum(1 for line in f if line.strip())
+        else:
+            triples = len(rdflib.Graph().parse(out.name, format=output_type))
+    finally:
+        os.unlink(out.name)
+    return elapsed, triples
+
+TARGETS = {
+    'parseXMLDocument': benchDocument,
+    'parseXMLSchema': benchSchema,
+    'main': benchMain,
+}
+
+def runCase(target, loc, results):
+    rss_start = peakRSS()
+    elapsed, triples = TARGETS[target](loc)
+    results.put({
+        'seconds': elapsed,
+        'triples': triples,
+        'triples_per_second': triples / elapsed if elapsed else None,
+        'peak_rss_kib': peakRSS(),
+        'rss_start_kib': rss_start,
+    })
+
+def runCaseInProcess(target, loc, repeat = 1):
+    """Runs a case `repeat` times, in a fresh process each time, and keeps
+       the fastest run."""
+    best = None
+    for i in xrange(repeat):
+        result = _runCaseOnce(target, loc)
+        if result is None:
+            return None
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+def _runCaseOnce(target, loc):
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=runCase, args=(target, loc, results))
+    p.start()
+    p.join()
+    if p.exitcode != 0:
+        return None
+    return results.get()
+
+def writeCorpora(directory, scale, schemata, definitions):
+    """Writes all corpora to `directory`. Returns (case name, target,
+       location) triples."""
+    cases = []
+    for name in sorted(corpus.DOCUMENTS):
+        loc = corpus.writeDocumentCorpus(directory, name, scale)
+        cases.append((name, 'parseXMLDocument', loc))
+        cases.append((name, 'main', loc))
+    loc = corpus.writeImportingSchema(directory, max(1, int(schemata * scale)), definitions)
+    cases.append(('imports', 'parseXMLSchema', loc))
+    return cases
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w'),
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def caseKey(result):
+    return '{0}/{1}'.format(result['corpus'], result['target'])
+
+def compareResults(results, baseline, tolerance):
+    """Prints the change in wall time against `baseline` per case. Returns
+       the number of cases that got slower by more than `tolerance`."""
+    old = dict((caseKey(r), r) for r in baseline['results'])
+    regressions = 0
+    for r in results:
+        o = old.get(caseKey(r))
+        if o is None or not r.get('seconds') or not o.get('seconds'):
+            continue
+        change = r['seconds'] / o['seconds'] - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        sys.stderr.write('{0:<30} {1:>+8.1%} time {2:>+8.1%} peak RSS{3}\n'.format(
+            caseKey(r), change, float(r['peak_rss_kib']) / o['peak_rss_kib'] - 1, flag))
+    return regressions
+
+def main():
+    argparser = argparse.ArgumentParser(description='Run the rdfify benchmark suite.')
+    argparser.add_argument('-o', '--outfile', default=None, help='write the JSON results here (default: stdout)')
+    argparser.add_argument('--scale', type=float, default=1.0, help='scale the corpus sizes by this factor')
+    argparser.add_argument('--schemata', type=int, default=50, help='number of schemata in the multi-import set')
+    argparser.add_argument('--definitions', type=int, default=40, help='definitions of each kind per schema')
+    argparser.add_argument('-r', '--repeat', type=int, default=1, help='run each case this many times and keep the fastest')
+    argparser.add_argument('--only', action='append', default=None, metavar='CORPUS',
+                           help='run only the cases on this corpus (repeatable)')
+    argparser.add_argument('--compare', default=None, metavar='FILE',
+                           help='compare against earlier results; exits non-zero on regressions')
+    argparser.add_argument('--tolerance', type=float, default=0.1,
+                           help='slowdown counted as a regression by --compare (default: 0.1)')
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        cases = writeCorpora(directory, args.scale, args.schemata, args.definitions)
+
+        results = []
+        for name, target, loc in cases:
+            if args.only and name not in args.only:
+                continue
+            sys.stderr.write('{0:<30} '.format('{0}/{1}'.format(name, target)))
+            result = runCaseInProcess(target, loc, args.repeat)
+            if result is None:
+                sys.stderr.write('FAILED\n')
+                result = {'failed': True}
+            else:
+                sys.stderr.write('{0:>8.3f} s {1:>10} triples {2:>10.0f} triples/s {3:>8} KiB\n'.format(
+                    result['seconds'], result['triples'], result['triples_per_second'] or 0, result['peak_rss_kib']))
+            result.update({'corpus': name, 'target': target, 'input_bytes': os.path.getsize(loc)})
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'lxml': lxml.etree.__version__,
+        'rdflib': rdflib.__version__,
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    out = open(args.outfile, 'w') if args.outfile else sys.stdout
+    try:
+        json.dump(report, out, indent=2, sort_keys=True)
+        out.write('\n')
+    finally:
+        if args.outfile:
+            out.close()
+
+    failed = sum(1 for r in results if r.get('failed'))
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compareResults(results, json.load(f), args.tolerance)
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# blank node allocation for xml2rdf.
+#
+# Every element that needs a node but has no ID gets a blank node from the
+# ConversionPlan's allocator, as allocator.node(parentNode, index), where
+# index is the element's position among its parent's child elements.
+#
+#   uuid     rdflib.BNode(): random labels, different on every run
+#   counter  labels numbered in allocation order; cheap, and the same on
+#            every run over the same document
+#   path     labels hashed from the parent node and the element's index, so
+#            they only depend on the element's place in the document, not on
+#            the order of conversion
+#
+# Batch mode calls startDocument for each document, so that documents merged
+# into one output can't share labels; subtree-parallel conversion calls
+# startChunk in each task, so that workers numbering from the same point
+# don't either.
+
+import hashlib
+
+import rdflib
+
+def scopeHash(name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return hashlib.sha1(name).hexdigest()[:8]
+
+class UUIDAllocator:
+    """rdflib's default blank nodes."""
+
+    def startDocument(self, name):
+        pass
+
+    def startChunk(self, index):
+        pass
+
+    def node(self, parentNode, index):
+        return rdflib.BNode()
+
+class CounterAllocator:
+    """Blank nodes numbered in allocation order: b1, b2, ..."""
+
+    def __init__(self):
+        self.scope = ''
+        self.prefix = 'b'
+        self.count = 0
+
+    def startDocument(self, name):
+        self.scope = 'd' + scopeHash(name)
+        self.prefix = self.scope + 'b'
+        self.count = 0
+
+    def startChunk(self, index):
+        # labels must stay [A-Za-z][A-Za-z0-9]* for N-Triples
+        self.prefix = '{0}c{1}x'.format(self.scope, index)
+        self.count = 0
+
+    def node(self, parentNode, index):
+        self.count += 1
+        return rdflib.BNode(self.prefix + str(self.count))
+
+class PathAllocator:
+    """Blank nodes labelled with a hash of their parent node's label and
+       their index under it."""
+
+    def __init__(self):
+        self.scope = ''
+
+    def startDocument(self, name):
+        self.scope = scopeHash(name)
+
+    def startChunk(self, index):
+        pass
+
+    def node(self, parentNode, index):
+        key = u'{0}\0{1}\0{2}'.format(self.scope, parentNode, index)
+        return rdflib.BNode('p' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:24])
+
+ALLOCATORS = {
+    'uuid': UUIDAllocator,
+    'counter': CounterAllocator,
+    'path': PathAllocator,
+}
+
+def makeAllocator(name):
+    return ALLOCATORS[name]()
@@ -0,0 +1,114 @@
+# local resolution of schema locations, after OASIS XML catalogs.
+#
+# A catalog maps schema URLs (and namespaces) to local files, so that schema
+# loading never has to go to the network. The supported catalog entries are
+#
+#   <uri name="..." uri="..."/>            exact URL or namespace
+#   <system systemId="..." uri="..."/>     exact URL
+#   <rewriteURI uriStartString="..." rewritePrefix="..."/>
+#   <rewriteSystem systemIdStartString="..." rewritePrefix="..."/>
+#   <nextCatalog catalog="..."/>
+#
+# Relative uri, rewritePrefix and catalog attributes are taken relative to
+# the catalog file.
+
+import os
+import hashlib
+import urlparse
+
+import lxml.etree
+
+ns_catalog = 'urn:oasis:names:tc:entity:xmlns:xml:catalog'
+
+def isRemoteLocation(loc):
+    return '://' in loc and not loc.startswith('file://')
+
+class SchemaCatalog:
+    """Resolves schema locations through catalog entries.
+
+       With `offline` set, resolving a remote location that has no catalog
+       entry raises an IOError instead of letting the location through."""
+
+    def __init__(self, offline = True):
+        self.offline = offline
+        self.entries = {}
+        self.rewrites = []
+        self.catalogsLoaded = set()
+        # (path, content hash) of the catalog files, in load order
+        self.catalogFiles = []
+
+    def load(self, catalog_loc):
+        """Adds the entries of the catalog file at `catalog_loc`."""
+        catalog_loc = os.path.abspath(catalog_loc)
+        if catalog_loc in self.catalogsLoaded:
+            return
+        self.catalogsLoaded.add(catalog_loc)
+
+        def local(path):
+            return urlparse.urljoin(catalog_loc, path)
+
+        with open(catalog_loc, 'rb') as f:
+            data = f.read()
+        self.catalogFiles.append((catalog_loc, hashlib.sha1(data).hexdigest()))
+        r = lxml.etree.fromstring(data, base_url=catalog_loc)
+        for e in r.iter():
+            if not isinstance(e.tag, basestring):
+                continue
+            tag = lxml.etree.QName(e).localname
+            if tag == 'uri':
+                self.entries[e.get('name')] = local(e.get('uri'))
+            elif tag == 'system':
+                self.entries[e.get('systemId')] = local(e.get('uri'))
+            elif tag == 'rewriteURI':
+                self.addRewrite(e.get('uriStartString'), local(e.get('rewritePrefix')))
+            elif tag == 'rewriteSystem':
+                self.addRewrite(e.get('systemIdStartString'), local(e.get('rewritePrefix')))
+            elif tag == 'nextCatalog':
+                self.load(local(e.get('catalog')))
+
+    def identity(self):
+        """Returns a hash of the catalog files (their locations, content and
+           load order) and the offline setting, which together determine
+           how locations resolve."""
+        h = hashlib.sha1('offline' if self.offline else 'online')
+        for loc, digest in self.catalogFiles:
+            h.update('\0' + loc.encode('utf-8') + '\0' + digest)
+        return h.hexdigest()
+
+    def addRewrite(self, prefix, replacement):
+        self.rewrites.append((prefix, replacement))
+        # longest prefix wins
+        self.rewrites.sort(key=lambda rewrite: -len(rewrite[0]))
+
+    def lookup(self, loc, namespace = None):
+        """Returns the location that a catalog entry maps the schema at `loc`
+           (imported for `namespace`, if known) to, or None if no entry
+           does."""
+        if loc:
+            if loc in self.entries:
+                return self.entries[loc]
+            for prefix, replacement in self.rewrites:
+                if loc.startswith(prefix):
+                    return replacement + loc[len(prefix):]
+        if namespace and namespace in self.entries:
+            return self.entries[namespace]
+        return None
+
+    def resolve(self, loc, namespace = None):
+        """Returns the local location for the schema at `loc`, which is
+           imported for `namespace` (if known). `loc` may be None for
+           imports that only name a namespace; these resolve to None unless
+           the catalog knows the namespace."""
+        mapped = self.lookup(loc, namespace)
+        if mapped is not None:
+            return mapped
+        if loc and self.offline and isRemoteLocation(loc):
+            raise IOError('no catalog entry for schema {0} (namespace {1})'.format(loc, namespace))
+        return loc
+
+def loadCatalogs(catalog_locs, offline = True):
+    """Builds a SchemaCatalog from the given catalog files."""
+    catalog = SchemaCatalog(offline)
+    for loc in catalog_locs:
+        catalog.load(loc)
+    return catalog
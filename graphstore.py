@@ -0,0 +1,222 @@
+# disk-backed rdflib graphs, for documents whose graph doesn't fit in memory.
+#
+# rdflib's own persistent store (Sleepycat) needs the bsddb module, which
+# many Python builds lack; sqlite3 is always there, so SQLiteStore below keeps
+# a graph in a SQLite database file instead. Terms are numbered in a `terms`
+# table and triples are rows of three term numbers, so memory use is bounded
+# by SQLite's page cache and the term number cache.
+#
+# SQLiteStore is not context- or formula-aware; every graph opened on a
+# database file sees all of its triples. Changes are made in one transaction
+# per commit, so commit (or close the graph with commit_pending_transaction)
+# to keep them.
+
+import sqlite3
+
+import rdflib
+from rdflib.store import Store, VALID_STORE, NO_STORE
+
+import termcache
+import triplebuffer
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    datatype TEXT NOT NULL,
+    language TEXT NOT NULL,
+    UNIQUE (kind, value, datatype, language)
+);
+CREATE TABLE IF NOT EXISTS triples (
+    s INTEGER NOT NULL,
+    p INTEGER NOT NULL,
+    o INTEGER NOT NULL,
+    PRIMARY KEY (s, p, o)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS triples_po ON triples (p, o);
+CREATE INDEX IF NOT EXISTS triples_os ON triples (o, s);
+CREATE TABLE IF NOT EXISTS namespaces (
+    prefix TEXT PRIMARY KEY,
+    uri TEXT NOT NULL
+);
+'''
+
+def termKey(term):
+    """Returns the (kind, value, datatype, language) row for an rdflib term."""
+    if isinstance(term, rdflib.Literal):
+        return ('L', unicode(term), unicode(term.datatype or u''), unicode(term.language or u''))
+    elif isinstance(term, rdflib.BNode):
+        return ('B', unicode(term), u'', u'')
+    elif isinstance(term, rdflib.URIRef):
+        return ('U', unicode(term), u'', u'')
+    raise TypeError('cannot store term {0!r}'.format(term))
+
+def termFromRow(kind, value, datatype, language):
+    if kind == 'U':
+        return rdflib.URIRef(value)
+    elif kind == 'B':
+        return rdflib.BNode(value)
+    return rdflib.Literal(value, lang=language or None, datatype=datatype or None)
+
+class SQLiteStore(Store):
+    """rdflib store in a SQLite database; `configuration` is the database
+       file name."""
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = False
+
+    def __init__(self, configuration = None, identifier = None):
+        self.db = None
+        self.identifier = identifier
+        Store.__init__(self, configuration)
+
+    def open(self, configuration, create = False):
+        db = sqlite3.connect(configuration)
+        exists = db.execute("SELECT name FROM sqlite_master WHERE name = 'triples'").fetchone()
+        if not exists and not create:
+            db.close()
+            return NO_STORE
+
+        self.db = db
+        # a crash can lose the last transaction, but not corrupt the file
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+
+        self.termIds = termcache.TermCache(self._termId)
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction = False):
+        if self.db is None:
+            return
+        if commit_pending_transaction:
+            self.db.commit()
+        self.db.close()
+        self.db = None
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+        # numbers handed out in the transaction are gone
+        self.termIds.clear()
+
+    def _termId(self, key):
+        """Returns the number of the term with the given key, adding the
+           term if needed."""
+        row = self.db.execute('SELECT id FROM terms WHERE kind = ? AND value = ? AND datatype = ? AND language = ?', key).fetchone()
+        if row is not None:
+            return row[0]
+        return self.db.execute('INSERT INTO terms (kind, value, datatype, language) VALUES (?, ?, ?, ?)', key).lastrowid
+
+    def _lookupTermId(self, key):
+        """Returns the number of the term with the given key, or None."""
+        row = self.db.execute('SELECT id FROM terms WHERE kind = ? AND value = ? AND datatype = ? AND language = ?', key).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def add(self, triple, context, quoted = False):
+        Store.add(self, triple, context, quoted)
+        s, p, o = triple
+        termIds = self.termIds
+        self.db.execute('INSERT OR IGNORE INTO triples (s, p, o) VALUES (?, ?, ?)',
+                        (termIds(termKey(s)), termIds(termKey(p)), termIds(termKey(o))))
+
+    def addN(self, quads):
+        termIds = self.termIds
+        self.db.executemany('INSERT OR IGNORE INTO triples (s, p, o) VALUES (?, ?, ?)',
+                            ((termIds(termKey(s)), termIds(termKey(p)), termIds(termKey(o))) for s, p, o, c in quads))
+
+    def _pattern(self, triple):
+        """Returns the WHERE clause and parameters matching a triple pattern,
+           or None if a bound term is not in the store at all."""
+        clauses = []
+        params = []
+        for column, term in zip(('s', 'p', 'o'), triple):
+            if term is None:
+                continue
+            term_id = self._lookupTermId(termKey(term))
+            if term_id is None:
+                return None
+            clauses.append('t.{0} = ?'.format(column))
+            params.append(term_id)
+        if not clauses:
+            return '', params
+        return ' WHERE ' + ' AND '.join(clauses), params
+
+    def remove(self, triple, context = None):
+        Store.remove(self, triple, context)
+        pattern = self._pattern(triple)
+        if pattern is None:
+            return
+        where, params = pattern
+        self.db.execute('DELETE FROM triples' + where.replace('t.', ''), params)
+
+    def triples(self, triple, context = None):
+        pattern = self._pattern(triple)
+        if pattern is None:
+            return
+        where, params = pattern
+        cursor = self.db.execute(
+            'SELECT s.kind, s.value, s.datatype, s.language, '
+            'p.kind, p.value, p.datatype, p.language, '
+            'o.kind, o.value, o.datatype, o.language '
+            'FROM triples t JOIN terms s ON s.id = t.s JOIN terms p ON p.id = t.p JOIN terms o ON o.id = t.o'
+            + where, params)
+        for row in cursor:
+            yield (termFromRow(*row[0:4]), termFromRow(*row[4:8]), termFromRow(*row[8:12])), iter(())
+
+    def __len__(self, context = None):
+        return self.db.execute('SELECT COUNT(*) FROM triples').fetchone()[0]
+
+    def contexts(self, triple = None):
+        return iter(())
+
+    def bind(self, prefix, namespace):
+        self.db.execute('INSERT OR REPLACE INTO namespaces (prefix, uri) VALUES (?, ?)', (prefix, unicode(namespace)))
+
+    def namespace(self, prefix):
+        row = self.db.execute('SELECT uri FROM namespaces WHERE prefix = ?', (prefix,)).fetchone()
+        if row is None:
+            return None
+        return rdflib.URIRef(row[0])
+
+    def prefix(self, namespace):
+        row = self.db.execute('SELECT prefix FROM namespaces WHERE uri = ?', (unicode(namespace),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def namespaces(self):
+        for prefix, uri in self.db.execute('SELECT prefix, uri FROM namespaces').fetchall():
+            yield prefix, rdflib.URIRef(uri)
+
+rdflib.plugin.register('SQLite', Store, 'graphstore', 'SQLiteStore')
+
+# store names accepted by openGraph
+STORES = ('memory', 'compact', 'sqlite', 'sleepycat')
+
+def openGraph(store = 'memory', path = None):
+    """Returns an rdflib.Graph in the named store. Disk-backed stores are
+       kept at `path`; if it holds a graph already, the graph is opened for
+       adding to. The compact store is a triplebuffer.TripleBuffer, which
+       only takes triples to be written out."""
+    if store == 'memory':
+        return rdflib.Graph()
+    if store == 'compact':
+        return triplebuffer.TripleBuffer()
+    if not path:
+        raise ValueError('the {0} store needs a path'.format(store))
+    g = rdflib.Graph({'sqlite': 'SQLite', 'sleepycat': 'Sleepycat'}[store])
+    g.open(path, create=True)
+    return g
+
+def closeGraph(g):
+    """Commits and closes a graph returned by openGraph."""
+    g.commit()
+    g.close(commit_pending_transaction=True)
@@ -0,0 +1,103 @@
+# per-phase timers and counters, for finding out where a conversion spends
+# its time.
+#
+# Instrumentation is off until `enable` is called. While it is off, `phase`
+# hands out a shared do-nothing context manager and the counting hooks in the
+# converters come down to testing `instrumentation.active` for None.
+#
+# Phases nest by name: 'schema' covers 'schema.parse', 'schema.reduce' etc.,
+# so the time of a phase includes that of its sub-phases.
+
+import time
+import json
+import cProfile
+
+# the Stats being collected, or None
+active = None
+
+class Stats:
+    """Phase timings and event counters of one run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = {}
+        self.counters = {}
+
+    def addTime(self, name, seconds, calls = 1):
+        try:
+            t = self.phases[name]
+        except KeyError:
+            t = self.phases[name] = [0.0, 0]
+        t[0] += seconds
+        t[1] += calls
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, report):
+        """Adds the phases and counters of another run's `report` (e.g. from
+           a batch worker) to these."""
+        for name, t in report['phases'].iteritems():
+            self.addTime(name, t['seconds'], t['calls'])
+        for name, n in report['counters'].iteritems():
+            self.count(name, n)
+
+    def report(self):
+        return {
+            'wall_seconds': time.time() - self.started,
+            'phases': dict((name, {'seconds': t[0], 'calls': t[1]}) for name, t in self.phases.iteritems()),
+            'counters': dict(self.counters),
+        }
+
+class _Phase:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.stats.addTime(self.name, time.time() - self.start)
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_noPhase = _NoPhase()
+
+def enable():
+    """Starts collecting a fresh Stats, and returns it."""
+    global active
+    active = Stats()
+    return active
+
+def disable():
+    global active
+    active = None
+
+def phase(name):
+    """Returns a context manager that times the named phase."""
+    if active is None:
+        return _noPhase
+    return _Phase(active, name)
+
+def count(name, n = 1):
+    if active is not None:
+        active.count(name, n)
+
+def writeReport(report, out):
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write('\n')
+
+def profile(function, path, *args, **kwargs):
+    """Runs `function` under cProfile and writes the profile (in pstats
+       format) to `path`. Returns what `function` returns."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
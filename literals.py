@@ -0,0 +1,141 @@
+# typed literals for leaf element text and attribute values.
+#
+# The schema's element and attribute maps, with the simple type map reduced
+# to XML Schema built-in datatypes (xsd2rdfs.reduceSimpleTypeMap), say which
+# datatype each value has. A ConversionPlan asks `literalConverter` once per
+# element or attribute name for the function that makes its literals:
+#
+#   plain     rdflib.Literal(text), no datatype (as before)
+#   lexical   the text with the datatype attached, skipping rdflib's
+#             conversion of each value to a Python object
+#   validate  the text is checked against the datatype's lexical space (by
+#             pattern; ranges only for the integer types) and made into an
+#             rdflib.Literal with the datatype, which converts and may
+#             normalize it. Invalid values become plain literals and are
+#             counted as 'literals.invalid'.
+#
+# xsd:string values stay plain literals in every mode, and other values have
+# leading and trailing whitespace removed, as the datatypes' whiteSpace facet
+# says.
+
+import re
+
+import rdflib
+
+import instrumentation
+from builtin_types import builtInDatatypeNames
+
+MODES = ('plain', 'lexical', 'validate')
+
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+
+# datatypes whose values keep their surrounding whitespace
+_preservedTypes = (XSD + 'string', XSD + 'normalizedString')
+
+_tz = r'(Z|[+-][0-9]{2}:[0-9]{2})?'
+_ncname = r'[^\W\d][\w.-]*'
+_nmtoken = r'[\w.:-]+'
+
+_patterns = {
+    'boolean': r'true|false|1|0',
+    'decimal': r'[+-]?([0-9]+(\.[0-9]*)?|\.[0-9]+)',
+    'float': r'[+-]?([0-9]+(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]+)?|[+-]?INF|NaN',
+    'double': r'[+-]?([0-9]+(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]+)?|[+-]?INF|NaN',
+    'duration': r'-?P(?=.)([0-9]+Y)?([0-9]+M)?([0-9]+D)?(T(?=[0-9])([0-9]+H)?([0-9]+M)?([0-9]+(\.[0-9]+)?S)?)?',
+    'dateTime': r'-?[0-9]{4,}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?' + _tz,
+    'date': r'-?[0-9]{4,}-[0-9]{2}-[0-9]{2}' + _tz,
+    'time': r'[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?' + _tz,
+    'gYearMonth': r'-?[0-9]{4,}-[0-9]{2}' + _tz,
+    'gYear': r'-?[0-9]{4,}' + _tz,
+    'gMonthDay': r'--[0-9]{2}-[0-9]{2}' + _tz,
+    'gDay': r'---[0-9]{2}' + _tz,
+    'gMonth': r'--[0-9]{2}' + _tz,
+    'hexBinary': r'([0-9a-fA-F]{2})*',
+    'base64Binary': r'[A-Za-z0-9+/ ]*=?=?',
+    'language': r'[a-zA-Z]{1,8}(-[a-zA-Z0-9]{1,8})*',
+    'Name': r'[^\W\d][\w.:-]*',
+    'NCName': _ncname,
+    'ID': _ncname,
+    'IDREF': _ncname,
+    'ENTITY': _ncname,
+    'QName': '({0}:)?{0}'.format(_ncname),
+    'NOTATION': '({0}:)?{0}'.format(_ncname),
+    'NMTOKEN': _nmtoken,
+    'NMTOKENS': '{0}( {0})*'.format(_nmtoken),
+    'IDREFS': '{0}( {0})*'.format(_ncname),
+    'ENTITIES': '{0}( {0})*'.format(_ncname),
+}
+
+# (lowest, highest) values of the integer types; None for no bound
+_integerRanges = {
+    'integer': (None, None),
+    'nonPositiveInteger': (None, 0),
+    'negativeInteger': (None, -1),
+    'long': (-2 ** 63, 2 ** 63 - 1),
+    'int': (-2 ** 31, 2 ** 31 - 1),
+    'nonNegativeInteger': (0, None),
+    'positiveInteger': (1, None),
+    'unsignedLong': (0, 2 ** 64 - 1),
+    'unsignedInt': (0, 2 ** 32 - 1),
+    'unsignedShort': (0, 2 ** 16 - 1),
+    'unsignedByte': (0, 2 ** 8 - 1),
+}
+
+_integer = re.compile(r'[+-]?[0-9]+\Z')
+
+def lexicalValidator(type_name):
+    """Returns a function telling whether a (whitespace-stripped) value is in
+       the lexical space of the built-in datatype `type_name` ({ns}name)."""
+    name = type_name[len(XSD):]
+    if name in _integerRanges:
+        lowest, highest = _integerRanges[name]
+        def valid(text):
+            if not _integer.match(text):
+                return False
+            value = int(text)
+            return (lowest is None or value >= lowest) and (highest is None or value <= highest)
+        return valid
+    if name in _patterns:
+        return re.compile('(' + _patterns[name] + r')\Z', re.UNICODE).match
+    # anyURI, token etc.: anything goes
+    return lambda text: True
+
+def lexicalLiteral(text, datatype):
+    """Makes the Literal `text`^^`datatype` like rdflib.Literal would, but
+       without converting the value to a Python object (`value` is None)."""
+    literal = unicode.__new__(rdflib.Literal, text)
+    literal._language = None
+    literal._datatype = datatype
+    literal._value = None
+    return literal
+
+def literalConverter(type_name, mode, datatype = None):
+    """Returns the function that makes the literal for a value of type
+       `type_name` ({ns}name, a built-in datatype or None for unknown) in
+       `mode`. `datatype` is the type's URIRef, if already at hand."""
+    if mode == 'plain' or type_name not in builtInDatatypeNames or type_name == XSD + 'string':
+        return rdflib.Literal
+
+    if datatype is None:
+        datatype = rdflib.URIRef(type_name[1:].replace('}', '#'))
+    strip = type_name not in _preservedTypes
+
+    if mode == 'lexical':
+        if strip:
+            return lambda text: lexicalLiteral(text.strip(), datatype)
+        return lambda text: lexicalLiteral(text, datatype)
+
+    if mode != 'validate':
+        raise ValueError('unknown literal mode {0}'.format(mode))
+
+    valid = lexicalValidator(type_name)
+    def convert(text):
+        if strip:
+            text = text.strip()
+        if valid(text):
+            return rdflib.Literal(text, datatype=datatype)
+        stats = instrumentation.active
+        if stats is not None:
+            stats.count('literals.invalid')
+        return rdflib.Literal(text)
+    return convert
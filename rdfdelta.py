@@ -0,0 +1,377 @@
+# incremental conversion between two versions of a document.
+#
+#   rdfdelta.py -w today.idx --index yesterday.idx today.xml > today.patch
+#
+# The units of a document are the root element (its own triples) and the
+# subtrees under it. Each unit is keyed on a hash of its XML (and of the
+# schema and output namespace it is converted with), so a unit that didn't
+# change between versions has the same key in both and needn't be converted
+# again. Blank nodes are labelled with bnodes.PathAllocator below the unit
+# key instead of the unit's position, so units keep their triples when
+# siblings are inserted or removed before them.
+#
+# A fingerprint index (a SQLite file) holds the keys and N-Triples of every
+# unit of one version: the triples of units that went away are read from it,
+# and only the units of the new version that aren't in it are converted.
+# Triples without blank nodes can be stated by several units, so the index
+# also maps hashes of these to the units stating them; such a triple is only
+# removed when none of its units are left.
+# Given the old XML instead, its index is built in a temporary file first,
+# which converts the whole old version.
+#
+# The delta is written as RDF Patch rows (D/A) or as a SPARQL Update. SPARQL
+# can't delete blank nodes, so the SPARQL form writes them as skolem IRIs.
+# Schema triples are not part of the delta.
+
+import os
+import re
+import sys
+import zlib
+import sqlite3
+import hashlib
+import tempfile
+import argparse
+import urlparse
+
+import lxml.etree
+import rdflib
+
+import xml2rdf
+import sinks
+import bnodes
+import catalog
+import rdfify2
+
+INDEX_VERSION = 1
+
+ROOT_KEY = 'root'
+
+def schemaFingerprint(sdata, output_namespace):
+    """Hashes what the conversion of a unit depends on besides its XML."""
+    h = hashlib.sha1()
+    h.update('{0}\0{1}\0'.format(INDEX_VERSION, output_namespace.encode('utf-8')))
+    for name, t in sorted(sdata.elementMap.iteritems()):
+        h.update(u'e\0{0}\0{1}\0'.format(name, t).encode('utf-8'))
+    for name, t in sorted(sdata.attributeMap.iteritems()):
+        h.update(u'a\0{0}\0{1}\0'.format(name, t).encode('utf-8'))
+    return h.hexdigest()
+
+def iterUnits(xmlfile, fingerprint):
+    """Parses `xmlfile` incrementally, yielding the (key, element) pair of
+       each unit: the root element first (with its attributes but not its
+       content), then each of its child elements once complete. Elements are
+       discarded after they have been yielded."""
+    depth = 0
+    occurrences = {}
+    for event, elem in lxml.etree.iterparse(xmlfile, events=('start', 'end')):
+        if event == 'start':
+            if depth == 0:
+                h = hashlib.sha1(fingerprint)
+                h.update(u'{0}'.format(elem.tag).encode('utf-8'))
+                for k, v in xml2rdf.sortedItems(elem):
+                    h.update(u'\0{0}\0{1}'.format(k, v).encode('utf-8'))
+                yield '{0}.{1}'.format(ROOT_KEY, h.hexdigest()), elem
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        h = hashlib.sha1(fingerprint)
+        h.update(lxml.etree.tostring(elem, with_tail=False))
+        digest = h.hexdigest()
+        # identical siblings are told apart by their order among themselves
+        n = occurrences.get(digest, 0)
+        occurrences[digest] = n + 1
+        yield '{0}.{1}'.format(digest, n), elem
+
+        # as in xml2rdf.parseXMLStream
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+class _Lines(list):
+    write = list.append
+
+def lineHash(line):
+    # 60 bits, to fit a SQLite integer
+    return int(hashlib.sha1(line).hexdigest()[:15], 16)
+
+def convertUnit(key, elem, plan):
+    """Converts one unit. Returns the list of its N-Triples lines, and the
+       list of those without blank nodes, which another unit may state too."""
+    triples = sinks.ListSink()
+    if key.startswith(ROOT_KEY):
+        xml2rdf.processTag(elem.tag, None, xml2rdf.sortedItems(elem), True, triples, None, plan)
+    else:
+        xml2rdf.processNode(elem, triples, plan.root_node, plan.schema_data, plan.target_namespace, plan, key)
+
+    lines = _Lines()
+    sink = sinks.NTriplesSink(lines)
+    shared = []
+    for triple in triples.triples:
+        sink.add(triple)
+        if not isinstance(triple[0], rdflib.BNode) and not isinstance(triple[2], rdflib.BNode):
+            shared.append(lines[-1])
+    return lines, shared
+
+class FingerprintIndex:
+    """A stored fingerprint index, see the top of this file."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise IOError('no fingerprint index at {0}'.format(path))
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        version = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if version is None or int(version[0]) != INDEX_VERSION:
+            raise ValueError('{0} is not a version {1} fingerprint index'.format(path, INDEX_VERSION))
+
+    def keys(self):
+        return set(key for key, in self.db.execute('SELECT key FROM units'))
+
+    def triples(self, key):
+        row = self.db.execute('SELECT triples FROM units WHERE key = ?', (key,)).fetchone()
+        return zlib.decompress(row[0]).splitlines(True)
+
+    def statingUnits(self, line):
+        """Returns the keys of the units that produce the blank-node-free
+           N-Triples `line`."""
+        return [key for key, in self.db.execute('SELECT key FROM shared JOIN units ON units.id = shared.unit '
+                                                'WHERE line_hash = ?', (lineHash(line),))]
+
+    def close(self):
+        self.db.close()
+
+class IndexWriter:
+    """Writes the fingerprint index of a new version to `path`. Units that
+       didn't change are copied from the old index when the writer is
+       closed; the file only replaces `path` then."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+        self.db = sqlite3.connect(self.tmp_path)
+        self.db.text_factory = str
+        self.db.executescript('''
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE units (id INTEGER PRIMARY KEY, key TEXT UNIQUE, triples BLOB);
+            CREATE TABLE shared (line_hash INTEGER, unit INTEGER);
+            CREATE TEMP TABLE kept (key TEXT PRIMARY KEY);
+        ''')
+        self.db.executemany('INSERT INTO meta VALUES (?, ?)', [('version', str(INDEX_VERSION)),
+                                                              ('source', source)])
+
+    def add(self, key, lines, shared):
+        unit = self.db.execute('INSERT INTO units (key, triples) VALUES (?, ?)',
+                               (key, sqlite3.Binary(zlib.compress(''.join(lines))))).lastrowid
+        self.db.executemany('INSERT INTO shared VALUES (?, ?)', ((h, unit) for h in set(lineHash(line) for line in shared)))
+
+    def close(self, old = None, kept = ()):
+        """Copies the units with keys in `kept` from the FingerprintIndex
+           `old`, and moves the index into place."""
+        if old is not None:
+            self.db.executemany('INSERT INTO kept VALUES (?)', ((key,) for key in kept))
+            self.db.execute('ATTACH DATABASE ? AS old', (old.path,))
+            self.db.execute('INSERT INTO units (key, triples) SELECT key, triples FROM old.units JOIN kept USING (key)')
+            self.db.execute('INSERT INTO shared SELECT line_hash, units.id FROM old.shared '
+                            'JOIN old.units AS o ON o.id = old.shared.unit JOIN units ON units.key = o.key')
+            self.db.commit()
+            self.db.execute('DETACH DATABASE old')
+        self.db.execute('CREATE INDEX shared_line ON shared (line_hash)')
+        self.db.commit()
+        self.db.close()
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        self.db.close()
+        os.unlink(self.tmp_path)
+
+def deltaConvert(xmlfile, old, patch, extra_schemata, output_namespace, schema_loader = None, index_path = None):
+    """Converts the units of `xmlfile` that are not in the FingerprintIndex
+       `old`, and writes the removed and added triples to `patch` (a
+       PatchWriter, or None), sorted. The new version's index is written to
+       `index_path` if given.
+
+       Without `old`, every unit is converted and its triples are written
+       to `patch` as they come; a triple stated by several units is then
+       added more than once. Returns the number of units converted."""
+    s = rdflib.Graph()
+    sdata = rdfify2.SchemaData()
+    rdfify2.loadSchemata(s, sdata, rdfify2.peekRootElement(xmlfile), extra_schemata, schema_loader)
+    plan = xml2rdf.ConversionPlan(sdata, output_namespace, bnodes.PathAllocator())
+    fingerprint = schemaFingerprint(sdata, output_namespace)
+
+    writer = IndexWriter(index_path, xmlfile) if index_path else None
+    old_keys = old.keys() if old is not None else set()
+    new_keys = set()
+    added = set()
+    removed = set()
+    converted = 0
+    try:
+        for key, elem in iterUnits(xmlfile, fingerprint):
+            if old is not None:
+                new_keys.add(key)
+                if key in old_keys:
+                    continue
+            lines, shared = convertUnit(key, elem, plan)
+            converted += 1
+            if writer:
+                writer.add(key, lines, shared)
+            if old is not None:
+                added.update(lines)
+            elif patch is not None:
+                for line in set(lines):
+                    patch.add(line)
+
+        for key in old_keys - new_keys:
+            removed.update(old.triples(key))
+    except:
+        if writer:
+            writer.abort()
+        raise
+    if writer:
+        writer.close(old, old_keys & new_keys)
+
+    # triples in both sets don't change, nor do those (without blank nodes)
+    # that a unit still there states too
+    unchanged = removed & added
+    for line in (removed | added) - unchanged:
+        if any(key in new_keys for key in old.statingUnits(line)):
+            unchanged.add(line)
+
+    if patch is not None:
+        for line in sorted(removed - unchanged):
+            patch.remove(line)
+        for line in sorted(added - unchanged):
+            patch.add(line)
+    return converted
+
+class PatchWriter:
+    """Writes a delta as RDF Patch rows: D for each removed triple, A for
+       each added one."""
+
+    def __init__(self, out):
+        self.out = out
+        self.removed = 0
+        self.added = 0
+
+    def remove(self, line):
+        self.removed += 1
+        self.out.write('D ' + line)
+
+    def add(self, line):
+        self.added += 1
+        self.out.write('A ' + line)
+
+    def close(self):
+        pass
+
+# blank nodes in the lines of convertUnit; a line can only end in a blank
+# node object, as newlines in literals are escaped
+subjectBNode = re.compile(r'^_:([A-Za-z0-9]+) ')
+objectBNode = re.compile(r' _:([A-Za-z0-9]+) \.\n$')
+
+def skolemizeLine(line, authority):
+    """Returns N-Triples `line` with its blank nodes as skolem IRIs."""
+    def skolem(m):
+        return m.group(0).replace('_:' + m.group(1), '<{0}>'.format(rdflib.BNode(m.group(1)).skolemize(authority)))
+    return objectBNode.sub(skolem, subjectBNode.sub(skolem, line))
+
+class SparqlUpdateWriter(PatchWriter):
+    """Writes a delta as a SPARQL 1.1 Update (DELETE DATA, then INSERT
+       DATA), with blank nodes skolemized under `authority`."""
+
+    def __init__(self, out, authority):
+        PatchWriter.__init__(self, out)
+        self.authority = authority
+        self.operation = None
+
+    def startOperation(self, operation):
+        if self.operation != operation:
+            if self.operation:
+                self.out.write('} ;\n')
+            self.out.write(operation + ' {\n')
+            self.operation = operation
+
+    def remove(self, line):
+        self.removed += 1
+        self.startOperation('DELETE DATA')
+        self.out.write('  ' + skolemizeLine(line, self.authority))
+
+    def add(self, line):
+        self.added += 1
+        self.startOperation('INSERT DATA')
+        self.out.write('  ' + skolemizeLine(line, self.authority))
+
+    def close(self):
+        if self.operation:
+            self.out.write('}\n')
+
+def skolemAuthority(output_namespace):
+    parts = urlparse.urlparse(output_namespace)
+    if parts.scheme and parts.netloc:
+        return '{0}://{1}/'.format(parts.scheme, parts.netloc)
+    return 'http://rdlib.net/'
+
+def main():
+    argparser = argparse.ArgumentParser(description='Convert only the parts of a document that changed since an earlier version.')
+    argparser.add_argument('xmlfile')
+    argparser.add_argument('--old', default=None, metavar='XMLFILE',
+                           help='the previous version of the document')
+    argparser.add_argument('--index', default=None, metavar='FILE',
+                           help="the previous version's fingerprint index (see -w)")
+    argparser.add_argument('-w','--write-index', default=None, metavar='FILE',
+                           help="write this version's fingerprint index to FILE (may be the same as --index)")
+    argparser.add_argument('-f','--format', default='patch', choices=('patch', 'sparql'),
+                           help='RDF Patch rows (default) or a SPARQL Update')
+    argparser.add_argument('-o','--outfile', default=None)
+    argparser.add_argument('-n','--output-namespace', default="")
+    argparser.add_argument('-s','--include-schema', action='append')
+    argparser.add_argument('--schema-cache', default=None, metavar='DIR')
+    argparser.add_argument('--catalog', action='append', default=[], metavar='FILE')
+
+    args = argparser.parse_args()
+    if args.old and args.index:
+        argparser.error('use one of --old and --index')
+
+    schema_catalog = catalog.loadCatalogs(args.catalog) if args.catalog else None
+    schema_loader = rdfify2.SchemaLoader(args.schema_cache, schema_catalog)
+
+    out = open(args.outfile, 'wb') if args.outfile else sys.stdout
+    if args.format == 'sparql':
+        patch = SparqlUpdateWriter(out, skolemAuthority(args.output_namespace))
+    else:
+        patch = PatchWriter(out)
+
+    old = None
+    old_tmp = None
+    try:
+        if args.old:
+            fd, old_tmp = tempfile.mkstemp(suffix='.idx')
+            os.close(fd)
+            deltaConvert(args.old, None, None, args.include_schema, args.output_namespace, schema_loader, old_tmp)
+            old = FingerprintIndex(old_tmp)
+        elif args.index:
+            old = FingerprintIndex(args.index)
+
+        converted = deltaConvert(args.xmlfile, old, patch, args.include_schema, args.output_namespace,
+                                 schema_loader, args.write_index)
+        patch.close()
+    finally:
+        if old is not None:
+            old.close()
+        if old_tmp:
+            os.unlink(old_tmp)
+        if args.outfile:
+            out.close()
+    sys.stderr.write('{0} units converted: {1} triples removed, {2} added\n'.format(converted, patch.removed, patch.added))
+
+if __name__ == "__main__":
+    main()
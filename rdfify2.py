@@ -5,8 +5,12 @@ import sys
 import os
 import re
 import argparse
-import tempfile
 import itertools
+import traceback
+import tempfile
+import multiprocessing
+import json
+import cStringIO
 
 ns_rdfify = u'http://dig.csail.mit.edu/2014/rdfify/schema#'
 
@@ -14,6 +18,14 @@ from builtin_types import builtInDatatypeNames
 
 import xml2rdf
 import xsd2rdfs
+import sinks
+import schemacache
+import catalog
+import instrumentation
+import graphstore
+import bnodes
+import refindex
+import literals
 
 ## stuff goes here
 
@@ -23,7 +35,8 @@ class SchemaData:
         self.complexTypeMap = {}
         self.elementMap = {}
         self.attributeMap = {}
-        self.schemataVisited = []
+        self.schemataVisited = set()
+        self.rdfsEmitted = {}
 
 def nsExpand(name, nsMap):
     """Expands the given `name` into {namespace}shortName form using the given nsMap.
@@ -69,92 +82,874 @@ def parseSchemaLocations(xml_root):
 
     return ret
     
-def extractRDFGraphWithSchemaInPlace(g, s, sdata, xml_root, extra_schemata, output_namespace, alsoGenerateIsolatedGraph = False):
+def peekRootElement(xmlfile):
+    """Returns the root element of the given XML file, with its attributes
+       but without parsing the rest of the document."""
+    for event, elem in lxml.etree.iterparse(xmlfile, events=('start',)):
+        return elem
+
+class SchemaLoader:
+    """How schemata are loaded: through the schema cache in `cache_dir` (if
+       set), resolving locations through `catalog` (a catalog.SchemaCatalog,
+       if set), parsing each level of imports on `threads` threads."""
+    def __init__(self, cache_dir = None, catalog = None, threads = None):
+        self.cache_dir = cache_dir
+        self.catalog = catalog
+        self.threads = threads
+
+    def load(self, s, sdata, schemata):
+        if self.cache_dir:
+            for schema in schemata:
+                schemacache.loadSchema(schema, s, sdata, self.cache_dir, self.catalog)
+        else:
+            xsd2rdfs.parseXMLSchemata(schemata, s, sdata, self.catalog, self.threads)
+
+def loadSchemata(s, sdata, xml_root, extra_schemata, schema_loader = None):
     # load all referenced schemata and process them
     #print "processing schemata"
-    for schema in parseSchemaLocations(xml_root):
-        xsd2rdfs.parseXMLSchema(schema, s, sdata)
+    schemata = parseSchemaLocations(xml_root)
     if extra_schemata:
-        for schema in extra_schemata:
-            xsd2rdfs.parseXMLSchema(schema, s, sdata)
+        schemata.extend(extra_schemata)
+
+    loadSchemataFromLocations(s, sdata, schemata, schema_loader)
+
+def loadSchemataFromLocations(s, sdata, schemata, schema_loader = None):
+    if schema_loader is None:
+        schema_loader = SchemaLoader()
+    with instrumentation.phase('schema'):
+        schema_loader.load(s, sdata, schemata)
+
+def extractRDFGraphWithSchemaInPlace(g, s, sdata, xml_root, extra_schemata, output_namespace, alsoGenerateIsolatedGraph = False, schema_loader = None,
+                                     split = None, allocator = None, references = None, literal_mode = 'plain'):
+    loadSchemata(s, sdata, xml_root, extra_schemata, schema_loader)
 
 
     #print "processing XML"
-    xml2rdf.parseXMLDocument(xml_root, g, sdata, output_namespace)
-    
+    with instrumentation.phase('plan'):
+        plan = xml2rdf.ConversionPlan(sdata, output_namespace, allocator, references, literal_mode)
+
+    # the isolated graph is filled in the same pass as the shared one
+    g2 = None
+    sink = g
     if alsoGenerateIsolatedGraph == True:
         g2 = rdflib.Graph()
-        xml2rdf.parseXMLDocument(xml_root, g2, sdata, output_namespace)
-        return g2
-        
-    return None
-
-def extractRDFGraphWithSchema(xml_root, extra_schemata, output_namespace):
-    g = rdflib.Graph()
+        sink = sinks.TeeSink(g, g2)
+
+    with instrumentation.phase('convert'):
+        convertTree(xml_root, sink, sdata, output_namespace, plan, split)
+
+    return g2
+
+def extractRDFGraphWithSchema(xml_root, extra_schemata, output_namespace, schema_loader = None, graph = None, split = None,
+                              allocator = None, references = None, literal_mode = 'plain'):
+    """Converts the document under `xml_root`. Returns the (document, schema)
+       graph pair; the document triples are added to `graph` if given (e.g. a
+       disk-backed graph from graphstore.openGraph). With `split` (a
+       SplitOptions), subtrees are converted in parallel. Blank nodes come
+       from `allocator` (see bnodes.py) if given, and ID and reference values
+       are recorded in `references` (see refindex.py) if given.
+       `literal_mode` is one of literals.MODES."""
+    g = graph if graph is not None else rdflib.Graph()
     s = rdflib.Graph()
     sdata = SchemaData()
 
-    extractRDFGraphWithSchemaInPlace(g, s, sdata, xml_root, extra_schemata, output_namespace)
+    extractRDFGraphWithSchemaInPlace(g, s, sdata, xml_root, extra_schemata, output_namespace, schema_loader = schema_loader,
+                                     split = split, allocator = allocator, references = references,
+                                     literal_mode = literal_mode)
 
     return (g, s)
 
-def main():
-    argparser = argparse.ArgumentParser()
-    argparser.add_argument('xmlfile')
-    argparser.add_argument('-t','--output-type', default='n3')
-    argparser.add_argument('-o','--outfile', default=None)
-    argparser.add_argument('-z','--schema-outfile', default=None)
-    argparser.add_argument('-n','--output-namespace', default="")
-    argparser.add_argument('-s','--include-schema', action='append')
-
-    args = argparser.parse_args()
-
-    outfile = args.outfile
-    schema_outfile = args.schema_outfile
-    output_type = args.output_type
-
-    # Extract the root element
-    t = lxml.etree.parse(args.xmlfile)
-    r = t.getroot()
+def mergeGraphs(g, s):
+    """Adds the triples and namespace bindings of graph `s` to graph `g`."""
+    for prefix, namespace in s.namespaces():
+        g.bind(prefix, namespace, override=False)
+    g += s
+    return g
+
+def extractRDFGraphWithSchemaStreaming(xmlfile, extra_schemata, output_namespace, schema_loader = None, graph = None,
+                                       allocator = None, references = None, literal_mode = 'plain'):
+    """Like extractRDFGraphWithSchema, but converts the XML file incrementally
+       instead of building its whole element tree first."""
+    g = graph if graph is not None else rdflib.Graph()
+    s = rdflib.Graph()
+    sdata = SchemaData()
 
-    # Extract a RDF graph from the given root element.
-    # This step does everything else.
+    loadSchemata(s, sdata, peekRootElement(xmlfile), extra_schemata, schema_loader)
+    with instrumentation.phase('plan'):
+        plan = xml2rdf.ConversionPlan(sdata, output_namespace, allocator, references, literal_mode)
+    # XML parsing is part of the conversion here
+    with instrumentation.phase('convert'):
+        xml2rdf.parseXMLStream(xmlfile, g, sdata, output_namespace, plan)
 
-    g, s = extractRDFGraphWithSchema(r, args.include_schema, args.output_namespace)
+    return (g, s)
 
-    #print "exporting"
+# output types that --stream can write as triples come
+streamTypes = ('nt', 'nquads', 'turtle', 'n3')
+
+def streamSink(out, output_type, context = None):
+    """Returns the sink that writes `output_type` (one of streamTypes) to
+       `out`; N-Quads go to graph `context`. Call its `flush` at the end."""
+    if output_type in ('turtle', 'n3'):
+        return sinks.TurtleSink(out)
+    return sinks.NTriplesSink(out, context)
+
+def streamRDFWithSchema(xmlfile, sink, schema_sink, extra_schemata, output_namespace, iterparse = False, schema_loader = None,
+                        subtree_done = None, split = None, allocator = None, references = None,
+                        literal_mode = 'plain'):
+    """Converts the XML file straight into the given sinks, without building
+       an RDF graph for the document.
+
+       Schema triples go to `schema_sink` ahead of the document triples. With
+       `iterparse`, the document itself is converted incrementally too.
+       `subtree_done` is passed on to the converter (see
+       xml2rdf.parseXMLDocument). With `split` (a SplitOptions), subtrees of
+       the document tree are converted in parallel."""
+    sdata = SchemaData()
 
+    with instrumentation.phase('xml.parse'):
+        if iterparse:
+            r = peekRootElement(xmlfile)
+        else:
+            r = lxml.etree.parse(xmlfile).getroot()
+
+    loadSchemata(schema_sink, sdata, r, extra_schemata, schema_loader)
+
+    with instrumentation.phase('plan'):
+        plan = xml2rdf.ConversionPlan(sdata, output_namespace, allocator, references, literal_mode)
+    with instrumentation.phase('convert'):
+        if iterparse:
+            xml2rdf.parseXMLStream(xmlfile, sink, sdata, output_namespace, plan, subtree_done)
+        elif split:
+            convertTree(r, sink, sdata, output_namespace, plan, split)
+        else:
+            xml2rdf.parseXMLDocument(r, sink, sdata, output_namespace, plan, subtree_done)
+
+def shardRDFWithSchema(xmlfile, outfile, schema_outfile, output_type, extra_schemata, output_namespace,
+                       shards = None, shard_size = None, iterparse = False, schema_loader = None, context = None,
+                       allocator = None, references = None, literal_mode = 'plain'):
+    """Converts the XML file into N-Triples (or N-Quads) shards for parallel
+       loading: `shards` of them, or as many as it takes to keep each near
+       `shard_size` triples. Shards are split between subtrees under the
+       root, so no blank node is split across shards.
+
+       Given `outfile` PREFIX.EXT, shards are written to PREFIX-00000.EXT
+       etc., schema triples to `schema_outfile` (or PREFIX-schema.EXT), and a
+       manifest listing the files with their triple counts and SHA-256
+       checksums to PREFIX.manifest.json. Returns the manifest."""
+    prefix, ext = os.path.splitext(outfile)
+    if not ext:
+        ext = '.' + outputExtensions[output_type]
+
+    def shardPath(i):
+        return '{0}-{1:05d}{2}'.format(prefix, i, ext)
+
+    sink = sinks.ShardedSink(shardPath, shards, shard_size, context)
+    schema_path = schema_outfile or prefix + '-schema' + ext
+    schema_sink = sinks.ShardedSink(lambda i: schema_path, 1, None, context)
+    try:
+        streamRDFWithSchema(xmlfile, sink, schema_sink, extra_schemata, output_namespace, iterparse, schema_loader,
+                            sink.subtreeDone, allocator=allocator, references=references, literal_mode=literal_mode)
+    finally:
+        sink.close()
+        schema_sink.close()
+
+    manifest = {
+        'source': xmlfile,
+        'format': output_type,
+        'triples': sum(shard['triples'] for shard in sink.manifest()),
+        'schema': schema_sink.manifest()[0],
+        'shards': sink.manifest(),
+    }
+    with open(prefix + '.manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return manifest
+
+def serializeGraph(g, output_type, destination = None, ordered = False):
+    """Like g.serialize. With `ordered`, N-Triples lines are sorted: rdflib's
+       memory store doesn't iterate in a stable order, so this is what makes
+       repeatable blank node labels (see bnodes.py) give the same bytes on
+       every run. Turtle and N3 are sorted already."""
+    if not (ordered and output_type == 'nt'):
+        return g.serialize(destination=destination, format=output_type)
+    data = ''.join(sorted(line for line in g.serialize(format='nt').splitlines(True) if line.strip()))
+    if destination is None:
+        return data
+    destination.write(data)
+
+def writeGraphs(g, s, outfile, schema_outfile, output_type, ordered = False):
     # If schema-outfile is unspecified, merge the two graphs.
 
     if not schema_outfile:
+        with instrumentation.phase('merge'):
+            mergeGraphs(g, s)
 
-        # Save both graphs to a tmpdir
-        stmp = tempfile.NamedTemporaryFile()
-        gtmp = tempfile.NamedTemporaryFile(delete=False)
+    # Write the graph to the given file (or stdout)
+    with instrumentation.phase('serialize'):
+      if outfile:
+        with open(outfile, 'w') as f:
+          serializeGraph(g, output_type, f, ordered)
+      else:
+        print serializeGraph(g, output_type, ordered=ordered)
+
+      # Write the schema to the given file (if applicable)
+      if schema_outfile:
+        with open(schema_outfile, 'w') as f:
+          serializeGraph(s, output_type, f, ordered)
+
+## batch mode
+
+outputExtensions = {
+    'n3': 'n3',
+    'turtle': 'ttl',
+    'nt': 'nt',
+    'nquads': 'nq',
+    'xml': 'rdf',
+    'pretty-xml': 'rdf',
+}
+
+def expandInputs(paths, file_list = None):
+    """Expands input arguments into a list of (XML file, name) pairs.
+       Directories stand for the *.xml files below them, which are named by
+       their path relative to the directory; other files by their base name.
+       `file_list` names a file listing one input per line."""
+    paths = list(paths)
+    if file_list:
+        with open(file_list) as f:
+            paths.extend(line.strip() for line in f if line.strip())
 
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith('.xml'):
+                        xmlfile = os.path.join(dirpath, filename)
+                        ret.append((xmlfile, os.path.relpath(xmlfile, path)))
+        else:
+            ret.append((path, os.path.basename(path)))
+    return ret
 
-        stmp.write(s.serialize(format='n3'))
-        gtmp.write(g.serialize(format='n3'))
+def currentUmask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def batchOutputPath(name, outdir, output_type):
+    """Returns the output file in `outdir` for the input named `name` (see
+       expandInputs)."""
+    name = os.path.splitext(name)[0]
+    return os.path.join(outdir, name + '.' + outputExtensions.get(output_type, output_type))
+
+class BatchOptions:
+    def __init__(self, output_namespace, output_type, outdir = None, stream = False, iterparse = False, stats = False,
+                 bnodes = 'uuid', literal_mode = 'plain'):
+        self.output_namespace = output_namespace
+        self.output_type = output_type
+        self.outdir = outdir
+        self.stream = stream
+        self.iterparse = iterparse
+        # collect instrumentation per document in the workers
+        self.stats = stats
+        # blank node allocator name, see bnodes.py
+        self.bnodes = bnodes
+        # one of literals.MODES
+        self.literal_mode = literal_mode
+
+# schema state of a batch worker, set up once per process by initBatchWorker
+_batchWorker = None
+
+def initBatchWorker(sdata, schema_namespaces, schema_triples, options):
+    global _batchWorker
+    plan = xml2rdf.ConversionPlan(sdata, options.output_namespace, bnodes.makeAllocator(options.bnodes),
+                                  literal_mode=options.literal_mode)
+    _batchWorker = (sdata, plan, schema_namespaces, schema_triples, options)
+
+def convertDocumentToSink(xmlfile, sink, sdata, options, plan = None, subtree_done = None):
+    if options.iterparse:
+        with instrumentation.phase('convert'):
+            xml2rdf.parseXMLStream(xmlfile, sink, sdata, options.output_namespace, plan, subtree_done)
+    else:
+        with instrumentation.phase('xml.parse'):
+            r = lxml.etree.parse(xmlfile).getroot()
+        with instrumentation.phase('convert'):
+            xml2rdf.parseXMLDocument(r, sink, sdata, options.output_namespace, plan, subtree_done)
+
+def convertBatchDocument(task):
+    """Converts one document of a batch in a worker process. `task` is the
+       document's (xmlfile, output path, error); documents that come with an
+       error are only reported.
+
+       Returns (xmlfile, result, error, stats). With an output directory, the
+       document (plus schema triples, unless those are written separately) is
+       written to its output path and result is its triple count; otherwise
+       result is the pair of namespace bindings and triples to merge. stats
+       is the instrumentation report for the document, if collected."""
+    if _batchWorker[-1].stats:
+        instrumentation.enable()
+    xmlfile, path, error = task
+    if error:
+        return xmlfile, None, error, None
+    xmlfile, result, error = _convertBatchDocument(xmlfile, path)
+    if instrumentation.active is None:
+        return xmlfile, result, error, None
+    return xmlfile, result, error, instrumentation.active.report()
+
+def _convertBatchDocument(xmlfile, path = None):
+    sdata, plan, schema_namespaces, schema_triples, options = _batchWorker
+    # merged documents must not share blank node labels
+    plan.allocator.startDocument(xmlfile)
+    try:
+        if not options.outdir:
+            g = rdflib.Graph()
+            convertDocumentToSink(xmlfile, g, sdata, options, plan)
+            return xmlfile, (list(g.namespaces()), list(g)), None
+
+        # write to a temporary file first, so that a document that fails
+        # leaves no partial output behind
+        f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.',
+                                        delete=False)
+        try:
+            if options.stream:
+                sink = streamSink(f, options.output_type)
+                for prefix, namespace in schema_namespaces:
+                    sink.bind(prefix, namespace)
+                for triple in schema_triples:
+                    sink.add(triple)
+                convertDocumentToSink(xmlfile, sink, sdata, options, plan, sink.flush)
+                sink.flush()
+                count = sink.count
+            else:
+                g = rdflib.Graph()
+                for prefix, namespace in schema_namespaces:
+                    g.bind(prefix, namespace)
+                for triple in schema_triples:
+                    g.add(triple)
+                convertDocumentToSink(xmlfile, g, sdata, options, plan)
+                with instrumentation.phase('serialize'):
+                    f.write(serializeGraph(g, options.output_type, ordered=options.bnodes != 'uuid'))
+                count = len(g)
+            f.close()
+            # temporary files are private; output files get the usual mode
+            os.chmod(f.name, 0666 & ~currentUmask())
+            os.rename(f.name, path)
+        except:
+            f.close()
+            os.unlink(f.name)
+            raise
+        return xmlfile, count, None
+
+    except Exception:
+        return xmlfile, None, traceback.format_exc().strip().splitlines()[-1]
+
+def runBatch(xmlfiles, extra_schemata, options, outfile = None, schema_outfile = None, jobs = None, schema_loader = None, graph = None,
+             names = None):
+    """Converts many documents in a pool of `jobs` worker processes.
+
+       The schemata referenced by any of the documents are loaded once, up
+       front, and shared by all workers. Documents are written one file each
+       to `options.outdir` if it is set, or merged into `outfile` otherwise
+       (collecting them in `graph`, if given, unless streaming). Output files
+       are named after `names` (see expandInputs; by default the base
+       names of the documents), and a document whose output file an earlier
+       one already has fails.
+       Progress and failures are reported per document on stderr; returns the
+       number of failed documents."""
+    s = rdflib.Graph()
+    sdata = SchemaData()
 
-        stmp.flush()
-        gtmp.flush()
+    schemata = []
+    for xmlfile in xmlfiles:
+        try:
+            locations = parseSchemaLocations(peekRootElement(xmlfile))
+        except Exception:
+            # the document will fail (and be reported) in its worker
+            continue
+        for schema in locations:
+            if schema not in schemata:
+                schemata.append(schema)
+    for schema in extra_schemata or []:
+        if schema not in schemata:
+            schemata.append(schema)
+    loadSchemataFromLocations(s, sdata, schemata, schema_loader)
+
+    # schema triples are merged into every output unless written separately
+    if schema_outfile:
+        schema_namespaces, schema_triples = [], []
+    else:
+        schema_namespaces, schema_triples = list(s.namespaces()), list(s)
+
+    tasks = []
+    if options.outdir:
+        if names is None:
+            names = [os.path.basename(xmlfile) for xmlfile in xmlfiles]
+        taken = {}
+        for xmlfile, name in zip(xmlfiles, names):
+            path = batchOutputPath(name, options.outdir, options.output_type)
+            if path in taken:
+                tasks.append((xmlfile, path, 'output file {0} is taken by {1}'.format(path, taken[path])))
+                continue
+            taken[path] = xmlfile
+            tasks.append((xmlfile, path, None))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+    else:
+        tasks = [(xmlfile, None, None) for xmlfile in xmlfiles]
+
+    # merged output is collected (or streamed) in this process
+    g = None
+    sink = None
+    out = None
+    if not options.outdir:
+        if options.stream:
+            out = open(outfile, 'wb') if outfile else sys.stdout
+            sink = streamSink(out, options.output_type)
+            for prefix, namespace in schema_namespaces:
+                sink.bind(prefix, namespace)
+            for triple in schema_triples:
+                sink.add(triple)
+        else:
+            g = graph if graph is not None else rdflib.Graph()
+
+    pool = multiprocessing.Pool(jobs, initBatchWorker, (sdata, schema_namespaces, schema_triples, options))
+    failures = 0
+    try:
+        for i, (xmlfile, result, error, stats) in enumerate(pool.imap(convertBatchDocument, tasks)):
+            if stats is not None:
+                instrumentation.active.merge(stats)
+            instrumentation.count('documents')
+            if error:
+                failures += 1
+                instrumentation.count('documents.failed')
+                sys.stderr.write('[{0}/{1}] {2}: FAILED: {3}\n'.format(i + 1, len(xmlfiles), xmlfile, error))
+                continue
+
+            if options.outdir:
+                triples = result
+            else:
+                namespaces, triples = result
+                with instrumentation.phase('merge'):
+                    if sink:
+                        for prefix, namespace in namespaces:
+                            sink.bind(prefix, namespace)
+                        for triple in triples:
+                            sink.add(triple)
+                        sink.flush()
+                    else:
+                        for prefix, namespace in namespaces:
+                            g.bind(prefix, namespace, override=False)
+                        for triple in triples:
+                            g.add(triple)
+                triples = len(triples)
+            sys.stderr.write('[{0}/{1}] {2}: {3} triples\n'.format(i + 1, len(xmlfiles), xmlfile, triples))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if out and outfile:
+            out.close()
+
+    if g is not None:
+        # schema triples were already merged into the streamed output
+        writeGraphs(g, s, outfile, schema_outfile, options.output_type, options.bnodes != 'uuid')
+    elif schema_outfile:
+        with instrumentation.phase('serialize'):
+            with open(schema_outfile, 'w') as f:
+                if options.stream:
+                    schema_sink = streamSink(f, options.output_type)
+                    for prefix, namespace in s.namespaces():
+                        schema_sink.bind(prefix, namespace)
+                    for triple in s:
+                        schema_sink.add(triple)
+                    schema_sink.flush()
+                else:
+                    f.write(serializeGraph(s, options.output_type, ordered=options.bnodes != 'uuid'))
+
+    return failures
+
+## subtree-parallel conversion
+
+class SplitOptions:
+    """Converting one document in parallel: the elements `depth` levels
+       below the root (and their descendants) are converted in a pool of
+       `jobs` worker processes, `chunk_size` subtrees per task."""
+    def __init__(self, depth = 1, jobs = None, chunk_size = 1000):
+        self.depth = depth
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+
+def convertTree(xml_root, sink, sdata, output_namespace, plan = None, split = None):
+    if split:
+        parseXMLDocumentInParallel(xml_root, sink, sdata, output_namespace, split, plan)
+    else:
+        xml2rdf.parseXMLDocument(xml_root, sink, sdata, output_namespace, plan)
+
+def splitDocument(xml_root, depth, sink, plan):
+    """Converts the elements less than `depth` levels below `xml_root`, and
+       returns the (element, parent node, index) triples of the elements at
+       `depth`, in document order."""
+    units = []
+    stack = [(xml_root, None, 0, 0)]
+    while stack:
+        tag, parentNode, level, index = stack.pop()
+
+        if level == depth:
+            units.append((tag, parentNode, index))
+            continue
+
+        node, ref_key = xml2rdf.processTag(tag.tag, xml2rdf.collapseText(tag.text), xml2rdf.sortedItems(tag), len(tag) > 0,
+                                           sink, parentNode, plan, None, index)
+        children = list(xml2rdf.childElements(tag))
+        stack.extend((child, node, level + 1, i) for i, child in reversed(children))
+    return units
+
+# the split document and schema state, handed to the subtree workers by
+# forking (elements can't be pickled)
+_subtreeWorker = None
+
+def convertSubtrees(bounds):
+    """Converts a range of the split document's subtrees in a worker
+       process. Returns N-Triples text and its triple count if the output is
+       N-Triples, or a list of triples otherwise, the ID and reference values
+       met if the plan records them (or None), and the instrumentation report
+       of the task if stats are collected (or None)."""
+    units, sdata, plan, encode, context = _subtreeWorker
+    start, end = bounds
+
+    # the worker's copy of the stats holds the main process's so far, and
+    # its term caches count every task the worker ran
+    stats = instrumentation.active
+    if stats is not None:
+        stats = instrumentation.enable()
+        caches = xml2rdf.termCacheStats()
+
+    # values are recorded per task and merged into the main process's index
+    references = None
+    if plan.references is not None:
+        references = plan.references = refindex.ReferenceIndex(None)
+
+    if encode:
+        out = cStringIO.StringIO()
+        sink = sinks.NTriplesSink(out, context)
+    else:
+        sink = sinks.ListSink()
+
+    # counters restart in every task, under a prefix of their own
+    plan.allocator.startChunk(start)
+    for tag, parentNode, index in units[start:end]:
+        xml2rdf.processNode(tag, sink, parentNode, sdata, plan.target_namespace, plan, index)
+
+    report = None
+    if stats is not None:
+        report = stats.report()
+        report['term_caches'] = dict(
+            (name, {'hits': counts['hits'] - caches[name]['hits'], 'misses': counts['misses'] - caches[name]['misses']})
+            for name, counts in xml2rdf.termCacheStats().iteritems())
+
+    if encode:
+        return (out.getvalue(), sink.count), references, report
+    return sink.triples, references, report
+
+def parseXMLDocumentInParallel(xml_root, sink, sdata, output_namespace, split, plan = None):
+    """Produces the same triples as xml2rdf.parseXMLDocument, converting the
+       subtrees at `split.depth` in worker processes.
+
+       The elements above the split are converted here first. The workers
+       share the document tree and the compiled plan with this process
+       (they are forked after both are ready), and their results are added
+       to `sink` in document order. Node URIs only depend on the root
+       namespace and ID values, and each task gets its own blank node
+       labels (see bnodes.py), so workers can't produce clashing nodes."""
+    global _subtreeWorker
+
+    if plan is None:
+        plan = xml2rdf.ConversionPlan(sdata, output_namespace)
+
+    for k, v in xml_root.nsmap.iteritems():
+        sink.bind(k, xml2rdf.normalizeNamespace(v))
+
+    units = splitDocument(xml_root, split.depth, sink, plan)
+
+    # N-Triples are encoded in the workers
+    encode = isinstance(sink, sinks.NTriplesSink)
+    context = sink.context if encode else None
+
+    chunk_size = max(1, split.chunk_size)
+    ranges = [(i, min(i + chunk_size, len(units))) for i in xrange(0, len(units), chunk_size)]
+
+    _subtreeWorker = (units, sdata, plan, encode, context)
+    pool = multiprocessing.Pool(split.jobs)
+    try:
+        for result, references, report in pool.imap(convertSubtrees, ranges):
+            if encode:
+                sink.addEncoded(*result)
+            else:
+                for triple in result:
+                    sink.add(triple)
+            if references is not None:
+                plan.references.merge(references)
+            if report is not None:
+                instrumentation.active.merge(report)
+                xml2rdf.addTermCacheStats(report['term_caches'])
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _subtreeWorker = None
+
+def writeStats(path):
+    report = instrumentation.active.report()
+    report['term_caches'] = xml2rdf.termCacheStats()
+    if path == '-':
+        instrumentation.writeReport(report, sys.stderr)
+    else:
+        with open(path, 'w') as f:
+            instrumentation.writeReport(report, f)
 
-        # Then merge the two graphs
-        g = rdflib.Graph()
-        g.parse(stmp.name, format='n3')
-        g.parse(gtmp.name, format='n3')
+def openDocumentGraph(args):
+    """Returns the graph chosen by --store (disk-backed, or a compact
+       triplebuffer.TripleBuffer), or None for the default in-memory graph."""
+    if args.store == 'memory':
+        return None
+    return graphstore.openGraph(args.store, args.store_path)
 
-    # Write the graph to the given file (or stdout)
-    if outfile:
-      with open(outfile, 'w') as f:
-        f.write(g.serialize(format=output_type))
+def closeDocumentGraph(graph):
+    if graph is not None:
+        graphstore.closeGraph(graph)
+
+def convert(args, argparser):
+    outfile = args.outfile
+    schema_outfile = args.schema_outfile
+    output_type = args.output_type
+
+    if args.stream:
+        if output_type not in streamTypes:
+            argparser.error('--stream writes N-Triples, N-Quads, Turtle or N3 only; use -t nt, nquads, turtle or n3')
+
+    sharded = args.shards or args.shard_size
+    if sharded:
+        if output_type not in ('nt', 'nquads'):
+            argparser.error('sharded output is line-based; use -t nt or -t nquads')
+        if not outfile:
+            argparser.error('sharded output needs -o to name the shards')
+        if args.shards and args.shard_size:
+            argparser.error('use one of --shards and --shard-size')
+
+    split = None
+    if args.split_depth is not None:
+        if args.split_depth < 1:
+            argparser.error('--split-depth must be at least 1')
+        if args.iterparse or sharded:
+            argparser.error('--split-depth needs the whole document tree; it cannot be combined with --iterparse or sharding')
+        split = SplitOptions(args.split_depth, args.jobs)
+
+    if args.store != 'memory':
+        if args.stream or args.outdir or sharded:
+            argparser.error('--store builds a single graph; it cannot be combined with --stream, --outdir or sharding')
+        if not args.store_path and args.store != 'compact':
+            argparser.error('--store {0} needs --store-path'.format(args.store))
+
+    schema_catalog = catalog.loadCatalogs(args.catalog) if args.catalog else None
+    schema_loader = SchemaLoader(args.schema_cache, schema_catalog, args.schema_threads)
+
+    if args.serve:
+        import service
+        if args.xmlfile or args.file_list or args.outfile or args.outdir or sharded or split or args.stream \
+                or args.iterparse or args.store != 'memory' or args.check_refs:
+            argparser.error('--serve takes documents over HTTP; it only combines with -t, -n, -s, -j, --bnodes, '
+                            '--literals and the schema options')
+        options = service.ServiceOptions(args.output_namespace, output_type, args.include_schema, schema_loader,
+                                         args.bnodes, args.literals, args.allow_schema)
+        service.serve(args.serve, options, args.jobs, args.max_pending, args.max_body, args.verbose)
+        return
+
+    inputs = expandInputs(args.xmlfile, args.file_list)
+    xmlfiles = [xmlfile for xmlfile, name in inputs]
+    if not xmlfiles:
+        argparser.error('no input documents')
+
+    # several documents (or an output directory) mean batch mode
+    if len(xmlfiles) > 1 or args.file_list or args.outdir or os.path.isdir(args.xmlfile[0]):
+        if sharded or split or args.check_refs:
+            argparser.error('sharded output, --split-depth and --check-refs are for a single document')
+        options = BatchOptions(args.output_namespace, output_type, args.outdir, args.stream, args.iterparse,
+                               bool(args.stats), args.bnodes, args.literals)
+        graph = openDocumentGraph(args)
+        try:
+            failures = runBatch(xmlfiles, args.include_schema, options, outfile, schema_outfile,
+                                args.jobs, schema_loader, graph, [name for xmlfile, name in inputs])
+        finally:
+            closeDocumentGraph(graph)
+        if failures:
+            sys.exit('{0} of {1} documents failed'.format(failures, len(xmlfiles)))
+        return
+
+    allocator = bnodes.makeAllocator(args.bnodes)
+
+    references = None
+    if args.check_refs:
+        references = refindex.ReferenceIndex(args.ref_spill)
+    try:
+        convertDocument(args, xmlfiles[0], schema_loader, split, allocator, references)
+        if references is not None:
+            with instrumentation.phase('refs'):
+                report = references.check()
+            writeReferenceReport(report, args.check_refs)
+    finally:
+        if references is not None:
+            references.close()
+    if references is not None and not report.ok():
+        sys.exit('{0} unresolved references, {1} duplicate IDs'.format(len(report.unresolved),
+                                                                     len(report.duplicates)))
+
+def writeReferenceReport(report, path):
+    if path == '-':
+        instrumentation.writeReport(report.asDict(), sys.stderr)
     else:
-      print g.serialize(format=output_type)
+        with open(path, 'w') as f:
+            instrumentation.writeReport(report.asDict(), f)
 
-    # Write the schema to the given file (if applicable)
-    if schema_outfile:
-      with open(schema_outfile, 'w') as f:
-        f.write(s.serialize(format=output_type))
+def convertDocument(args, xmlfile, schema_loader, split, allocator, references):
+    """Converts a single document as the command line says."""
+    outfile = args.outfile
+    schema_outfile = args.schema_outfile
+    output_type = args.output_type
+    sharded = args.shards or args.shard_size
+
+    # N-Quads go to a graph named after the output namespace
+    context = None
+    if output_type == 'nquads' and args.output_namespace:
+        context = rdflib.URIRef(args.output_namespace)
+
+    if sharded:
+        manifest = shardRDFWithSchema(xmlfile, outfile, schema_outfile, output_type, args.include_schema,
+                                      args.output_namespace, args.shards, args.shard_size, args.iterparse,
+                                      schema_loader, context, allocator, references, args.literals)
+        sys.stderr.write('{0} triples in {1} shards\n'.format(manifest['triples'], len(manifest['shards'])))
+        return
+
+    if args.stream:
+        out = open(outfile, 'wb') if outfile else sys.stdout
+        schema_out = open(schema_outfile, 'wb') if schema_outfile else out
+        try:
+            sink = streamSink(out, output_type, context)
+            schema_sink = streamSink(schema_out, output_type, context) if schema_outfile else sink
+            streamRDFWithSchema(xmlfile, sink, schema_sink, args.include_schema, args.output_namespace,
+                                args.iterparse, schema_loader, sink.flush, split, allocator, references,
+                                args.literals)
+            schema_sink.flush()
+            sink.flush()
+        finally:
+            if schema_outfile:
+                schema_out.close()
+            if outfile:
+                out.close()
+        return
+
+    graph = openDocumentGraph(args)
+    try:
+        if args.iterparse:
+            g, s = extractRDFGraphWithSchemaStreaming(xmlfile, args.include_schema, args.output_namespace,
+                                                      schema_loader, graph, allocator, references, args.literals)
+        else:
+            # Extract the root element
+            with instrumentation.phase('xml.parse'):
+                t = lxml.etree.parse(xmlfile)
+            r = t.getroot()
+
+            # Extract a RDF graph from the given root element.
+            # This step does everything else.
+
+            g, s = extractRDFGraphWithSchema(r, args.include_schema, args.output_namespace, schema_loader, graph,
+                                             split, allocator, references, args.literals)
+
+        #print "exporting"
+
+        writeGraphs(g, s, outfile, schema_outfile, output_type, args.bnodes != 'uuid')
+    finally:
+        closeDocumentGraph(graph)
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('xmlfile', nargs='*',
+                           help='XML document(s) to convert; directories stand for the *.xml files below them')
+    argparser.add_argument('-t','--output-type', default='n3')
+    argparser.add_argument('-o','--outfile', default=None)
+    argparser.add_argument('-z','--schema-outfile', default=None)
+    argparser.add_argument('-n','--output-namespace', default="")
+    argparser.add_argument('-s','--include-schema', action='append')
+    argparser.add_argument('--iterparse', action='store_true',
+                           help='convert the document incrementally instead of loading its whole tree')
+    argparser.add_argument('--stream', action='store_true',
+                           help='write N-Triples/N-Quads (or Turtle/N3 by subject) as they are produced instead of building a graph')
+    argparser.add_argument('--schema-cache', default=None, metavar='DIR',
+                           help='reuse compiled schemata from DIR (see schemacache.py to precompile)')
+    argparser.add_argument('--catalog', action='append', default=[], metavar='FILE',
+                           help='resolve schema locations through the XML catalog FILE, without network access')
+    argparser.add_argument('--schema-threads', type=int, default=None, metavar='N',
+                           help='parse imported schemata on N threads (default: one per core)')
+    argparser.add_argument('--file-list', default=None, metavar='FILE',
+                           help='convert the documents listed in FILE, one per line')
+    argparser.add_argument('--outdir', default=None, metavar='DIR',
+                           help='batch mode: write one output file per document to DIR')
+    argparser.add_argument('-j','--jobs', type=int, default=None,
+                           help='number of worker processes for batch mode, --split-depth and --serve (default: one per core)')
+    argparser.add_argument('--split-depth', type=int, default=None, metavar='D',
+                           help='convert the subtrees D levels below the root in parallel (usually 1)')
+    argparser.add_argument('--store', default='memory', choices=graphstore.STORES,
+                           help='where to build the document graph (default: memory; compact keeps it in a triplebuffer.TripleBuffer); see graphstore.py')
+    argparser.add_argument('--store-path', default=None, metavar='PATH',
+                           help='file (sqlite) or directory (sleepycat) of a disk-backed store; '
+                                'an existing store is added to')
+    argparser.add_argument('--shards', type=int, default=None, metavar='N',
+                           help='split N-Triples/N-Quads output into N shards plus a manifest (needs -o)')
+    argparser.add_argument('--shard-size', type=int, default=None, metavar='TRIPLES',
+                           help='split N-Triples/N-Quads output into shards of about this many triples (needs -o)')
+    argparser.add_argument('--bnodes', default='uuid', choices=sorted(bnodes.ALLOCATORS),
+                           help='blank node labels: random (uuid, the default), numbered in document order '
+                                '(counter) or derived from the element path (path); see bnodes.py')
+    argparser.add_argument('--literals', default='plain', choices=literals.MODES,
+                           help='literals for leaf text and attribute values: untyped (plain, the default), typed '
+                                'after their schema datatype (lexical) or typed after checking their lexical form '
+                                '(validate); see literals.py')
+    argparser.add_argument('--check-refs', default=None, metavar='FILE',
+                           help='report unresolved references and duplicate IDs as JSON to FILE (- for stderr); '
+                                'see refindex.py')
+    argparser.add_argument('--ref-spill', type=int, default=1000000, metavar='N',
+                           help='--check-refs: keep at most N ID/reference values in memory before spilling '
+                                'them to a temporary file')
+    argparser.add_argument('--serve', default=None, metavar='[HOST:]PORT',
+                           help='run a local HTTP conversion service on PORT (see service.py)')
+    argparser.add_argument('--max-pending', type=int, default=None, metavar='N',
+                           help='--serve: requests accepted at a time before answering 503 (default: 2 per worker)')
+    argparser.add_argument('--max-body', type=int, default=None, metavar='BYTES',
+                           help='--serve: largest request body accepted')
+    argparser.add_argument('--allow-schema', action='append', default=[], metavar='LOC',
+                           help='--serve: let documents name the schema LOC (besides -s schemata and catalog entries)')
+    argparser.add_argument('-v','--verbose', action='store_true',
+                           help='--serve: log every request')
+    argparser.add_argument('--stats', default=None, metavar='FILE',
+                           help='write phase timings and counters as JSON to FILE (- for stderr)')
+    argparser.add_argument('--profile', default=None, metavar='FILE',
+                           help='run under cProfile and write the profile to FILE (pstats format)')
+
+    args = argparser.parse_args()
+
+    if args.stats:
+        instrumentation.enable()
+    try:
+        if args.profile:
+            instrumentation.profile(convert, args.profile, args, argparser)
+        else:
+            convert(args, argparser)
+    finally:
+        if args.stats:
+            writeStats(args.stats)
 
 if __name__ == "__main__":
     main()
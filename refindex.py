@@ -0,0 +1,126 @@
+# ID/IDREF bookkeeping for checking references (`rdfify2.py --check-refs`).
+#
+# Reference attributes are turned into node URIs without looking at the IDs
+# of the document, so a reference to a missing ID, or two elements with the
+# same ID, go unnoticed. A ReferenceIndex on the ConversionPlan is told about
+# every ID and reference value the converter meets (xml2rdf.processTag), in
+# whatever order: tree walk, iterparse or subtree workers. Checking at the
+# end needs no second pass over the XML.
+#
+# In memory, the index is two dictionaries from value to occurrence count;
+# references to IDs already seen aren't kept. Past `spill_threshold` values,
+# both are written to a temporary SQLite file and started afresh, and the
+# final check is done there.
+
+import os
+import sqlite3
+import tempfile
+
+class ReferenceReport:
+    """The outcome of a reference check. `unresolved` and `duplicates` are
+       sorted lists of (value, occurrences)."""
+
+    def __init__(self, ids, refs, unresolved, duplicates, spilled):
+        self.ids = ids
+        self.refs = refs
+        self.unresolved = unresolved
+        self.duplicates = duplicates
+        self.spilled = spilled
+
+    def ok(self):
+        return not self.unresolved and not self.duplicates
+
+    def asDict(self):
+        return {
+            'ids': self.ids,
+            'references': self.refs,
+            'spilled_to_disk': self.spilled,
+            'unresolved': [{'value': v, 'references': n} for v, n in self.unresolved],
+            'duplicate_ids': [{'value': v, 'occurrences': n} for v, n in self.duplicates],
+        }
+
+class ReferenceIndex:
+    """Records ID and IDREF values; see the module comment."""
+
+    def __init__(self, spill_threshold = 1000000, directory = None):
+        self.spill_threshold = spill_threshold
+        self.directory = directory
+        self.ids = {}
+        self.refs = {}
+        self.id_count = 0
+        self.ref_count = 0
+        self.db = None
+        self.path = None
+
+    def addID(self, value):
+        ids = self.ids
+        ids[value] = ids.get(value, 0) + 1
+        self.id_count += 1
+        # earlier references to it are resolved
+        self.refs.pop(value, None)
+        if self.spill_threshold and len(ids) + len(self.refs) > self.spill_threshold:
+            self.spill()
+
+    def addRef(self, value):
+        self.ref_count += 1
+        if value in self.ids:
+            return
+        refs = self.refs
+        refs[value] = refs.get(value, 0) + 1
+        if self.spill_threshold and len(self.ids) + len(refs) > self.spill_threshold:
+            self.spill()
+
+    def merge(self, other):
+        """Adds what an in-memory index `other` (e.g. of a worker process)
+           has recorded."""
+        for value, n in other.ids.iteritems():
+            self.ids[value] = self.ids.get(value, 0) + n
+            self.refs.pop(value, None)
+        for value, n in other.refs.iteritems():
+            if value not in self.ids:
+                self.refs[value] = self.refs.get(value, 0) + n
+        self.id_count += other.id_count
+        self.ref_count += other.ref_count
+        if self.spill_threshold and len(self.ids) + len(self.refs) > self.spill_threshold:
+            self.spill()
+
+    def spill(self):
+        """Moves the values held in memory to the index file."""
+        if self.db is None:
+            fd, self.path = tempfile.mkstemp(prefix='refs-', suffix='.db', dir=self.directory)
+            os.close(fd)
+            self.db = sqlite3.connect(self.path)
+            self.db.executescript('''
+                PRAGMA journal_mode = OFF;
+                PRAGMA synchronous = OFF;
+                CREATE TABLE ids (value TEXT, n INTEGER);
+                CREATE TABLE refs (value TEXT, n INTEGER);
+            ''')
+        self.db.executemany('INSERT INTO ids VALUES (?, ?)', self.ids.iteritems())
+        self.db.executemany('INSERT INTO refs VALUES (?, ?)', self.refs.iteritems())
+        self.db.commit()
+        self.ids = {}
+        self.refs = {}
+
+    def check(self):
+        """Returns a ReferenceReport of everything recorded so far."""
+        if self.db is None:
+            ids = self.ids
+            unresolved = sorted(self.refs.iteritems())
+            duplicates = sorted((v, n) for v, n in ids.iteritems() if n > 1)
+            return ReferenceReport(self.id_count, self.ref_count, unresolved, duplicates, False)
+
+        self.spill()
+        self.db.execute('CREATE INDEX IF NOT EXISTS ids_value ON ids (value)')
+        duplicates = self.db.execute('SELECT value, SUM(n) FROM ids GROUP BY value HAVING SUM(n) > 1 '
+                                     'ORDER BY value').fetchall()
+        unresolved = self.db.execute('SELECT value, SUM(n) FROM refs WHERE value NOT IN (SELECT value FROM ids) '
+                                     'GROUP BY value ORDER BY value').fetchall()
+        return ReferenceReport(self.id_count, self.ref_count, unresolved, duplicates, True)
+
+    def close(self):
+        """Removes the index file, if there is one."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            os.remove(self.path)
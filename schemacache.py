@@ -0,0 +1,223 @@
+# on-disk cache of compiled schemata.
+#
+# Compiling a schema (xsd2rdfs.parseXMLSchema) means parsing it and all its
+# imports, extracting the SchemaData maps, reducing the simple types and
+# building the RDFS triples. A cache entry keeps the result of all of that for
+# one schema location, keyed on the location, the content hash of the schema
+# and the identity of the catalog its imports were resolved through (see
+# catalog.SchemaCatalog.identity); the entry also records the content hash of
+# every schema in the import closure, and is recompiled when any of them
+# changes.
+#
+# Remote schemata aren't downloaded on every run to hash them: a remote
+# location is keyed on its URL (and the catalog) alone, and the closure
+# records the ETag and Last-Modified headers of each remote schema with the
+# time they were last checked. Within REMOTE_MAX_AGE of that, a remote schema
+# is taken to be unchanged; after it, a conditional request revalidates it,
+# and only a changed (or unvalidated) schema is downloaded again.
+
+import os
+import sys
+import hashlib
+import cPickle
+import time
+import tempfile
+import urllib2
+import argparse
+
+import rdflib
+
+import xsd2rdfs
+import catalog
+import instrumentation
+
+CACHE_VERSION = 4
+
+# seconds a remote schema is used without revalidating it
+REMOTE_MAX_AGE = 3600
+
+MAP_NAMES = ('simpleTypeMap', 'complexTypeMap', 'elementMap', 'attributeMap')
+
+def isRemoteLocation(loc):
+    return '://' in loc
+
+def canonicalLocation(loc):
+    if isRemoteLocation(loc):
+        return loc
+    return os.path.abspath(loc)
+
+def fetchRemote(loc, validators = None):
+    """Downloads the remote schema at `loc`. Returns (content, validators),
+       where validators are the response's ETag and Last-Modified headers
+       and the time of the request. Given the validators of an earlier
+       download, the request is conditional, and content is None if the
+       schema hasn't changed since."""
+    request = urllib2.Request(loc)
+    if validators is not None:
+        if validators['etag']:
+            request.add_header('If-None-Match', validators['etag'])
+        if validators['last_modified']:
+            request.add_header('If-Modified-Since', validators['last_modified'])
+    checked = time.time()
+    try:
+        f = urllib2.urlopen(request)
+    except urllib2.HTTPError as e:
+        if e.code == 304 and validators is not None:
+            return None, dict(validators, checked=checked)
+        raise
+    try:
+        info = f.info()
+        return f.read(), {'etag': info.getheader('ETag'), 'last_modified': info.getheader('Last-Modified'),
+                          'checked': checked}
+    finally:
+        f.close()
+
+def readSchemaBytes(loc):
+    if isRemoteLocation(loc):
+        return fetchRemote(loc)[0]
+    with open(loc, 'rb') as f:
+        return f.read()
+
+def contentHash(loc):
+    return hashlib.sha1(readSchemaBytes(loc)).hexdigest()
+
+def closureRecord(loc):
+    """Returns the (location, content hash, validators) triple an entry
+       keeps for a schema in its import closure; validators are None for
+       local files."""
+    if isRemoteLocation(loc):
+        content, validators = fetchRemote(loc)
+        return loc, hashlib.sha1(content).hexdigest(), validators
+    return canonicalLocation(loc), contentHash(loc), None
+
+def cacheEntryPath(cache_dir, schema_loc, catalog = None):
+    loc = canonicalLocation(schema_loc)
+    # a changed catalog can resolve the same imports to other files
+    catalog_id = catalog.identity() if catalog is not None else ''
+    # remote schemata are revalidated from the entry instead (see checkClosure)
+    digest = 'remote' if isRemoteLocation(schema_loc) else contentHash(schema_loc)
+    key = hashlib.sha1(loc.encode('utf-8') + '\0' + digest + '\0' + catalog_id).hexdigest()
+    return os.path.join(cache_dir, key + '.pickle')
+
+def compileSchema(schema_loc, schema_data_class, catalog = None):
+    """Compiles the schema at `schema_loc` into a cache entry."""
+    schema_graph = rdflib.Graph()
+    schema_data = schema_data_class()
+
+    xsd2rdfs.parseXMLSchema(schema_loc, schema_graph, schema_data, catalog)
+
+    return {
+        'version': CACHE_VERSION,
+        'closure': [closureRecord(loc) for loc in schema_data.schemataVisited],
+        'visited': list(schema_data.schemataVisited),
+        'maps': dict((name, getattr(schema_data, name)) for name in MAP_NAMES),
+        'emitted': schema_data.rdfsEmitted,
+        'namespaces': list(schema_graph.namespaces()),
+        'triples': list(schema_graph),
+    }
+
+def checkClosure(entry, now = None):
+    """Checks that no schema in the entry's import closure has changed.
+       Returns the closure with the validators of revalidated remote
+       schemata updated, or None if the entry is out of date."""
+    if entry.get('version') != CACHE_VERSION:
+        return None
+    if now is None:
+        now = time.time()
+    closure = []
+    for loc, digest, validators in entry['closure']:
+        try:
+            if validators is None:
+                if contentHash(loc) != digest:
+                    return None
+            elif now - validators['checked'] >= REMOTE_MAX_AGE:
+                content, validators = fetchRemote(loc, validators)
+                if content is not None and hashlib.sha1(content).hexdigest() != digest:
+                    return None
+        except (IOError, OSError, urllib2.URLError):
+            return None
+        closure.append((loc, digest, validators))
+    return closure
+
+def readCacheEntry(path):
+    try:
+        with open(path, 'rb') as f:
+            entry = cPickle.load(f)
+    except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+        return None
+    closure = checkClosure(entry)
+    if closure is None:
+        return None
+    if closure != entry['closure']:
+        # keep the new check times, so the next run needn't ask again
+        entry['closure'] = closure
+        try:
+            writeCacheEntry(path, entry)
+        except (IOError, OSError):
+            # e.g. a read-only shared cache
+            pass
+    return entry
+
+def writeCacheEntry(path, entry):
+    # write to a temporary file first, so that concurrent readers never see
+    # a partial entry
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+    try:
+        cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.rename(f.name, path)
+    except:
+        f.close()
+        os.unlink(f.name)
+        raise
+
+def applyCacheEntry(entry, schema_graph, schema_data):
+    for prefix, namespace in entry['namespaces']:
+        schema_graph.bind(prefix, namespace)
+    for name in MAP_NAMES:
+        getattr(schema_data, name).update(entry['maps'][name])
+    schema_data.rdfsEmitted.update(entry['emitted'])
+    schema_data.schemataVisited.update(entry['visited'])
+    for triple in entry['triples']:
+        schema_graph.add(triple)
+
+def precompileSchema(schema_loc, cache_dir, schema_data_class, catalog = None):
+    """Makes sure the cache holds a valid entry for `schema_loc`, compiling
+       the schema if needed. Returns the entry."""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    schema_loc = xsd2rdfs.resolveSchemaLocation(schema_loc, None, catalog)
+    path = cacheEntryPath(cache_dir, schema_loc, catalog)
+    entry = readCacheEntry(path)
+    if entry is None:
+        entry = compileSchema(schema_loc, schema_data_class, catalog)
+        writeCacheEntry(path, entry)
+    return entry
+
+def loadSchema(schema_loc, schema_graph, schema_data, cache_dir, catalog = None):
+    """Cached equivalent of xsd2rdfs.parseXMLSchema."""
+    with instrumentation.phase('schema.cache'):
+        entry = precompileSchema(schema_loc, cache_dir, schema_data.__class__, catalog)
+    instrumentation.count('schemata.cached', len(entry['closure']))
+    applyCacheEntry(entry, schema_graph, schema_data)
+
+def main():
+    import rdfify2
+
+    argparser = argparse.ArgumentParser(description='Precompile schemata into a schema cache.')
+    argparser.add_argument('schema', nargs='+')
+    argparser.add_argument('-d','--schema-cache', required=True)
+    argparser.add_argument('--catalog', action='append', default=[],
+                           help='resolve schema locations through this XML catalog, without network access')
+
+    args = argparser.parse_args()
+
+    schema_catalog = catalog.loadCatalogs(args.catalog) if args.catalog else None
+
+    for schema_loc in args.schema:
+        entry = precompileSchema(schema_loc, args.schema_cache, rdfify2.SchemaData, schema_catalog)
+        sys.stderr.write('{0}: {1} schemata, {2} triples\n'.format(schema_loc, len(entry['closure']), len(entry['triples'])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# local HTTP conversion service, started by `rdfify2.py --serve PORT`.
+#
+#   POST /convert?format=nt   body: an XML document   ->  its RDF
+#   GET  /status                                      ->  JSON counters
+#
+# Conversion is CPU-bound, so requests are handled on threads but converted
+# in a pool of worker processes. Each worker keeps the schemata it has loaded
+# (SchemaData, conversion plans and RDFS triples, keyed on the documents'
+# schema locations) for later requests, so a document only costs its own
+# parsing and conversion once its schemata are warm. Both caches keep the
+# most recently used entries only.
+#
+# Schema locations come from the client's documents, so only the schemata
+# given with -s or --allow-schema, and locations the catalog has an entry
+# for, are loaded; documents naming others get 403. Otherwise a request could
+# have the service read any local file or fetch any URL.
+#
+# At most `max_pending` requests are accepted at a time (being converted or
+# waiting for a worker); further requests get 503 with Retry-After until one
+# finishes, so a burst of clients can't pile up unbounded work and memory.
+# Query parameters: `format` (rdflib output format, default: the server's
+# -t), `namespace` (default: the server's -n) and `schema=omit` to leave the
+# RDFS triples out of the response.
+
+import sys
+import json
+import time
+import collections
+import socket
+import signal
+import urlparse
+import threading
+import traceback
+import cStringIO
+import multiprocessing
+import SocketServer
+import BaseHTTPServer
+
+import lxml.etree
+import rdflib
+
+import xml2rdf
+import sinks
+import bnodes
+import rdfify2
+
+contentTypes = {
+    'nt': 'application/n-triples',
+    'nquads': 'application/n-quads',
+    'turtle': 'text/turtle',
+    'n3': 'text/n3',
+    'xml': 'application/rdf+xml',
+    'pretty-xml': 'application/rdf+xml',
+}
+
+class ServiceOptions:
+    def __init__(self, output_namespace, output_type, extra_schemata = None, schema_loader = None, bnodes = 'uuid',
+                 literal_mode = 'plain', allowed_schemata = None, schema_sets = 32, plans = 16):
+        self.output_namespace = output_namespace
+        self.output_type = output_type
+        self.extra_schemata = extra_schemata
+        self.schema_loader = schema_loader
+        self.bnodes = bnodes
+        self.literal_mode = literal_mode
+        # schema locations documents may name, besides extra_schemata and
+        # the catalog's
+        self.allowed_schemata = allowed_schemata
+        # sizes of the per-worker schema and per-schema plan caches
+        self.schema_sets = schema_sets
+        self.plans = plans
+
+class SchemaNotAllowed(Exception):
+    pass
+
+def schemaAllowed(options, loc):
+    """Tells whether a document may have the service load the schema at
+       `loc`."""
+    if loc in (options.extra_schemata or ()) or loc in (options.allowed_schemata or ()):
+        return True
+    catalog = options.schema_loader.catalog if options.schema_loader is not None else None
+    return catalog is not None and catalog.lookup(loc) is not None
+
+class LRUCache:
+    """Keeps the `maxsize` most recently used of the entries put in it."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return None
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+## worker side
+
+# per-process state of a service worker, set up by initServiceWorker
+_serviceWorker = None
+
+class _SchemaEntry:
+    """Warm schema state for one set of schema locations."""
+    def __init__(self, sdata, s, plans):
+        self.sdata = sdata
+        self.namespaces = list(s.namespaces())
+        self.triples = list(s)
+        self.plans = LRUCache(plans)
+
+def initServiceWorker(options):
+    global _serviceWorker
+    # Ctrl-C reaches the whole process group; the server shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _serviceWorker = (options, LRUCache(options.schema_sets))
+
+def _schemaEntry(xml_root):
+    options, entries = _serviceWorker
+    key = tuple(rdfify2.parseSchemaLocations(xml_root))
+    entry = entries.get(key)
+    if entry is None:
+        for loc in key:
+            if not schemaAllowed(options, loc):
+                raise SchemaNotAllowed('schema {0} is not allowed'.format(loc))
+        s = rdflib.Graph()
+        sdata = rdfify2.SchemaData()
+        rdfify2.loadSchemata(s, sdata, xml_root, options.extra_schemata, options.schema_loader)
+        entry = _SchemaEntry(sdata, s, options.plans)
+        entries.put(key, entry)
+    return entry
+
+def _plan(entry, namespace):
+    options = _serviceWorker[0]
+    plan = entry.plans.get(namespace)
+    if plan is None:
+        plan = xml2rdf.ConversionPlan(entry.sdata, namespace, bnodes.makeAllocator(options.bnodes),
+                                      literal_mode=options.literal_mode)
+        entry.plans.put(namespace, plan)
+    return plan
+
+def convertRequest(request):
+    """Converts one request body in a worker. Returns (status, content type,
+       data). `document` names the request for the blank node allocator, so
+       that no two requests get the same labels."""
+    body, output_type, namespace, include_schema, document = request
+    try:
+        r = lxml.etree.fromstring(body)
+    except lxml.etree.XMLSyntaxError as e:
+        return 400, 'text/plain', 'not well-formed XML: {0}\n'.format(e)
+
+    try:
+        try:
+            entry = _schemaEntry(r)
+        except SchemaNotAllowed as e:
+            return 403, 'text/plain', '{0}\n'.format(e)
+        plan = _plan(entry, namespace)
+        plan.allocator.startDocument(document)
+        if output_type in ('nt', 'nquads'):
+            out = cStringIO.StringIO()
+            context = rdflib.URIRef(namespace) if output_type == 'nquads' and namespace else None
+            sink = sinks.NTriplesSink(out, context)
+            if include_schema:
+                for triple in entry.triples:
+                    sink.add(triple)
+            xml2rdf.parseXMLDocument(r, sink, entry.sdata, namespace, plan)
+            return 200, contentTypes[output_type], out.getvalue()
+
+        g = rdflib.Graph()
+        if include_schema:
+            for prefix, ns in entry.namespaces:
+                g.bind(prefix, ns)
+            for triple in entry.triples:
+                g.add(triple)
+        xml2rdf.parseXMLDocument(r, g, entry.sdata, namespace, plan)
+        return 200, contentTypes.get(output_type, 'application/octet-stream'), g.serialize(format=output_type)
+    except Exception:
+        return 500, 'text/plain', traceback.format_exc().strip().splitlines()[-1] + '\n'
+
+## server side
+
+class ConversionService:
+    """The worker pool and admission control of a running service."""
+
+    def __init__(self, options, jobs = None, max_pending = None, max_body = None):
+        self.options = options
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.max_pending = max_pending or 2 * self.jobs
+        self.max_body = max_body
+        self.pool = multiprocessing.Pool(self.jobs, initServiceWorker, (options,))
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.counters = {'pending': 0, 'converted': 0, 'failed': 0, 'rejected': 0}
+        # requests are named after the service's start and their number
+        self.started = '{0:.6f}'.format(time.time())
+        self.requests = 0
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.counters[name] += n
+
+    def admit(self):
+        """Takes a pending slot if one is free; returns whether it did."""
+        if self.slots.acquire(False):
+            self.count('pending')
+            return True
+        self.count('rejected')
+        return False
+
+    def convert(self, body, output_type, namespace, include_schema):
+        """Converts `body` on a worker, in a slot taken by `admit`."""
+        with self.lock:
+            self.requests += 1
+            document = '{0}/{1}'.format(self.started, self.requests)
+        try:
+            status, content_type, data = self.pool.apply_async(
+                convertRequest, ((body, output_type, namespace, include_schema, document),)).get()
+        finally:
+            self.count('pending', -1)
+            self.slots.release()
+        self.count('converted' if status == 200 else 'failed')
+        return status, content_type, data
+
+    def status(self):
+        with self.lock:
+            ret = dict(self.counters)
+        ret.update({'jobs': self.jobs, 'max_pending': self.max_pending})
+        return ret
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class ConversionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # response bodies are written in pieces of this size
+    chunk_size = 1 << 16
+
+    def sendBody(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        for i in xrange(0, len(data), self.chunk_size):
+            self.wfile.write(data[i:i + self.chunk_size])
+
+    def refuse(self, status, message, retry_after = None):
+        # the request body is left unread, so the connection can't be reused
+        self.close_connection = True
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(message) + 1))
+        self.send_header('Connection', 'close')
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(message + '\n')
+
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path != '/status':
+            return self.refuse(404, 'not found')
+        self.sendBody(200, 'application/json', json.dumps(self.server.service.status(), sort_keys=True) + '\n')
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse.urlparse(self.path)
+        if url.path != '/convert':
+            return self.refuse(404, 'not found')
+        query = urlparse.parse_qs(url.query)
+        output_type = query.get('format', [service.options.output_type])[0]
+        namespace = query.get('namespace', [service.options.output_namespace])[0]
+        include_schema = query.get('schema', ['include'])[0] != 'omit'
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return self.refuse(411, 'Content-Length required')
+        length = int(length)
+        if service.max_body is not None and length > service.max_body:
+            return self.refuse(413, 'request body larger than {0} bytes'.format(service.max_body))
+        if output_type not in contentTypes:
+            return self.refuse(400, 'unknown format {0}'.format(output_type))
+        if not service.admit():
+            return self.refuse(503, 'busy', retry_after=1)
+
+        try:
+            body = self.rfile.read(length)
+        except:
+            service.count('pending', -1)
+            service.slots.release()
+            raise
+        self.sendBody(*service.convert(body, output_type, namespace, include_schema))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ConversionServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, service, verbose = False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ConversionHandler)
+        self.service = service
+        self.verbose = verbose
+
+    def handle_error(self, request, client_address):
+        # clients that hang up early are no error of the service's
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+def parseAddress(address):
+    """Splits [HOST:]PORT; the host defaults to localhost."""
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+def serve(address, options, jobs = None, max_pending = None, max_body = None, verbose = False):
+    """Runs the service on `address` ([HOST:]PORT) until interrupted."""
+    service = ConversionService(options, jobs, max_pending, max_body)
+    try:
+        server = ConversionServer(parseAddress(address), service, verbose)
+        sys.stderr.write('serving on http://{0}:{1}/convert ({2} workers, {3} pending requests at most)\n'.format(
+            server.server_address[0], server.server_address[1], service.jobs, service.max_pending))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    finally:
+        service.close()
@@ -0,0 +1,333 @@
+# triple sinks for xml2rdf / xsd2rdfs output.
+#
+# A sink is anything with the two methods of rdflib.Graph that the converters
+# use: add((s, p, o)) and bind(prefix, namespace). An rdflib.Graph is itself a
+# sink; the writers here send triples to a file handle as they are produced
+# instead of collecting them first.
+
+import os
+import re
+import hashlib
+
+import rdflib
+
+def _escapeNonASCII(s):
+    """Escapes non-ASCII characters of `s` as N-Triples \\u / \\U sequences."""
+    try:
+        return s.encode('ascii')
+    except UnicodeEncodeError:
+        ret = []
+        for c in s:
+            o = ord(c)
+            if o < 0x80:
+                ret.append(c)
+            elif o < 0x10000:
+                ret.append('\\u%04X' % o)
+            else:
+                ret.append('\\U%08X' % o)
+        return ''.join(ret).encode('ascii')
+
+def quoteLexical(l):
+    """Returns the lexical form of a literal as a quoted N-Triples (and
+       Turtle) string."""
+    return u'"%s"' % l.replace('\\', '\\\\') \
+        .replace('\n', '\\n') \
+        .replace('"', '\\"') \
+        .replace('\r', '\\r')
+
+def quoteLiteral(l):
+    """Returns the N-Triples form of an rdflib.Literal."""
+    encoded = quoteLexical(l)
+
+    if l.language:
+        return u'%s@%s' % (encoded, l.language)
+    elif l.datatype:
+        return u'%s^^<%s>' % (encoded, l.datatype)
+    else:
+        return encoded
+
+def ntTerm(t):
+    """Returns the N-Triples form of an rdflib term."""
+    if isinstance(t, rdflib.Literal):
+        return quoteLiteral(t)
+    elif isinstance(t, rdflib.BNode):
+        return u'_:%s' % t
+    else:
+        return u'<%s>' % t
+
+# prefixes and local names that are safe to write in prefixed names
+_turtlePrefix = re.compile(r'([A-Za-z][A-Za-z0-9_-]*)?\Z')
+_turtleLocal = re.compile(r'[A-Za-z_][A-Za-z0-9_-]*\Z')
+
+# the prefixes an rdflib.Graph starts with
+defaultNamespaces = (
+    ('xml', u'http://www.w3.org/XML/1998/namespace'),
+    ('rdf', u'http://www.w3.org/1999/02/22-rdf-syntax-ns#'),
+    ('rdfs', u'http://www.w3.org/2000/01/rdf-schema#'),
+    ('xsd', u'http://www.w3.org/2001/XMLSchema#'),
+)
+
+class TurtleTerms:
+    """Formats rdflib terms for Turtle, abbreviating URIs in the namespaces
+       of `namespaces` ((prefix, namespace) pairs, e.g. graph.namespaces())
+       and of later `bind` calls. The first prefix bound to a namespace is
+       used; prefixes that can't be written in Turtle are left out."""
+
+    def __init__(self, namespaces = ()):
+        self.prefixes = {}
+        self.taken = set()
+        for prefix, namespace in namespaces:
+            self.bind(prefix, namespace)
+
+    def bind(self, prefix, namespace):
+        """Adds a namespace binding; returns the @prefix line for it, or None
+           if it isn't used."""
+        prefix = prefix or u''
+        namespace = unicode(namespace)
+        if namespace in self.prefixes or prefix in self.taken or not _turtlePrefix.match(prefix):
+            return None
+        self.prefixes[namespace] = prefix
+        self.taken.add(prefix)
+        return u'@prefix %s: <%s> .\n' % (prefix, namespace)
+
+    def declarations(self):
+        """Returns the @prefix lines for the namespaces, sorted by prefix."""
+        return u''.join(u'@prefix %s: <%s> .\n' % (prefix, namespace)
+                        for prefix, namespace in sorted((p, n) for n, p in self.prefixes.iteritems()))
+
+    def uri(self, uri):
+        i = max(uri.rfind('#'), uri.rfind('/')) + 1
+        prefix = self.prefixes.get(uri[:i])
+        if prefix is not None and _turtleLocal.match(uri, i):
+            return u'%s:%s' % (prefix, uri[i:])
+        return u'<%s>' % uri
+
+    def predicate(self, p):
+        if p == rdflib.namespace.RDF.type:
+            return u'a'
+        return self.uri(p)
+
+    def term(self, t):
+        if isinstance(t, rdflib.Literal):
+            if t.language:
+                return u'%s@%s' % (quoteLexical(t), t.language)
+            elif t.datatype:
+                return u'%s^^%s' % (quoteLexical(t), self.uri(t.datatype))
+            return quoteLexical(t)
+        elif isinstance(t, rdflib.BNode):
+            return u'_:%s' % t
+        return self.uri(t)
+
+class NTriplesSink:
+    """Writes triples to `out` as N-Triples lines, or as N-Quads lines if a
+       `context` URIRef is given.
+
+       Nothing is kept in memory, so repeated triples are written repeatedly;
+       this is harmless for N-Triples consumers, which treat the output as a
+       set."""
+
+    def __init__(self, out, context=None):
+        self.out = out
+        self.context = context
+        if context is not None:
+            self.suffix = u' %s .\n' % ntTerm(context)
+        else:
+            self.suffix = u' .\n'
+        self.count = 0
+
+    def add(self, triple):
+        s, p, o = triple
+        self.count += 1
+        self.out.write(_escapeNonASCII(u'%s %s %s%s' % (ntTerm(s), ntTerm(p), ntTerm(o), self.suffix)))
+
+    def bind(self, prefix, namespace):
+        # N-Triples has no prefixes
+        pass
+
+    def flush(self):
+        # lines are written as they come
+        pass
+
+    def addEncoded(self, data, count):
+        """Writes `count` triples already encoded by a sink like this one
+           (e.g. in another process)."""
+        self.count += count
+        self.out.write(data)
+
+class TurtleSink:
+    """Writes triples to `out` as Turtle (which is also N3), a block per
+       subject.
+
+       Triples are held back and grouped by subject until `flush` is called,
+       or until `limit` of them (if not None) are waiting. Passed as the
+       converter's `subtree_done` (see xml2rdf.parseXMLDocument), `flush` is
+       called after each subtree under the root, so a subject is usually
+       written in one block; the root node gets a block per subtree.
+       Prefixes bound before the first flush are declared at the top, later
+       ones where they are bound. Call `flush` at the end. Repeated triples
+       are only dropped within a block."""
+
+    def __init__(self, out, limit = 100000):
+        self.out = out
+        self.limit = limit
+        self.terms = TurtleTerms(defaultNamespaces)
+        self.predicates = {}
+        self.subjects = []
+        self.blocks = {}
+        self.waiting = 0
+        self.started = False
+        self.count = 0
+
+    def add(self, triple):
+        s, p, o = triple
+        block = self.blocks.get(s)
+        if block is None:
+            block = self.blocks[s] = []
+            self.subjects.append(s)
+        block.append((p, o))
+        self.count += 1
+        self.waiting += 1
+        if self.limit and self.waiting >= self.limit:
+            self.flush()
+
+    def bind(self, prefix, namespace):
+        declaration = self.terms.bind(prefix, namespace)
+        if declaration and self.started:
+            self.out.write(declaration.encode('utf-8'))
+
+    def predicate(self, p):
+        try:
+            return self.predicates[p]
+        except KeyError:
+            ret = self.predicates[p] = self.terms.predicate(p)
+            return ret
+
+    def flush(self):
+        """Writes the triples held back so far."""
+        write = self.out.write
+        if not self.started:
+            self.started = True
+            write(self.terms.declarations().encode('utf-8'))
+        term = self.terms.term
+        for s in self.subjects:
+            # objects of the same predicate are listed together
+            objects = {}
+            predicates = []
+            seen = set()
+            for p, o in self.blocks[s]:
+                if (p, o) in seen:
+                    continue
+                seen.add((p, o))
+                if p not in objects:
+                    objects[p] = []
+                    predicates.append(p)
+                objects[p].append(term(o))
+            lines = [u'%s %s' % (self.predicate(p), u' , '.join(objects[p])) for p in predicates]
+            write((u'\n%s %s .\n' % (term(s), u' ;\n    '.join(lines))).encode('utf-8'))
+        self.subjects = []
+        self.blocks = {}
+        self.waiting = 0
+
+class ListSink:
+    """Collects triples in a list, in the order they are added."""
+
+    def __init__(self):
+        self.triples = []
+
+    def add(self, triple):
+        self.triples.append(triple)
+
+    def bind(self, prefix, namespace):
+        pass
+
+class TeeSink:
+    """Sends every triple and namespace binding to each of `sinks`, so one
+       conversion pass can feed several graphs or writers."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self.adds = [sink.add for sink in sinks]
+
+    def add(self, triple):
+        for add in self.adds:
+            add(triple)
+
+    def bind(self, prefix, namespace):
+        for sink in self.sinks:
+            sink.bind(prefix, namespace)
+
+class _HashingFile:
+    """Write-only file that keeps a running SHA-256 and size of its content."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'wb')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self.f.close()
+
+class ShardedSink:
+    """Writes triples as N-Triples (or N-Quads, given a `context`) spread
+       over several files, named by `shardPath(index)`.
+
+       The converter calls `subtreeDone` at points where output may be split
+       (see xml2rdf.parseXMLDocument); triples between two such points always
+       go to the same shard, so blank nodes are never split across files.
+       With `shards`, each subtree goes to the shard with the fewest triples
+       so far; with `shard_size`, a new shard is started once the current one
+       has reached that many triples."""
+
+    def __init__(self, shard_path, shards = None, shard_size = None, context = None):
+        if not shards and not shard_size:
+            raise ValueError('need a number of shards or a shard size')
+        self.shardPath = shard_path
+        self.shard_size = shard_size
+        self.context = context
+        self.files = []
+        self.sinks = []
+        for i in xrange(shards or 1):
+            self.openShard()
+        self.current = self.sinks[0]
+
+    def openShard(self):
+        f = _HashingFile(self.shardPath(len(self.files)))
+        self.files.append(f)
+        self.sinks.append(NTriplesSink(f, self.context))
+        return self.sinks[-1]
+
+    def add(self, triple):
+        if self.current is None:
+            # started lazily, so that no shard is left empty
+            self.current = self.openShard()
+        self.current.add(triple)
+
+    def bind(self, prefix, namespace):
+        pass
+
+    def subtreeDone(self):
+        if self.shard_size:
+            if self.current is not None and self.current.count >= self.shard_size:
+                self.current = None
+        else:
+            self.current = min(self.sinks, key=lambda sink: sink.count)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def manifest(self):
+        """Returns the shard list for a manifest: file name, triple count,
+           size and SHA-256 of each shard."""
+        return [{
+            'file': os.path.basename(f.path),
+            'triples': sink.count,
+            'bytes': f.size,
+            'sha256': f.sha256.hexdigest(),
+        } for f, sink in zip(self.files, self.sinks)]
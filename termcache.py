@@ -0,0 +1,42 @@
+# interning of frequently built rdflib terms.
+#
+# The converters build the same few hundred predicate and type URIRefs for
+# millions of elements; a TermCache builds each of them once and hands out
+# the shared instance afterwards.
+
+DEFAULT_MAXSIZE = 65536
+
+class TermCache:
+    """Bounded cache of terms built by `factory(key)`, with hit and miss
+       counters.
+
+       When the cache is full it is emptied, rather than evicting entries one
+       by one; caches are meant for keys from a small vocabulary (tag and
+       attribute names), so in practice they never fill up."""
+
+    def __init__(self, factory, maxsize=DEFAULT_MAXSIZE):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.terms = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, key):
+        try:
+            term = self.terms[key]
+        except KeyError:
+            self.misses += 1
+            if len(self.terms) >= self.maxsize:
+                self.terms.clear()
+            term = self.terms[key] = self.factory(key)
+            return term
+        self.hits += 1
+        return term
+
+    def clear(self):
+        self.terms.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.terms)}
@@ -0,0 +1,110 @@
+# batch conversion into an output directory (rdfify2.py --outdir): documents
+# that fail leave no output file behind, output files get the usual mode and
+# inputs in subdirectories get their own output files.
+
+import sys
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rdflib
+
+import rdfify2
+
+NS = 'http://example.org/out'
+
+GOOD = '<root xmlns="urn:x"><a><b>1</b></a><a><b>2</b></a></root>'
+# fails half-way through, after the first subtrees were written
+BAD = '<root xmlns="urn:x"><a><b>1</b></a><a><b>2</b></a><a>'
+
+class OutdirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.directory, 'out')
+        os.mkdir(self.outdir)
+        for name, body in (('good.xml', GOOD), ('bad.xml', BAD)):
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(body)
+
+    def tearDown(self):
+        rdfify2._batchWorker = None
+        shutil.rmtree(self.directory)
+
+    def convert(self, output_type, **kwargs):
+        options = rdfify2.BatchOptions(NS, output_type, self.outdir, **kwargs)
+        rdfify2.initBatchWorker(rdfify2.SchemaData(), [], [], options)
+        return [rdfify2._convertBatchDocument(os.path.join(self.directory, name),
+                                              rdfify2.batchOutputPath(name, self.outdir, output_type))
+                for name in ('good.xml', 'bad.xml')]
+
+    def assertOnlyGoodOutput(self, results, output_type):
+        (_, count, error), (_, bad_count, bad_error) = results
+        self.assertEqual(error, None)
+        self.assertTrue(bad_error)
+        self.assertEqual(bad_count, None)
+        name = 'good.' + rdfify2.outputExtensions.get(output_type, output_type)
+        self.assertEqual(os.listdir(self.outdir), [name])
+        g = rdflib.Graph().parse(os.path.join(self.outdir, name), format=output_type)
+        self.assertEqual(len(g), count)
+        umask = rdfify2.currentUmask()
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.outdir, name)).st_mode), 0666 & ~umask)
+
+    def testGraph(self):
+        self.assertOnlyGoodOutput(self.convert('turtle'), 'turtle')
+
+    def testStream(self):
+        self.assertOnlyGoodOutput(self.convert('nt', stream=True), 'nt')
+
+    def testStreamIterparse(self):
+        self.assertOnlyGoodOutput(self.convert('nt', stream=True, iterparse=True), 'nt')
+
+    def testModeFollowsUmask(self):
+        old = os.umask(0027)
+        try:
+            (_, _, error), _ = self.convert('nt', stream=True)
+        finally:
+            os.umask(old)
+        self.assertEqual(error, None)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.outdir, 'good.nt')).st_mode), 0640)
+
+class SubdirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputs = os.path.join(self.directory, 'col')
+        self.outdir = os.path.join(self.directory, 'out')
+        for sub, body in (('a', GOOD), ('b', '<root xmlns="urn:x"><c>3</c></root>')):
+            os.makedirs(os.path.join(self.inputs, sub))
+            with open(os.path.join(self.inputs, sub, 'x.xml'), 'w') as f:
+                f.write(body)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convertInputs(self, inputs):
+        inputs = rdfify2.expandInputs(inputs)
+        options = rdfify2.BatchOptions(NS, 'nt', self.outdir, stream=True)
+        return rdfify2.runBatch([xmlfile for xmlfile, name in inputs], None, options, jobs=1,
+                                names=[name for xmlfile, name in inputs])
+
+    def testSameNamesInSubdirectories(self):
+        self.assertEqual(self.convertInputs([self.inputs]), 0)
+        a = rdflib.Graph().parse(os.path.join(self.outdir, 'a', 'x.nt'), format='nt')
+        b = rdflib.Graph().parse(os.path.join(self.outdir, 'b', 'x.nt'), format='nt')
+        self.assertIn(rdflib.Literal('2'), set(a.objects()))
+        self.assertIn(rdflib.Literal('3'), set(b.objects()))
+
+    def testSameOutputFileFails(self):
+        # named files are written under their base name, so these collide
+        failures = self.convertInputs([os.path.join(self.inputs, 'a', 'x.xml'), os.path.join(self.inputs, 'b', 'x.xml')])
+        self.assertEqual(failures, 1)
+        a = rdflib.Graph().parse(os.path.join(self.outdir, 'x.nt'), format='nt')
+        self.assertIn(rdflib.Literal('2'), set(a.objects()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# blank node labels (bnodes.py, --bnodes): counter and path labels give
+# byte-identical output when the same document is converted again.
+
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+rdfify2_path = os.path.join(here, '..', 'rdfify2.py')
+
+DOCUMENT = '''<root xmlns="urn:x" xmlns:x="urn:x">
+  <a x:id="a1"><b>1</b><c><g>one</g></c></a>
+  <a><b>3</b><d><e>three</e></d></a>
+  <a><b>4</b><d><e>four</e><e>vier</e></d></a>
+  <f>text</f>
+</root>
+'''
+
+class RepeatableLabelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xmlfile = os.path.join(self.directory, 'doc.xml')
+        with open(self.xmlfile, 'w') as f:
+            f.write(DOCUMENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, allocator, *args):
+        outfile = os.path.join(self.directory, 'out.nt')
+        subprocess.check_call([sys.executable, rdfify2_path, '-t', 'nt', '-n', 'http://example.org/out',
+                               '-o', outfile, '--bnodes', allocator] + list(args) + [self.xmlfile],
+                              stderr=open(os.devnull, 'w'))
+        with open(outfile, 'rb') as f:
+            return f.read()
+
+    def assertRepeatable(self, allocator, *args):
+        first = self.convert(allocator, *args)
+        self.assertIn('_:', first)
+        self.assertEqual(first, self.convert(allocator, *args))
+        return first
+
+    def testCounter(self):
+        self.assertRepeatable('counter')
+        self.assertRepeatable('counter', '--stream')
+        self.assertRepeatable('counter', '--split-depth', '1', '-j', '2')
+
+    def testPath(self):
+        whole = self.assertRepeatable('path')
+        streamed = self.assertRepeatable('path', '--stream')
+        split = self.assertRepeatable('path', '--split-depth', '1', '-j', '2')
+        # path labels don't depend on the order of conversion either
+        self.assertEqual(sorted(streamed.splitlines()), sorted(whole.splitlines()))
+        self.assertEqual(sorted(split.splitlines()), sorted(whole.splitlines()))
+
+    def testBatch(self):
+        other = os.path.join(self.directory, 'other.xml')
+        shutil.copy(self.xmlfile, other)
+        self.assertRepeatable('counter', other)
+        self.assertRepeatable('path', other)
+
+    def testUUID(self):
+        self.assertNotEqual(self.convert('uuid', '--stream'), self.convert('uuid', '--stream'))
+
+if __name__ == '__main__':
+    unittest.main()
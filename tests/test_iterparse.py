@@ -0,0 +1,68 @@
+# parseXMLStream (--iterparse) against parseXMLDocument, on documents with
+# comments and processing instructions before the root element.
+
+import sys
+import os
+import unittest
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+from rdflib.compare import isomorphic
+
+import rdfify2
+import xml2rdf
+import sinks
+
+NS = 'http://example.org/out'
+
+PROLOG_PI = '''<?xml version="1.0"?>
+<?xml-stylesheet type="text/xsl" href="style.xsl"?>
+<root xmlns="urn:x" xmlns:x="urn:x"><a x:id="1"><b>text</b></a><!-- c --><a><b>more</b></a></root>
+'''
+
+PROLOG_COMMENT = '''<?xml version="1.0"?>
+<!-- generated -->
+<?pi one?>
+<!-- and again -->
+<root xmlns="urn:x"><a><b>text</b></a>tail<a/></root>
+'''
+
+def streamGraph(document):
+    g = rdflib.Graph()
+    xml2rdf.parseXMLStream(cStringIO.StringIO(document), g, rdfify2.SchemaData(), NS)
+    return g
+
+def treeGraph(document):
+    g = rdflib.Graph()
+    r = lxml.etree.parse(cStringIO.StringIO(document)).getroot()
+    xml2rdf.parseXMLDocument(r, g, rdfify2.SchemaData(), NS)
+    return g
+
+class PrologTest(unittest.TestCase):
+
+    def assertSameAsTree(self, document):
+        streamed = streamGraph(document)
+        self.assertTrue(len(streamed) > 0)
+        self.assertTrue(isomorphic(streamed, treeGraph(document)))
+
+    def testProcessingInstruction(self):
+        self.assertSameAsTree(PROLOG_PI)
+
+    def testComment(self):
+        self.assertSameAsTree(PROLOG_COMMENT)
+
+    def testTurtleKeepsRoot(self):
+        out = cStringIO.StringIO()
+        sink = sinks.TurtleSink(out)
+        xml2rdf.parseXMLStream(cStringIO.StringIO(PROLOG_PI), sink, rdfify2.SchemaData(), NS, subtree_done=sink.flush)
+        sink.flush()
+        g = rdflib.Graph().parse(data=out.getvalue(), format='turtle')
+        root = rdflib.URIRef(NS + '#')
+        self.assertIn((root, rdflib.RDF.type, rdflib.URIRef('urn:x#root')), g)
+        self.assertTrue(isomorphic(g, treeGraph(PROLOG_PI)))
+
+if __name__ == '__main__':
+    unittest.main()
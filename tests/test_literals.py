@@ -0,0 +1,99 @@
+# literals for leaf text and attribute values (literals.py, --literals):
+# plain literals as before, typed ones in lexical and validate mode, and
+# plain fallbacks for invalid values under validate.
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+
+import bnodes
+import instrumentation
+import literals
+import rdfify2
+import xml2rdf
+
+NS = 'http://example.org/out'
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+XSDNS = rdflib.Namespace('http://www.w3.org/2001/XMLSchema#')
+
+DOCUMENT = '''<root xmlns="urn:x" xmlns:x="urn:x">
+  <item x:on="2014-05-01"><n> 42 </n><s> keep  spaces </s></item>
+  <item x:on="May 1st"><n>forty-two</n><n>99999999999</n></item>
+</root>'''
+
+def schemaData():
+    sdata = rdfify2.SchemaData()
+    sdata.elementMap.update({'{urn:x}n': XSD + 'int', '{urn:x}s': XSD + 'string'})
+    sdata.attributeMap.update({'{urn:x}on': XSD + 'date'})
+    return sdata
+
+def convert(literal_mode = None):
+    sdata = schemaData()
+    if literal_mode is None:
+        plan = xml2rdf.ConversionPlan(sdata, NS, bnodes.CounterAllocator())
+    else:
+        plan = xml2rdf.ConversionPlan(sdata, NS, bnodes.CounterAllocator(), literal_mode=literal_mode)
+    g = rdflib.Graph()
+    xml2rdf.parseXMLDocument(lxml.etree.fromstring(DOCUMENT), g, sdata, NS, plan)
+    return g
+
+def objects(g, predicate):
+    return sorted(g.objects(None, rdflib.URIRef('urn:x#' + predicate)))
+
+class LiteralTest(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def testPlainIsUnchanged(self):
+        g = convert('plain')
+        self.assertEqual(sorted(g), sorted(convert()))
+        for s, p, o in g:
+            if isinstance(o, rdflib.Literal):
+                self.assertEqual(o.datatype, None)
+        self.assertEqual(objects(g, 'n'), sorted([rdflib.Literal(' 42 '), rdflib.Literal('forty-two'),
+                                                  rdflib.Literal('99999999999')]))
+        self.assertIs(literals.literalConverter(XSD + 'int', 'plain'), rdflib.Literal)
+
+    def testLexical(self):
+        g = convert('lexical')
+        n = objects(g, 'n')
+        # values are typed as they are, whitespace stripped, without checking
+        self.assertIn(rdflib.Literal('42', datatype=XSDNS.int), n)
+        self.assertIn(rdflib.Literal('forty-two', datatype=XSDNS.int), n)
+        self.assertIn(rdflib.Literal('2014-05-01', datatype=XSDNS.date), objects(g, 'on'))
+        # xsd:string stays plain, and keeps its (collapsed) surrounding spaces
+        self.assertEqual(objects(g, 's'), [rdflib.Literal(' keep spaces ')])
+
+    def testValidate(self):
+        stats = instrumentation.enable()
+        g = convert('validate')
+        n = objects(g, 'n')
+        self.assertIn(rdflib.Literal('42', datatype=XSDNS.int), n)
+        self.assertEqual(n[[o.toPython() for o in n].index(42)].datatype, XSDNS.int)
+        # not an int, and out of the int range: plain literals
+        self.assertIn(rdflib.Literal('forty-two'), n)
+        self.assertIn(rdflib.Literal('99999999999'), n)
+        on = objects(g, 'on')
+        self.assertIn(rdflib.Literal('2014-05-01', datatype=XSDNS.date), on)
+        self.assertIn(rdflib.Literal('May 1st'), on)
+        self.assertEqual(stats.counters['literals.invalid'], 3)
+
+    def testValidator(self):
+        valid = literals.lexicalValidator(XSD + 'unsignedByte')
+        self.assertTrue(valid('255'))
+        self.assertFalse(valid('256'))
+        self.assertFalse(valid('-1'))
+        self.assertTrue(literals.lexicalValidator(XSD + 'dateTime')('2014-05-01T12:00:00Z'))
+        self.assertFalse(literals.lexicalValidator(XSD + 'boolean')('yes'))
+
+    def testUnknownMode(self):
+        self.assertRaises(ValueError, literals.literalConverter, XSD + 'int', 'typed')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# incremental conversion (rdfdelta.py): the fingerprint index of one version
+# and the delta to the next, as RDF Patch rows and as a SPARQL Update.
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rdflib
+
+import rdfdelta
+
+NS = 'http://example.org/out'
+
+SCHEMA = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:x">
+  <xs:attribute name="id" type="xs:ID"/>
+  <xs:attribute name="ref" type="xs:IDREF"/>
+</xs:schema>
+'''
+
+OLD = '''<root xmlns="urn:x" xmlns:x="urn:x">
+  <item x:id="a1"><name>one</name></item>
+  <item x:id="a2"><name>two</name></item>
+  <group><entry>alpha</entry></group>
+  <link x:ref="a1"/>
+  <link x:ref="a1"/>
+</root>
+'''
+
+NEW = '''<root xmlns="urn:x" xmlns:x="urn:x">
+  <item x:id="a1"><name>one</name></item>
+  <item x:id="a2"><name>zwei</name></item>
+  <group><entry>beta</entry></group>
+  <link x:ref="a1"/>
+</root>
+'''
+
+class Lines:
+    """A patch that keeps the lines it is given."""
+    def __init__(self):
+        self.removed = []
+        self.added = []
+
+    def remove(self, line):
+        self.removed.append(line)
+
+    def add(self, line):
+        self.added.append(line)
+
+def parseLines(lines):
+    return rdflib.Graph().parse(data=''.join(lines), format='nt')
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.schema = self.write('x.xsd', SCHEMA)
+        self.old = self.write('old.xml', OLD)
+        self.new = self.write('new.xml', NEW)
+        self.index_path = os.path.join(self.directory, 'old.idx')
+        rdfdelta.deltaConvert(self.old, None, None, [self.schema], NS, index_path=self.index_path)
+        self.index = rdfdelta.FingerprintIndex(self.index_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def fullConversion(self, xmlfile):
+        lines = Lines()
+        rdfdelta.deltaConvert(xmlfile, None, lines, [self.schema], NS)
+        return set(lines.added)
+
+    def delta(self, patch, index_path = None):
+        return rdfdelta.deltaConvert(self.new, self.index, patch, [self.schema], NS, index_path=index_path)
+
+    def testIndex(self):
+        # the root and five subtrees, the two identical links told apart
+        keys = self.index.keys()
+        self.assertEqual(len(keys), 6)
+        self.assertEqual(len([key for key in keys if key.startswith(rdfdelta.ROOT_KEY)]), 1)
+        link = '<{0}#> <urn:x#link> <{0}#a1> .\n'.format(NS)
+        self.assertEqual(len(self.index.statingUnits(link)), 2)
+        triples = set()
+        for key in keys:
+            triples.update(self.index.triples(key))
+        self.assertEqual(triples, self.fullConversion(self.old))
+
+    def testExactDelta(self):
+        lines = Lines()
+        # only the two changed subtrees are converted
+        self.assertEqual(self.delta(lines), 2)
+        old, new = self.fullConversion(self.old), self.fullConversion(self.new)
+        self.assertEqual(set(lines.removed), old - new)
+        self.assertEqual(set(lines.added), new - old)
+        self.assertEqual(lines.removed, sorted(lines.removed))
+
+        removed, added = parseLines(lines.removed), parseLines(lines.added)
+        self.assertIn((rdflib.URIRef(NS + '#a2'), rdflib.URIRef('urn:x#name'), rdflib.Literal('two')), removed)
+        self.assertIn((rdflib.URIRef(NS + '#a2'), rdflib.URIRef('urn:x#name'), rdflib.Literal('zwei')), added)
+        # the changed group is a blank node, labelled after its content
+        self.assertEqual(len([l for l in lines.removed if l.startswith('_:')]), 2)
+        self.assertEqual(len([l for l in lines.added if l.startswith('_:')]), 2)
+        self.assertIn(rdflib.Literal('alpha'), set(removed.objects()))
+        self.assertIn(rdflib.Literal('beta'), set(added.objects()))
+        # a link is still stated by the remaining unit
+        self.assertNotIn(rdflib.URIRef('urn:x#link'), set(removed.predicates()))
+
+    def testPatchFormat(self):
+        out = cStringIO.StringIO()
+        patch = rdfdelta.PatchWriter(out)
+        self.delta(patch)
+        lines = Lines()
+        self.delta(lines)
+        self.assertEqual(out.getvalue(), ''.join(['D ' + line for line in lines.removed] +
+                                                 ['A ' + line for line in lines.added]))
+        self.assertEqual((patch.removed, patch.added), (len(lines.removed), len(lines.added)))
+
+    def testSparqlUpdate(self):
+        authority = rdfdelta.skolemAuthority(NS)
+        out = cStringIO.StringIO()
+        patch = rdfdelta.SparqlUpdateWriter(out, authority)
+        self.delta(patch)
+        patch.close()
+        update = out.getvalue()
+        self.assertTrue(update.startswith('DELETE DATA {\n'))
+        self.assertIn('} ;\nINSERT DATA {\n', update)
+        self.assertNotIn('_:', update)
+
+        # applied to the old version, the update gives the new one
+        skolemized = lambda lines: parseLines([rdfdelta.skolemizeLine(line, authority) for line in lines])
+        g = skolemized(self.fullConversion(self.old))
+        g.update(update)
+        self.assertEqual(set(g), set(skolemized(self.fullConversion(self.new))))
+
+    def testWrittenIndex(self):
+        new_index = os.path.join(self.directory, 'new.idx')
+        self.delta(Lines(), new_index)
+        index = rdfdelta.FingerprintIndex(new_index)
+        try:
+            lines = Lines()
+            rdfdelta.deltaConvert(self.new, index, lines, [self.schema], NS)
+            self.assertEqual((lines.removed, lines.added), ([], []))
+        finally:
+            index.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# RDFS from schemata (xsd2rdfs.py): definitions that change between
+# incremental loads into the same SchemaData replace their RDFS triples
+# instead of adding conflicting ones; cycles of base types are broken, and
+# anonymous types are named after their declaration.
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+
+import rdfify2
+import xsd2rdfs
+import xml2rdf
+
+SCHEMA = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:x" xmlns:x="urn:x">
+{0}
+</xs:schema>
+'''
+
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+
+class SchemaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.versions = 0
+        self.g = rdflib.Graph()
+        self.sdata = rdfify2.SchemaData()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, definitions):
+        # each version of the schema is a new location, as the loader skips
+        # locations it has visited
+        self.versions += 1
+        path = os.path.join(self.directory, 'v{0}.xsd'.format(self.versions))
+        with open(path, 'w') as f:
+            f.write(SCHEMA.format(definitions))
+        xsd2rdfs.parseXMLSchemata([path], self.g, self.sdata)
+
+    def ranges(self, name):
+        return sorted(str(o).split('#')[-1] for o in self.g.objects(rdflib.URIRef('urn:x#' + name), rdflib.RDFS.range))
+
+class ReloadTest(SchemaTestCase):
+
+    def testChangedElementType(self):
+        self.load('<xs:element name="a" type="xs:string"/><xs:element name="b" type="xs:string"/>')
+        self.assertEqual(self.ranges('a'), ['string'])
+        self.load('<xs:element name="a" type="xs:int"/>')
+        self.assertEqual(self.ranges('a'), ['int'])
+        self.assertEqual(self.ranges('b'), ['string'])
+
+    def testChangedComplexTypeBase(self):
+        self.load('''<xs:complexType name="T"><xs:complexContent><xs:extension base="x:A"/></xs:complexContent>
+                     </xs:complexType>''')
+        self.load('''<xs:complexType name="T"><xs:complexContent><xs:extension base="x:B"/></xs:complexContent>
+                     </xs:complexType>''')
+        bases = sorted(str(o) for o in self.g.objects(rdflib.URIRef('urn:x#T'), rdflib.RDFS.subClassOf))
+        self.assertEqual(bases, ['urn:x#B'])
+
+    def testSimpleTypeDefinedLater(self):
+        self.load('<xs:attribute name="c" type="x:S"/>')
+        self.assertEqual(self.ranges('c'), ['S'])
+        self.load('<xs:simpleType name="S"><xs:restriction base="xs:int"/></xs:simpleType>')
+        self.assertEqual(self.ranges('c'), ['int'])
+
+    def testSharedPropertyKeepsOtherRange(self):
+        self.load('<xs:element name="d" type="xs:string"/><xs:attribute name="d" type="xs:string"/>')
+        self.load('<xs:element name="d" type="xs:int"/>')
+        self.assertEqual(self.ranges('d'), ['int', 'string'])
+
+class TypeTest(SchemaTestCase):
+
+    def testCyclicSimpleTypes(self):
+        self.load('''<xs:simpleType name="S1"><xs:restriction base="x:S2"/></xs:simpleType>
+                     <xs:simpleType name="S2"><xs:restriction base="x:S1"/></xs:simpleType>
+                     <xs:simpleType name="S3"><xs:restriction base="x:S1"/></xs:simpleType>
+                     <xs:element name="a" type="x:S3"/>''')
+        self.assertEqual(self.ranges('a'), ['string'])
+        cycles = set()
+        resolved = xsd2rdfs.resolveSimpleTypes({'{urn:x}S1': '{urn:x}S2', '{urn:x}S2': '{urn:x}S1',
+                                                '{urn:x}S3': '{urn:x}S1'}, cycles)
+        self.assertEqual(cycles, set(['{urn:x}S1', '{urn:x}S2']))
+        self.assertEqual(set(resolved.values()), set([XSD + 'string']))
+
+    def testCyclicComplexTypes(self):
+        self.load('''<xs:complexType name="C1"><xs:complexContent><xs:extension base="x:C2"/></xs:complexContent>
+                     </xs:complexType>
+                     <xs:complexType name="C2"><xs:complexContent><xs:extension base="x:C1"/></xs:complexContent>
+                     </xs:complexType>
+                     <xs:element name="e" type="x:C1"/>''')
+        types = xsd2rdfs.TypeResolver(self.sdata)
+        self.assertEqual(types.cycles, set(['{urn:x}C1', '{urn:x}C2']))
+        self.assertEqual(types.datatype('{urn:x}C1'), None)
+        # typed literals need the resolver; the element still converts
+        plan = xml2rdf.ConversionPlan(self.sdata, 'http://example.org/out', literal_mode='lexical')
+        g = rdflib.Graph()
+        xml2rdf.parseXMLDocument(lxml.etree.fromstring('<e xmlns="urn:x"><e>v</e></e>'), g, self.sdata,
+                                 'http://example.org/out', plan)
+        self.assertIn(rdflib.Literal('v'), set(g.objects()))
+
+    def testAnonymousSimpleContent(self):
+        self.load('''<xs:element name="price"><xs:complexType><xs:simpleContent>
+                       <xs:extension base="xs:decimal"><xs:attribute name="currency" type="xs:string"/></xs:extension>
+                     </xs:simpleContent></xs:complexType></xs:element>''')
+        self.assertEqual(self.sdata.elementMap['{urn:x}price'], '{urn:x}price.type')
+        self.assertEqual(self.ranges('price'), ['price.type'])
+        self.assertIn((rdflib.URIRef('urn:x#price.type'), rdflib.RDFS.subClassOf,
+                       rdflib.URIRef('http://www.w3.org/2001/XMLSchema#decimal')), self.g)
+        self.assertEqual(xsd2rdfs.TypeResolver(self.sdata).datatype('{urn:x}price.type'), XSD + 'decimal')
+
+        plan = xml2rdf.ConversionPlan(self.sdata, 'http://example.org/out', literal_mode='lexical')
+        g = rdflib.Graph()
+        xml2rdf.parseXMLDocument(lxml.etree.fromstring('<r xmlns="urn:x"><price>1.50</price></r>'), g,
+                                 self.sdata, 'http://example.org/out', plan)
+        self.assertIn(rdflib.Literal('1.50', datatype=rdflib.URIRef('http://www.w3.org/2001/XMLSchema#decimal')),
+                      set(g.objects()))
+
+if __name__ == '__main__':
+    unittest.main()
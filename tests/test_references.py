@@ -0,0 +1,69 @@
+# --check-refs bookkeeping (xml2rdf.recordReferences, refindex.py): only
+# xs:IDREF and xs:IDREFS values are references.
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+
+import rdfify2
+import xml2rdf
+import refindex
+
+NS = 'http://example.org/out'
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+
+def schemaData():
+    sdata = rdfify2.SchemaData()
+    sdata.attributeMap.update({
+        '{urn:x}id': XSD + 'ID',
+        '{urn:x}ref': XSD + 'IDREF',
+        '{urn:x}refs': XSD + 'IDREFS',
+        '{urn:x}name': XSD + 'NCName',
+    })
+    return sdata
+
+def convert(document):
+    references = refindex.ReferenceIndex()
+    plan = xml2rdf.ConversionPlan(schemaData(), NS, references=references)
+    g = rdflib.Graph()
+    xml2rdf.parseXMLDocument(lxml.etree.fromstring(document), g, plan.schema_data, NS, plan)
+    return g, references.check()
+
+class ReferenceTest(unittest.TestCase):
+
+    def testNCNameIsNotAReference(self):
+        g, report = convert('''<root xmlns="urn:x" xmlns:x="urn:x">
+            <item x:id="a" x:name="widget"/>
+            <link x:ref="a"/>
+            <named x:name="gadget"/>
+        </root>''')
+        self.assertTrue(report.ok())
+        self.assertEqual(report.ids, 1)
+        self.assertEqual(report.refs, 1)
+        # NCName values still label nodes
+        self.assertIn((rdflib.URIRef(NS + '#'), rdflib.URIRef('urn:x#named'), rdflib.URIRef(NS + '#gadget')), g)
+
+    def testIDREFSValuesAreSplit(self):
+        g, report = convert('''<root xmlns="urn:x" xmlns:x="urn:x">
+            <item x:id="a"/><item x:id="b"/>
+            <links x:refs=" a  b
+                c "/>
+        </root>''')
+        self.assertEqual(report.refs, 3)
+        self.assertEqual(report.unresolved, [('c', 1)])
+        self.assertFalse(report.ok())
+
+    def testDuplicateAndMissing(self):
+        g, report = convert('''<root xmlns="urn:x" xmlns:x="urn:x">
+            <item x:id="a"/><item x:id="a"/><link x:ref="b"/>
+        </root>''')
+        self.assertEqual(report.duplicates, [('a', 2)])
+        self.assertEqual(report.unresolved, [('b', 1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# the on-disk schema cache (schemacache.py): entries compiled through one
+# catalog are not reused under a catalog that resolves imports differently,
+# and remote schemata are revalidated rather than downloaded on every run.
+
+import sys
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rdflib
+
+import catalog
+import rdfify2
+import schemacache
+
+MAIN = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:a">
+  <xs:import namespace="urn:b" schemaLocation="http://example.org/b.xsd"/>
+  <xs:element name="a" type="xs:string"/>
+</xs:schema>
+'''
+
+IMPORTED = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:b">
+  <xs:element name="{0}" type="xs:string"/>
+</xs:schema>
+'''
+
+CATALOG = '''<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">
+  <system systemId="http://example.org/b.xsd" uri="{0}"/>
+</catalog>
+'''
+
+class CatalogKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.write('main.xsd', MAIN)
+        self.write('one.xsd', IMPORTED.format('one'))
+        self.write('two.xsd', IMPORTED.format('two'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def elements(self, catalog_loc):
+        schema_catalog = catalog.loadCatalogs([catalog_loc])
+        sdata = rdfify2.SchemaData()
+        schemacache.loadSchema(os.path.join(self.directory, 'main.xsd'), rdflib.Graph(), sdata, self.cache_dir,
+                               schema_catalog)
+        return set(sdata.elementMap)
+
+    def testChangedCatalog(self):
+        catalog_loc = self.write('catalog.xml', CATALOG.format('one.xsd'))
+        self.assertIn('{urn:b}one', self.elements(catalog_loc))
+        self.write('catalog.xml', CATALOG.format('two.xsd'))
+        elements = self.elements(catalog_loc)
+        self.assertIn('{urn:b}two', elements)
+        self.assertNotIn('{urn:b}one', elements)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def testSameCatalogReusesEntry(self):
+        catalog_loc = self.write('catalog.xml', CATALOG.format('one.xsd'))
+        self.elements(catalog_loc)
+        self.elements(catalog_loc)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+class SchemaServer(BaseHTTPServer.HTTPServer):
+    """Serves `schemas` (path -> content) with ETags, and answers
+       conditional requests for unchanged ones with 304."""
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), SchemaHandler)
+        self.schemas = {}
+        # (path, conditional, status) per request
+        self.requests = []
+
+    def url(self, path):
+        return 'http://127.0.0.1:{0}{1}'.format(self.server_port, path)
+
+class SchemaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        content = self.server.schemas[self.path]
+        etag = '"{0}"'.format(hashlib.sha1(content).hexdigest())
+        conditional = 'If-None-Match' in self.headers
+        status = 304 if self.headers.get('If-None-Match') == etag else 200
+        self.server.requests.append((self.path, conditional, status))
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+class RemoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.server = SchemaServer()
+        self.server.schemas['/b.xsd'] = IMPORTED.format('one')
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.max_age = schemacache.REMOTE_MAX_AGE
+
+    def tearDown(self):
+        schemacache.REMOTE_MAX_AGE = self.max_age
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def elements(self):
+        del self.server.requests[:]
+        sdata = rdfify2.SchemaData()
+        schemacache.loadSchema(self.server.url('/b.xsd'), rdflib.Graph(), sdata, self.cache_dir)
+        return set(sdata.elementMap)
+
+    def testNoFetchWhenFresh(self):
+        self.assertEqual(self.elements(), set(['{urn:b}one']))
+        self.assertTrue(self.server.requests)
+        self.assertEqual(self.elements(), set(['{urn:b}one']))
+        self.assertEqual(self.server.requests, [])
+
+    def testRevalidation(self):
+        self.elements()
+        schemacache.REMOTE_MAX_AGE = 0
+        self.assertEqual(self.elements(), set(['{urn:b}one']))
+        self.assertEqual(self.server.requests, [('/b.xsd', True, 304)])
+
+        # the revalidated entry keeps its new check time
+        schemacache.REMOTE_MAX_AGE = 60
+        self.elements()
+        self.assertEqual(self.server.requests, [])
+
+        # a changed schema is downloaded again, and replaces the entry
+        schemacache.REMOTE_MAX_AGE = 0
+        self.server.schemas['/b.xsd'] = IMPORTED.format('two')
+        self.assertEqual(self.elements(), set(['{urn:b}two']))
+        self.assertEqual(self.server.requests[0], ('/b.xsd', True, 200))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
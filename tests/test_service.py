@@ -0,0 +1,118 @@
+# the worker side of the conversion service (service.py): which schema
+# locations a document may name, the bounds of the worker caches and blank
+# node labels across requests.
+
+import sys
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import catalog
+import rdfify2
+import service
+
+NS = 'http://example.org/out'
+
+SCHEMA = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:x"
+    xmlns="urn:x" elementFormDefault="qualified">
+  <xs:element name="root"><xs:complexType><xs:sequence>
+    <xs:element name="a" type="xs:string" maxOccurs="unbounded"/>
+  </xs:sequence></xs:complexType></xs:element>
+</xs:schema>
+'''
+
+CATALOG = '''<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">
+  <system systemId="http://example.org/x.xsd" uri="{0}"/>
+</catalog>
+'''
+
+def document(schema_loc):
+    return ('<root xmlns="urn:x" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="urn:x {0}"><a>1</a><a>2</a></root>'.format(schema_loc))
+
+class ServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.schema_loc = os.path.join(self.directory, 'x.xsd')
+        with open(self.schema_loc, 'w') as f:
+            f.write(SCHEMA)
+        # initServiceWorker ignores Ctrl-C, as the server's workers do
+        self.sigint = signal.getsignal(signal.SIGINT)
+
+    def tearDown(self):
+        signal.signal(signal.SIGINT, self.sigint)
+        service._serviceWorker = None
+        shutil.rmtree(self.directory)
+
+    def startWorker(self, **kwargs):
+        kwargs.setdefault('schema_loader', rdfify2.SchemaLoader())
+        service.initServiceWorker(service.ServiceOptions(NS, 'nt', **kwargs))
+
+    def convert(self, body, document_name = 'request'):
+        return service.convertRequest((body, 'nt', NS, False, document_name))
+
+    def testUnknownSchemaIsRefused(self):
+        self.startWorker()
+        status, content_type, data = self.convert(document(self.schema_loc))
+        self.assertEqual(status, 403)
+        self.assertIn(self.schema_loc, data)
+        status, _, data = self.convert(document('http://169.254.169.254/latest/meta-data'))
+        self.assertEqual(status, 403)
+
+    def testAllowedSchemata(self):
+        self.startWorker(extra_schemata=[self.schema_loc])
+        self.assertEqual(self.convert(document(self.schema_loc))[0], 200)
+
+        self.startWorker(allowed_schemata=[self.schema_loc])
+        self.assertEqual(self.convert(document(self.schema_loc))[0], 200)
+
+        catalog_loc = os.path.join(self.directory, 'catalog.xml')
+        with open(catalog_loc, 'w') as f:
+            f.write(CATALOG.format(self.schema_loc))
+        loader = rdfify2.SchemaLoader(catalog=catalog.loadCatalogs([catalog_loc]))
+        self.startWorker(schema_loader=loader)
+        self.assertEqual(self.convert(document('http://example.org/x.xsd'))[0], 200)
+        self.assertEqual(self.convert(document(self.schema_loc))[0], 403)
+
+    def testCounterLabelsDifferAcrossRequests(self):
+        self.startWorker(allowed_schemata=[self.schema_loc], bnodes='counter')
+        body = '<root xmlns="urn:x"><a><b>1</b></a></root>'
+        first = self.convert(body, 'request/1')
+        second = self.convert(body, 'request/2')
+        self.assertEqual(first[0], 200)
+        self.assertIn('_:', first[2])
+        labels = lambda data: set(t for t in data.split() if t.startswith('_:'))
+        self.assertEqual(len(labels(first[2])), len(labels(second[2])))
+        self.assertFalse(labels(first[2]) & labels(second[2]))
+
+    def testCachesAreBounded(self):
+        self.startWorker(allowed_schemata=[self.schema_loc], schema_sets=2, plans=2)
+        for i in xrange(4):
+            loc = os.path.join(self.directory, 'x{0}.xsd'.format(i))
+            shutil.copy(self.schema_loc, loc)
+            service._serviceWorker[0].allowed_schemata.append(loc)
+            for j in xrange(3):
+                status = service.convertRequest((document(loc), 'nt', NS + str(j), False, 'request'))[0]
+                self.assertEqual(status, 200)
+        entries = service._serviceWorker[1]
+        self.assertEqual(len(entries), 2)
+        for entry in entries.entries.values():
+            self.assertEqual(len(entry.plans), 2)
+
+    def testLRUCache(self):
+        cache = service.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# sharded N-Triples output (rdfify2.shardRDFWithSchema, sinks.ShardedSink):
+# the shards together hold the unsharded output, the manifest accounts for
+# every shard, and no subtree is split across shards.
+
+import sys
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+
+import bnodes
+import rdfify2
+import sinks
+import xml2rdf
+
+NS = 'http://example.org/out'
+
+def document(subtrees):
+    return ('<root xmlns="urn:x">' +
+            ''.join('<r><a>{0}</a><b><c>{0}</c>{1}</b></r>'.format(i, '<d><e/></d>' * (i % 4)) for i in xrange(subtrees)) +
+            '<tail>end</tail></root>')
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xmlfile = os.path.join(self.directory, 'doc.xml')
+        with open(self.xmlfile, 'w') as f:
+            f.write(document(25))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def unsharded(self):
+        out = cStringIO.StringIO()
+        plan = xml2rdf.ConversionPlan(rdfify2.SchemaData(), NS, bnodes.CounterAllocator())
+        xml2rdf.parseXMLDocument(lxml.etree.parse(self.xmlfile).getroot(), sinks.NTriplesSink(out),
+                                 plan.schema_data, NS, plan)
+        return out.getvalue().splitlines()
+
+    def shard(self, **kwargs):
+        # counter labels, which are the same as in the unsharded output
+        outfile = os.path.join(self.directory, 'out.nt')
+        manifest = rdfify2.shardRDFWithSchema(self.xmlfile, outfile, None, 'nt', None, NS,
+                                              allocator=bnodes.CounterAllocator(), **kwargs)
+        with open(os.path.join(self.directory, 'out.manifest.json')) as f:
+            self.assertEqual(json.load(f), json.loads(json.dumps(manifest)))
+        shards = []
+        for shard in manifest['shards']:
+            with open(os.path.join(self.directory, shard['file']), 'rb') as f:
+                data = f.read()
+            self.assertEqual(shard['bytes'], len(data))
+            self.assertEqual(shard['sha256'], hashlib.sha256(data).hexdigest())
+            self.assertEqual(shard['triples'], len(data.splitlines()))
+            shards.append(data)
+        self.assertEqual(manifest['triples'], sum(shard['triples'] for shard in manifest['shards']))
+        return manifest, shards
+
+    def checkShards(self, manifest, shards):
+        lines = []
+        labels = []
+        for data in shards:
+            lines.extend(data.splitlines())
+            labels.append(set(re.findall(r'_:\w+', data)))
+        # a blank node, and so the subtree it stands for, is in one shard only
+        for i in xrange(len(labels)):
+            for j in xrange(i + 1, len(labels)):
+                self.assertFalse(labels[i] & labels[j])
+        expected = self.unsharded()
+        self.assertEqual(sorted(lines), sorted(expected))
+        self.assertEqual(manifest['triples'], len(expected))
+
+    def testShardCount(self):
+        manifest, shards = self.shard(shards=3)
+        self.assertEqual(len(shards), 3)
+        self.checkShards(manifest, shards)
+        # the subtrees are spread evenly
+        counts = [shard['triples'] for shard in manifest['shards']]
+        self.assertTrue(max(counts) - min(counts) <= 12)
+
+    def testShardSize(self):
+        manifest, shards = self.shard(shard_size=40, iterparse=True)
+        self.assertTrue(len(shards) > 2)
+        self.checkShards(manifest, shards)
+        # shards only grow past the size by the rest of a subtree
+        for shard in manifest['shards'][:-1]:
+            self.assertTrue(40 <= shard['triples'] < 40 + 13)
+
+if __name__ == '__main__':
+    unittest.main()
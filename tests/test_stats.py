@@ -0,0 +1,60 @@
+# --stats reports (instrumentation.py): subtree-parallel conversion
+# (--split-depth) counts the work of its workers too.
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+rdfify2_path = os.path.join(here, '..', 'rdfify2.py')
+
+DOCUMENT = '''<root xmlns="urn:x" xmlns:x="urn:x">
+  <a x:id="a1"><b>1</b><c>one</c></a>
+  <a x:id="a2"><b>2</b><c>two</c></a>
+  <a><b>3</b><d><e>three</e></d></a>
+  <f>text</f>
+</root>
+'''
+
+class SplitStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xmlfile = os.path.join(self.directory, 'doc.xml')
+        with open(self.xmlfile, 'w') as f:
+            f.write(DOCUMENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stats(self, *args):
+        stats_path = os.path.join(self.directory, 'stats.json')
+        subprocess.check_call([sys.executable, rdfify2_path, '-t', 'nt', '-n', 'http://example.org/out',
+                               '-o', os.path.join(self.directory, 'out.nt'), '--stats', stats_path]
+                              + list(args) + [self.xmlfile])
+        with open(stats_path) as f:
+            return json.load(f)
+
+    def lookups(self, report):
+        return dict((name, counts['hits'] + counts['misses']) for name, counts in report['term_caches'].iteritems())
+
+    def assertSameCounts(self, split):
+        self.assertEqual(split['counters'], self.whole['counters'])
+        self.assertEqual(self.lookups(split), self.lookups(self.whole))
+
+    def testSplitDepth(self):
+        self.whole = self.stats()
+        self.assertEqual(self.whole['counters']['elements'], 12)
+        self.assertSameCounts(self.stats('--split-depth', '1', '-j', '2'))
+        self.assertSameCounts(self.stats('--split-depth', '2', '-j', '2'))
+
+    def testSplitDepthStream(self):
+        self.whole = self.stats('--stream')
+        self.assertSameCounts(self.stats('--stream', '--split-depth', '1', '-j', '2'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+# the explicit-stack tree walk of processNode (xml2rdf.py and rdfify.py)
+# against a recursive walk over the same per-tag conversion, on deep, wide
+# and mixed-content documents; the walk leaves the tree as it was, and a
+# TeeSink gets the same triples as a single sink.
+
+import sys
+import os
+import hashlib
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lxml.etree
+import rdflib
+
+import bnodes
+import rdfify
+import rdfify2
+import sinks
+import xml2rdf
+
+NS = 'http://example.org/out'
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+
+def deepDocument(depth):
+    # deeper than the recursion limit; every level has an attribute, text
+    # and a sibling leaf, so it takes each conversion branch
+    return ''.join('<n xmlns="urn:x" xmlns:x="urn:x" x:level="{0}">t{0}<leaf>{0}</leaf>'.format(i)
+                   for i in xrange(depth)) + '</n>' * depth
+
+def wideDocument(width):
+    return '<root xmlns="urn:x">' + ''.join('<r><a>{0}</a><b/></r>'.format(i) for i in xrange(width)) + '</root>'
+
+MIXED = '''<root xmlns="urn:x" xmlns:x="urn:x">
+  text <a x:id="a1">before<b>inner</b>after<!-- comment --><?pi?>tail</a>
+  <c x:ref="a1"/> more text <d>  spaced   out  </d><e/>
+  <f><g><h>deep<i x:k="v"/></h></g>tail</f>
+</root>'''
+
+def referenceSchema():
+    # x:ref alone on the childless <c> labels its node and is used up
+    sdata = rdfify2.SchemaData()
+    sdata.attributeMap.update({'{urn:x}id': XSD + 'ID', '{urn:x}ref': XSD + 'IDREF'})
+    return sdata
+
+def parse(document):
+    parser = lxml.etree.XMLParser(huge_tree=True)
+    return lxml.etree.fromstring(document, parser)
+
+def withRecursionLimit(limit, f, *args):
+    old = sys.getrecursionlimit()
+    sys.setrecursionlimit(limit)
+    try:
+        return f(*args)
+    finally:
+        sys.setrecursionlimit(old)
+
+def unskolemized(g):
+    """Returns `g` with rdflib's skolem URIs turned back into blank nodes."""
+    def term(t):
+        if isinstance(t, rdflib.URIRef) and '/.well-known/genid/' in t:
+            return rdflib.BNode(t.rsplit('/', 1)[1])
+        return t
+    ret = rdflib.Graph()
+    for s, p, o in g:
+        ret.add((term(s), p, term(o)))
+    return ret
+
+def canonicalTriples(g):
+    """Returns the triples of `g` with each blank node labelled by a hash of
+       the triples below it. The graphs here are trees of blank nodes, so two
+       of them are isomorphic if these sets are equal (rdflib's isomorphic is
+       far too slow on thousands of blank nodes)."""
+    below = {}
+    for s, p, o in g:
+        if isinstance(s, rdflib.BNode):
+            below.setdefault(s, []).append((p, o))
+
+    labels = {}
+    def label(t):
+        if not isinstance(t, rdflib.BNode):
+            return t
+        # innermost first, without recursion
+        stack = [t]
+        while stack:
+            b = stack[-1]
+            if b in labels:
+                stack.pop()
+                continue
+            pending = [o for p, o in below.get(b, ()) if isinstance(o, rdflib.BNode) and o not in labels]
+            if pending:
+                stack.extend(pending)
+                continue
+            key = sorted((p.n3(), labels.get(o, o).n3()) for p, o in below.get(b, ()))
+            labels[b] = rdflib.BNode(hashlib.sha1(repr(key)).hexdigest())
+            stack.pop()
+        return labels[t]
+
+    return set((label(s), p, label(o)) for s, p, o in g)
+
+def recursiveXML2RDF(tag, graph, parentNode, plan, index = 0):
+    if not isinstance(tag.tag, basestring):
+        return
+    node, _ = xml2rdf.processTag(tag.tag, xml2rdf.collapseText(tag.text), xml2rdf.sortedItems(tag), len(tag) > 0,
+                                 graph, parentNode, plan, None, index)
+    for i, child in xml2rdf.childElements(tag):
+        recursiveXML2RDF(child, graph, node, plan, i)
+
+def recursiveRdfify(tag, graph, parentNode):
+    if not isinstance(tag.tag, basestring):
+        return
+    node = rdfify.processTag(tag, graph, parentNode)
+    for child in tag:
+        recursiveRdfify(child, graph, node)
+
+class TraversalTest(unittest.TestCase):
+
+    def compareXML2RDF(self, document, limit = None):
+        stacked = rdflib.Graph()
+        xml2rdf.processNode(parse(document), stacked, None, rdfify2.SchemaData(), NS)
+
+        recursive = rdflib.Graph()
+        plan = xml2rdf.ConversionPlan(rdfify2.SchemaData(), NS)
+        if limit:
+            withRecursionLimit(limit, recursiveXML2RDF, parse(document), recursive, None, plan)
+        else:
+            recursiveXML2RDF(parse(document), recursive, None, plan)
+
+        self.assertTrue(len(stacked) > 0)
+        self.assertEqual(len(stacked), len(recursive))
+        self.assertEqual(canonicalTriples(stacked), canonicalTriples(recursive))
+
+    def compareRdfify(self, document, limit = None):
+        # reference attributes are removed from the tree, so each walk gets
+        # its own parse
+        stacked = rdflib.Graph()
+        rdfify.processNode(parse(document), stacked, None)
+
+        recursive = rdflib.Graph()
+        if limit:
+            withRecursionLimit(limit, recursiveRdfify, parse(document), recursive, None)
+        else:
+            recursiveRdfify(parse(document), recursive, None)
+
+        self.assertTrue(len(stacked) > 0)
+        self.assertEqual(len(stacked), len(recursive))
+        self.assertEqual(canonicalTriples(unskolemized(stacked)), canonicalTriples(unskolemized(recursive)))
+
+    def testDeep(self):
+        depth = sys.getrecursionlimit() + 500
+        self.compareXML2RDF(deepDocument(depth), depth * 4)
+        self.compareRdfify(deepDocument(depth), depth * 4)
+
+    def testWide(self):
+        self.compareXML2RDF(wideDocument(5000))
+        self.compareRdfify(wideDocument(5000))
+
+    def testMixed(self):
+        self.compareXML2RDF(MIXED)
+        self.compareRdfify(MIXED)
+
+class TreeTest(unittest.TestCase):
+
+    def testTreeUnchanged(self):
+        sdata = referenceSchema()
+        tree = parse(MIXED)
+        before = lxml.etree.tostring(tree)
+        g = rdflib.Graph()
+        xml2rdf.processNode(tree, g, None, sdata, NS)
+        self.assertIn((rdflib.URIRef(NS + '#'), rdflib.URIRef('urn:x#c'), rdflib.URIRef(NS + '#a1')), g)
+        self.assertEqual(lxml.etree.tostring(tree), before)
+        self.assertEqual(tree.find('{urn:x}c').get('{urn:x}ref'), 'a1')
+
+        # so a second conversion of the same tree gives the same graph
+        again = rdflib.Graph()
+        xml2rdf.processNode(tree, again, None, sdata, NS)
+        self.assertEqual(canonicalTriples(again), canonicalTriples(g))
+
+    def testTeeSink(self):
+        def convert(sink):
+            sdata = referenceSchema()
+            plan = xml2rdf.ConversionPlan(sdata, NS, bnodes.CounterAllocator())
+            xml2rdf.parseXMLDocument(parse(MIXED), sink, sdata, NS, plan)
+
+        single = rdflib.Graph()
+        convert(single)
+        first, second = rdflib.Graph(), sinks.ListSink()
+        convert(sinks.TeeSink(first, second))
+        self.assertEqual(set(first), set(single))
+        self.assertEqual(sorted(second.triples), sorted(single))
+        self.assertEqual(dict(first.namespaces()), dict(single.namespaces()))
+
+if __name__ == '__main__':
+    unittest.main()
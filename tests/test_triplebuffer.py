@@ -0,0 +1,72 @@
+# the compact triple collection behind --store compact (triplebuffer.py):
+# interned terms, duplicates dropped across compactions, and output matching
+# an rdflib.Graph of the same triples.
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rdflib
+from rdflib.compare import isomorphic
+
+import triplebuffer
+
+EX = rdflib.Namespace('http://example.org/')
+
+def triples():
+    b = rdflib.BNode('b1')
+    return [
+        (EX.s1, EX.p, rdflib.Literal('one')),
+        (EX.s2, EX.p, EX.s1),
+        (EX.s1, EX.q, b),
+        (b, EX.p, rdflib.Literal('1', datatype=rdflib.XSD.integer)),
+        (EX.s2, EX.p, rdflib.Literal('two', lang='en')),
+    ]
+
+class TripleBufferTest(unittest.TestCase):
+
+    def fill(self):
+        buf = triplebuffer.TripleBuffer()
+        g = rdflib.Graph()
+        buf.bind('ex', EX)
+        g.bind('ex', EX)
+        for triple in triples():
+            buf.add(triple)
+            g.add(triple)
+        # duplicates within the first batch
+        buf.add(triples()[0])
+        self.assertEqual(len(buf), len(g))
+        # and across a compaction, also of terms seen before
+        for triple in triples() + [(EX.s3, EX.p, rdflib.Literal('one'))]:
+            buf.add(triple)
+            g.add(triple)
+        return buf, g
+
+    def testInterning(self):
+        buf, g = self.fill()
+        self.assertEqual(len(buf.terms), len(set(buf.terms)))
+        self.assertEqual(buf.terms.count(rdflib.Literal('one')), 1)
+
+    def testLengthAndIteration(self):
+        buf, g = self.fill()
+        self.assertEqual(len(buf), len(g))
+        self.assertEqual(sorted(buf), sorted(g))
+        # triples of a subject are together
+        subjects = [s for s, p, o in buf]
+        runs = [s for i, s in enumerate(subjects) if i == 0 or subjects[i - 1] != s]
+        self.assertEqual(len(runs), len(set(subjects)))
+
+    def testSerialize(self):
+        buf, g = self.fill()
+        for format in ('nt', 'turtle', 'n3', 'xml'):
+            parsed = rdflib.Graph().parse(data=buf.serialize(format=format), format=format)
+            self.assertEqual(len(parsed), len(g))
+            self.assertTrue(isomorphic(parsed, g), format)
+        lines = buf.serialize(format='nt').splitlines()
+        self.assertEqual(len(lines), len(set(lines)))
+        self.assertEqual(len(lines), len(g))
+
+if __name__ == '__main__':
+    unittest.main()
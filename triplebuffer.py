@@ -0,0 +1,184 @@
+# compact in-memory triple collection, for conversion output that is only
+# written out once (`rdfify2.py --store compact`).
+#
+# rdflib's memory store keeps each triple in several nested indexes of term
+# objects. A TripleBuffer keeps every distinct term once, numbered in a term
+# dictionary, and each triple as three term numbers in array columns (12
+# bytes). It only supports what the converters and rdfify2 need of a graph:
+# add, bind, namespaces, iteration, += and serialize.
+#
+# Duplicate triples are dropped when the buffer is compacted, which sorts the
+# columns by subject (in the order subjects were first seen), so the triples
+# of each subject end up together. Compaction happens before the buffer is
+# iterated, counted or written. Turtle and N-Triples are written straight
+# from the columns (Turtle with a sinks.TurtleSink); other formats go
+# through an rdflib.Graph (toGraph).
+
+import array
+import cStringIO
+
+import rdflib
+
+import sinks
+
+class TripleBuffer:
+    """A write-once triple collection; see the module comment."""
+
+    def __init__(self):
+        # term dictionary
+        self.terms = []
+        self.ids = {}
+        # triple columns
+        self.subjects = array.array('i')
+        self.predicates = array.array('i')
+        self.objects = array.array('i')
+        self.compacted = 0
+        self.prefixes = []
+        for prefix, namespace in sinks.defaultNamespaces:
+            self.bind(prefix, namespace)
+
+    def termID(self, term):
+        try:
+            return self.ids[term]
+        except KeyError:
+            i = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+            return i
+
+    def add(self, triple):
+        s, p, o = triple
+        termID = self.termID
+        self.subjects.append(termID(s))
+        self.predicates.append(termID(p))
+        self.objects.append(termID(o))
+
+    def bind(self, prefix, namespace, override = True):
+        if prefix is None:
+            prefix = ''
+        for i, (p, n) in enumerate(self.prefixes):
+            if p == prefix:
+                if override:
+                    self.prefixes[i] = (prefix, rdflib.URIRef(namespace))
+                return
+        self.prefixes.append((prefix, rdflib.URIRef(namespace)))
+
+    def namespaces(self):
+        return iter(self.prefixes)
+
+    def compact(self):
+        """Groups the triples by subject and drops duplicates."""
+        n = len(self.subjects)
+        if self.compacted == n:
+            return
+        subjects, predicates, objects = self.subjects, self.predicates, self.objects
+
+        # counting sort on the subject column: start of each subject's run
+        starts = array.array('i', [0]) * (len(self.terms) + 1)
+        for s in subjects:
+            starts[s + 1] += 1
+        for i in xrange(1, len(starts)):
+            starts[i] += starts[i - 1]
+        order = array.array('i', [0]) * n
+        for i in xrange(n):
+            s = subjects[i]
+            order[starts[s]] = i
+            starts[s] += 1
+
+        # duplicates can only be among the triples of one subject
+        new_subjects = array.array('i')
+        new_predicates = array.array('i')
+        new_objects = array.array('i')
+        seen = set()
+        current = None
+        for i in order:
+            s = subjects[i]
+            if s != current:
+                current = s
+                seen.clear()
+            key = (predicates[i], objects[i])
+            if key in seen:
+                continue
+            seen.add(key)
+            new_subjects.append(s)
+            new_predicates.append(key[0])
+            new_objects.append(key[1])
+
+        self.subjects, self.predicates, self.objects = new_subjects, new_predicates, new_objects
+        self.compacted = len(new_subjects)
+
+    def __len__(self):
+        self.compact()
+        return len(self.subjects)
+
+    def __iter__(self):
+        self.compact()
+        terms = self.terms
+        for s, p, o in zip(self.subjects, self.predicates, self.objects):
+            yield terms[s], terms[p], terms[o]
+
+    def __iadd__(self, other):
+        for triple in other:
+            self.add(triple)
+        return self
+
+    def toGraph(self):
+        """Returns the triples and namespace bindings as an rdflib.Graph."""
+        g = rdflib.Graph()
+        for prefix, namespace in self.prefixes:
+            g.bind(prefix, namespace)
+        for triple in self:
+            g.add(triple)
+        return g
+
+    def writeNTriples(self, out):
+        self.compact()
+        terms = self.terms
+        encoded = [None] * len(terms)
+        for s, p, o in zip(self.subjects, self.predicates, self.objects):
+            for t in (s, p, o):
+                if encoded[t] is None:
+                    encoded[t] = sinks._escapeNonASCII(sinks.ntTerm(terms[t]))
+            out.write('%s %s %s .\n' % (encoded[s], encoded[p], encoded[o]))
+
+    def writeTurtle(self, out):
+        # the triples of a subject are together, so each is one block
+        sink = sinks.TurtleSink(out, None)
+        for prefix, namespace in self.prefixes:
+            sink.bind(prefix, namespace)
+        current = None
+        for triple in self:
+            if triple[0] != current:
+                sink.flush()
+                current = triple[0]
+            sink.add(triple)
+        sink.flush()
+
+    def serialize(self, destination = None, format = 'turtle', **kwargs):
+        """Writes the triples to `destination` (a file object or name) in
+           `format`, or returns them as a string if there is none."""
+        if format not in ('turtle', 'n3', 'nt'):
+            return self.toGraph().serialize(destination=destination, format=format, **kwargs)
+
+        if destination is None:
+            out = cStringIO.StringIO()
+        elif isinstance(destination, basestring):
+            out = open(destination, 'wb')
+        else:
+            out = destination
+        try:
+            if format == 'nt':
+                self.writeNTriples(out)
+            else:
+                # Turtle is a subset of N3
+                self.writeTurtle(out)
+            if destination is None:
+                return out.getvalue()
+        finally:
+            if isinstance(destination, basestring):
+                out.close()
+
+    def commit(self):
+        pass
+
+    def close(self, commit_pending_transaction = False):
+        pass
@@ -17,6 +17,12 @@ import os
 import re
 import argparse
 
+import termcache
+import instrumentation
+import bnodes
+import literals
+import xsd2rdfs
+
 ns_rdfify = u'http://dig.csail.mit.edu/2014/rdfify/schema#'
 
 def normalizeNamespace(namespace):
@@ -38,107 +44,486 @@ def constructURIRefFromXMLName(n):
     k = n[1:].split('}')
     return constructURIRef(k[0], k[1])
 
+def constructURIRefFromQName(n):
+    """Builds the URIRef for a tag or attribute name in {namespace}name form,
+       splitting it the way lxml.etree.QName does."""
+    n_qn = lxml.etree.QName(n)
+    return constructURIRef(n_qn.namespace, n_qn.localname)
+
+# interned URIRefs for tag and attribute predicates, and for type names
+predicateCache = termcache.TermCache(constructURIRefFromQName)
+typeCache = termcache.TermCache(constructURIRefFromXMLName)
+
+hasTextPredicate = rdflib.URIRef(ns_rdfify + 'hasText')
+rdfType = rdflib.namespace.RDF.type
+
+def termCacheStats():
+    """Returns the hit and miss counters of the interned term caches."""
+    return {
+        'predicates': predicateCache.stats(),
+        'types': typeCache.stats(),
+    }
+
+def addTermCacheStats(stats):
+    """Adds the hit and miss counts in `stats` (from termCacheStats, e.g. of
+       a worker process) to those of the term caches."""
+    for name, cache in (('predicates', predicateCache), ('types', typeCache)):
+        cache.hits += stats[name]['hits']
+        cache.misses += stats[name]['misses']
+
 def lookupTagType(tag, schema_data):
     return schema_data.elementMap.get(tag, tag)
 
 def lookupAttributeType(tag, schema_data):
     return schema_data.attributeMap.get(tag, "{http://www.w3.org/2001/XMLSchema}string")
 
-def processNode(tag, graph, parentNode, schema_data, target_namespace):
-    """ Converts a XML tag and children to RDF graph nodes.
+def collapseText(text):
+    """Collapses whitespace in tag text, or returns None for empty text."""
+    if text:
+        return re.sub("\s+"," ",text)
+    else:
+        return None
+
+def sortedItems(tag):
+    """Returns the attribute items of `tag`, sorted by name."""
+    items = tag.items()
+    if len(items) > 1:
+        items.sort()
+    return items
+
+idTypes = ("{http://www.w3.org/2001/XMLSchema}ID",)
+# attributes that may label a node by the ID they name (a heuristic)
+refTypes = ("{http://www.w3.org/2001/XMLSchema}IDREF", "{http://www.w3.org/2001/XMLSchema}NCName")
+# attributes whose values are checked against the IDs (--check-refs)
+idrefTypes = ("{http://www.w3.org/2001/XMLSchema}IDREF",)
+idrefsTypes = ("{http://www.w3.org/2001/XMLSchema}IDREFS",)
+
+class ElementPlan:
+    """Conversion decisions for one element name. `literal` makes the
+       literal for the text of a leaf element."""
+    def __init__(self, predicate, type_ref, literal = rdflib.Literal):
+        self.predicate = predicate
+        self.type_ref = type_ref
+        self.literal = literal
+
+class AttributePlan:
+    """Conversion decisions for one attribute name. `literal` makes the
+       literal for a value. `is_ref` says whether the attribute may label a
+       node (see selectNode); `is_idref` and `is_idrefs` whether its value,
+       or each of its whitespace-separated values, is a reference to check
+       (see recordReferences)."""
+    def __init__(self, predicate, is_id, is_ref, literal = rdflib.Literal, is_idref = False, is_idrefs = False):
+        self.predicate = predicate
+        self.is_id = is_id
+        self.is_ref = is_ref
+        self.literal = literal
+        self.is_idref = is_idref
+        self.is_idrefs = is_idrefs
+
+class ConversionPlan:
+    """Per-name element and attribute plans compiled from a SchemaData, so
+       that converting an element takes one dictionary lookup instead of
+       type lookups and URIRef construction.
+
+       Plans for the names in the schema's element and attribute maps are
+       compiled up front; names the schema doesn't know get theirs on first
+       use. The plan does not follow later changes to the SchemaData.
+
+       Blank nodes come from `allocator` (see bnodes.py), rdflib's random
+       ones by default. ID and reference values are recorded in
+       `references` (a refindex.ReferenceIndex), if given. `literal_mode`
+       says whether leaf text and attribute values get datatypes (see
+       literals.py)."""
+
+    def __init__(self, schema_data, target_namespace = "", allocator = None, references = None,
+                 literal_mode = 'plain'):
+        self.schema_data = schema_data
+        self.target_namespace = target_namespace
+        self.allocator = allocator or bnodes.UUIDAllocator()
+        self.references = references
+        self.literal_mode = literal_mode
+        # a xsd2rdfs.TypeResolver, made when typed literals need one
+        self.types = None
+
+        # node URIs are minted by appending ID(REF) values to this prefix
+        self.node_prefix = normalizeNamespace(target_namespace)
+        self.root_node = rdflib.URIRef(self.node_prefix)
+
+        self.elements = {}
+        self.attributes = {}
+
+        # names that can't be turned into URIRefs only fail if they turn up
+        # in a document
+        for name in schema_data.elementMap:
+            try:
+                self.compileElement(name)
+            except ValueError:
+                pass
+        for name in schema_data.attributeMap:
+            try:
+                self.compileAttribute(name)
+            except ValueError:
+                pass
+
+    def compileElement(self, name):
+        try:
+            type_ref = typeCache(lookupTagType(name, self.schema_data))
+        except IndexError:
+            # not a {namespace}name type; only an error if the element needs
+            # a type annotation
+            type_ref = None
+        plan = ElementPlan(predicateCache(name), type_ref,
+                           self.compileLiteral(lookupTagType(name, self.schema_data)))
+        self.elements[name] = plan
+        return plan
+
+    def compileAttribute(self, name):
+        attr_type = lookupAttributeType(name, self.schema_data)
+        plan = AttributePlan(predicateCache(name), attr_type in idTypes, attr_type in refTypes,
+                             self.compileLiteral(attr_type), attr_type in idrefTypes, attr_type in idrefsTypes)
+        self.attributes[name] = plan
+        return plan
+
+    def compileLiteral(self, type_name):
+        if self.literal_mode == 'plain':
+            return rdflib.Literal
+        if self.types is None:
+            self.types = xsd2rdfs.TypeResolver(self.schema_data)
+        # types without simple content, and unknown ones, get plain literals
+        datatype = self.types.datatype(type_name)
+        if datatype is None:
+            return rdflib.Literal
+        return literals.literalConverter(datatype, self.literal_mode, typeCache(datatype))
+
+    def element(self, name):
+        try:
+            return self.elements[name]
+        except KeyError:
+            return self.compileElement(name)
+
+    def attribute(self, name):
+        try:
+            return self.attributes[name]
+        except KeyError:
+            return self.compileAttribute(name)
+
+    def node(self, value):
+        return rdflib.URIRef(self.node_prefix + value)
+
+def selectNode(attrs, has_children, plan, parentNode = None, index = 0):
+    """Picks the RDF node for a non-root tag that has children or attributes.
+
+       `attrs` is the sorted list of the tag's attribute items; `parentNode`
+       and `index` (the tag's position among its parent's child elements)
+       are passed to the plan's blank node allocator. Returns a
+       (node, ref_key) pair, where ref_key is the reference attribute that was
+       used up in labelling the node (or None)."""
+
+    stats = instrumentation.active
+
+    # experimental support for adding labels to 'significant' nodes
+    # based on the simple heuristic of 'does this node have an id attribute'
+    for k, v in attrs:
+        attr_plan = plan.attribute(k)
+        if attr_plan.is_id:
+            if stats is not None:
+                stats.count('nodes.id')
+            return plan.node(v), None
+        # experimental support for reference-like tags
+        # invoked only if the reference tag has no other content or attributes
+        if attr_plan.is_ref and len(attrs) == 1 and not has_children:
+            if stats is not None:
+                stats.count('nodes.ref')
+            return plan.node(v), k
+
+    if stats is not None:
+        stats.count('nodes.blank')
+    return plan.allocator.node(parentNode, index), None
+
+# triples emitted by each branch of processTag, besides text and attributes
+branchTriples = {'root': 1, 'node': 2, 'literal': 1, 'empty': 1}
+
+def countTag(stats, branch, has_text, attr_triples):
+    stats.count('elements')
+    stats.count('triples.' + branch, branchTriples[branch])
+    if has_text:
+        stats.count('triples.text')
+    if attr_triples:
+        stats.count('triples.attribute', attr_triples)
+
+def recordReferences(references, attrs, plan):
+    """Tells `references` about the ID, IDREF and IDREFS attributes in
+       `attrs`. Unlike node labelling, this doesn't take NCName values for
+       references."""
+    for k, v in attrs:
+        attr_plan = plan.attribute(k)
+        if attr_plan.is_id:
+            references.addID(v)
+        elif attr_plan.is_idref:
+            references.addRef(v)
+        elif attr_plan.is_idrefs:
+            for value in v.split():
+                references.addRef(value)
+
+def processTag(tag_name, tag_text, attrs, has_children, graph, parentNode, plan, node = None, index = 0):
+    """ Converts a single XML tag (without its children) to RDF graph nodes.
+
+        `tag_text` is the collapsed tag text and `attrs` the sorted list of
+        attribute items. `node` may be given if the node for a tag with
+        children was already selected. `index` is the tag's position among
+        its parent's child elements. Returns a (node, ref_key) pair, see
+        `selectNode`.
     """
 
-    # only process actual tags, not comments
-    if isinstance(tag.tag, basestring):
+    # build the RDF nodes and triples implied by the tag
 
-        # split the tag into namespace and local name
-        tag_qn = lxml.etree.QName(tag)
+    # 0: tag is the root entity -> (BNode rdf:type URIRef)
+    # 1: tag has children / attributes -> (parent URIRef BNode)
+    # 1.1: the 'ref' markers doesn't count as an attribute if it's the only one
+    # 1a: tag also has text -> (BNode <rdfify:hasText> Literal)
+    # 2: tag has no children and some text -> (parent URIRef Literal)
+    # 3: tag has no children and no text -> (parent URIRef [])
 
-        # collapse whitespace in tag text
-        if tag.text:
-            tag_text = re.sub("\s+"," ",tag.text)
-        else:
-            tag_text = None
-
-
-        # build the RDF nodes and triples implied by the tag
-
-        # 0: tag is the root entity -> (BNode rdf:type URIRef)
-        # 1: tag has children / attributes -> (parent URIRef BNode)
-        # 1.1: the 'ref' markers doesn't count as an attribute if it's the only one
-        # 1a: tag also has text -> (BNode <rdfify:hasText> Literal)
-        # 2: tag has no children and some text -> (parent URIRef Literal)
-        # 3: tag has no children and no text -> (parent URIRef [])
-
-        node = None
-
-        # tag is the root entity
-        if parentNode == None:
-            #node = rdflib.BNode().skolemize()
-            node = constructURIRef(target_namespace, "")
-            pred = rdflib.namespace.RDF.type
-            #print tag.tag
-            obj = constructURIRefFromXMLName(lookupTagType(tag.tag, schema_data))
-            graph.add((node, pred, obj))
-
-        # tag has children / attributes
-        elif len(tag.getchildren()) or len(tag.keys()):
-            node = rdflib.BNode()
-            ignore_text = False
-
-            # experimental support for adding labels to 'significant' nodes
-            # based on the simple heuristic of 'does this node have an id attribute'
-            if len(tag.keys()):
-                for k, v in sorted(tag.items()):
-                    k_qn = lxml.etree.QName(k)
-                    #if k_qn.localname == "id":
-                    if lookupAttributeType(k, schema_data) in ("{http://www.w3.org/2001/XMLSchema}ID",):
-                        node = constructURIRef(target_namespace, v)
-                        break
-                    # experimental support for reference-like tags
-                    # invoked only if the reference tag has no other content or attributes
-                    #if k_qn.localname == "ref" and len(tag.keys()) == 1 and len(tag.getchildren()) == 0:
-                    if lookupAttributeType(k, schema_data) in ("{http://www.w3.org/2001/XMLSchema}IDREF", "{http://www.w3.org/2001/XMLSchema}NCName") and len(tag.keys()) == 1 and len(tag.getchildren()) == 0:
-                        node = constructURIRef(normalizeNamespace(target_namespace), v)
-                        del tag.attrib[k]
-                        ignore_text = True
-                        break
-
-            # tags with both children and text get the text in a separate triple
-            if not ignore_text and tag_text and tag_text != " ":
-                pred = rdflib.URIRef(ns_rdfify + 'hasText')
-                obj = rdflib.Literal(tag_text)
-                graph.add((node, pred, obj))
-            pred = constructURIRef(tag_qn.namespace, tag_qn.localname)
-            graph.add((parentNode, pred, node))
-
-            # type annotation
-            graph.add((node, rdflib.namespace.RDF.type, constructURIRefFromXMLName(lookupTagType(tag.tag, schema_data))))
-
-        # tag has no children and no attributes (i.e. pure literal value)
+    ref_key = None
+    has_text = False
+    elem_plan = plan.element(tag_name)
+
+    # tag is the root entity
+    if parentNode is None:
+        #node = rdflib.BNode().skolemize()
+        branch = 'root'
+        node = plan.root_node
+        graph.add((node, rdfType, elem_plan.type_ref or typeCache(lookupTagType(tag_name, plan.schema_data))))
+
+    # tag has children / attributes
+    elif has_children or attrs:
+        branch = 'node'
+        if node is None:
+            node, ref_key = selectNode(attrs, has_children, plan, parentNode, index)
+
+        # tags with both children and text get the text in a separate triple
+        if not ref_key and tag_text and tag_text != " ":
+            has_text = True
+            obj = rdflib.Literal(tag_text)
+            graph.add((node, hasTextPredicate, obj))
+        graph.add((parentNode, elem_plan.predicate, node))
+
+        # type annotation
+        graph.add((node, rdfType, elem_plan.type_ref or typeCache(lookupTagType(tag_name, plan.schema_data))))
+
+    # tag has no children and no attributes (i.e. pure literal value)
+    else:
+        if tag_text:
+            branch = 'literal'
+            node = elem_plan.literal(tag_text)
         else:
-            if tag_text:
-                # TODO add type annotation
-                node = rdflib.Literal(tag_text)
-            else:
-                node = rdflib.BNode()
-            pred = constructURIRef(tag_qn.namespace, tag_qn.localname)
-            graph.add((parentNode, pred, node))
+            branch = 'empty'
+            node = plan.allocator.node(parentNode, index)
+        graph.add((parentNode, elem_plan.predicate, node))
+
+    # tags with attributes get their own per-attribute triples
+    # (except for a reference attribute used up in labelling the node)
+    for k, v in attrs:
+        if k == ref_key:
+            continue
+        attr_plan = plan.attribute(k)
+        graph.add((node, attr_plan.predicate, attr_plan.literal(v)))
+
+    references = plan.references
+    if references is not None:
+        recordReferences(references, attrs, plan)
+
+    stats = instrumentation.active
+    if stats is not None:
+        countTag(stats, branch, has_text, len(attrs) - (ref_key is not None))
+
+    return node, ref_key
+
+class TripleBatch(list):
+    """The triples of one element, in the order they were emitted. It is a
+       sink itself, so processTag can add to it directly."""
+    add = list.append
+
+    def bind(self, prefix, namespace):
+        pass
+
+def addBatches(graph, batches):
+    """Adds the triples of `batches` (from one of the iter*Batches
+       generators) to `graph`."""
+    add = graph.add
+    for batch in batches:
+        for triple in batch:
+            add(triple)
+
+def iterNodeBatches(tag, parentNode, plan, index = 0):
+    """Converts a XML tag and children like processNode, yielding a
+       TripleBatch per element, in document order."""
+
+    # only process actual tags, not comments
+    if not isinstance(tag.tag, basestring):
+        return
+
+    stack = [(tag, parentNode, index)]
+
+    while stack:
+        tag, parentNode, index = stack.pop()
+
+        batch = TripleBatch()
+        node, _ = processTag(tag.tag, collapseText(tag.text), sortedItems(tag), len(tag) > 0,
+                             batch, parentNode, plan, None, index)
+        yield batch
+
+        # process any child elements next, in document order
+        children = list(tag.iterchildren(lxml.etree.Element))
+        stack.extend((children[i], node, i) for i in xrange(len(children) - 1, -1, -1))
+
+def processNode(tag, graph, parentNode, schema_data, target_namespace, plan = None, index = 0):
+    """ Converts a XML tag and children to RDF graph nodes.
+
+        The tree is walked with an explicit stack instead of recursion, so
+        the document depth is not limited by the Python recursion limit.
+        A ConversionPlan for `schema_data` is compiled unless one is given.
+        `index` is the tag's position among its parent's child elements.
+        The tree is left unchanged, so it can be converted again.
+    """
+
+    if plan is None:
+        plan = ConversionPlan(schema_data, target_namespace)
 
-        # tags with attributes get their own per-attribute triples
-        if len(tag.keys()):
-            for k, v in sorted(tag.items()):
-                k_qn = lxml.etree.QName(k)
-                pred = constructURIRef(k_qn.namespace, k_qn.localname)
-                obj = rdflib.Literal(v)
-                graph.add((node, pred, obj))
+    addBatches(graph, iterNodeBatches(tag, parentNode, plan, index))
 
-        # recursively process any children
-        for child in tag.getchildren():
-            processNode(child, graph, node, schema_data, target_namespace)
+def childElements(tag):
+    """Iterates over the child elements of `tag` (skipping comments and
+       processing instructions) with their indices."""
+    return enumerate(tag.iterchildren(lxml.etree.Element))
 
-def parseXMLDocument(xml_root, graph, schema_data, target_namespace = ""):
-    processNode(xml_root, graph, None, schema_data, target_namespace)
+def iterDocumentBatches(xml_root, plan, subtree_done = None):
+    """Converts the XML tree under `xml_root`, yielding a TripleBatch per
+       element. See parseXMLDocument for `subtree_done`."""
+    if subtree_done is None:
+        for batch in iterNodeBatches(xml_root, None, plan):
+            yield batch
+        return
 
+    batch = TripleBatch()
+    node, _ = processTag(xml_root.tag, collapseText(xml_root.text), sortedItems(xml_root), len(xml_root) > 0,
+                         batch, None, plan)
+    yield batch
+    for index, child in childElements(xml_root):
+        for batch in iterNodeBatches(child, node, plan, index):
+            yield batch
+        subtree_done()
+
+def iterDocumentTriples(xml_root, schema_data, target_namespace = "", plan = None):
+    """Yields the triples of the XML tree under `xml_root` as they are
+       produced, without collecting them anywhere. The document's namespace
+       bindings are in xml_root.nsmap."""
+    if plan is None:
+        plan = ConversionPlan(schema_data, target_namespace)
+    for batch in iterDocumentBatches(xml_root, plan):
+        for triple in batch:
+            yield triple
+
+def parseXMLDocument(xml_root, graph, schema_data, target_namespace = "", plan = None, subtree_done = None):
+    """Converts the XML tree under `xml_root` into triples added to `graph`,
+       which may be an rdflib.Graph or any other sink (see sinks.py).
+
+       If given, `subtree_done` is called after the triples of each child of
+       the root have been emitted. Blank nodes never span two such subtrees,
+       so output can be split at these points."""
+    if plan is None:
+        plan = ConversionPlan(schema_data, target_namespace)
+
+    # bound first, so that writers can declare the prefixes up front
     for k, v in xml_root.nsmap.iteritems():
         graph.bind(k, normalizeNamespace(v))
+
+    addBatches(graph, iterDocumentBatches(xml_root, plan, subtree_done))
+
+class _StreamFrame:
+    """Conversion state of an open element during streaming conversion."""
+    def __init__(self, elem, parent, index):
+        self.elem = elem
+        self.parent = parent
+        self.index = index
+        self.node = None
+        self.children = 0
+
+def iterStreamBatches(source, plan, bind = None, subtree_done = None, **kwargs):
+    """Converts the XML document at `source` like parseXMLStream, yielding a
+       TripleBatch per element as it ends. `bind` is called with the root's
+       namespace bindings as soon as they are known."""
+
+    stack = []
+
+    for event, elem in lxml.etree.iterparse(source, events=('start', 'end'), **kwargs):
+        if event == 'start':
+            if stack:
+                parent = stack[-1]
+                # the parent has a child element, so it needs a node; its
+                # own parent's node was selected the same way
+                if parent.node is None:
+                    parent.node, _ = selectNode(sortedItems(parent.elem), True, plan,
+                                                parent.parent.node, parent.index)
+                frame = _StreamFrame(elem, parent, parent.children)
+                parent.children += 1
+            else:
+                # the root's namespaces are known up front
+                if bind is not None:
+                    for k, v in elem.nsmap.iteritems():
+                        bind(k, normalizeNamespace(v))
+                frame = _StreamFrame(elem, None, 0)
+                frame.node = plan.root_node
+            stack.append(frame)
+            continue
+
+        frame = stack.pop()
+
+        parentNode = frame.parent.node if frame.parent is not None else None
+
+        # comments and processing instructions still count as children
+        has_children = frame.children > 0 or len(elem) > 0
+
+        batch = TripleBatch()
+        processTag(elem.tag, collapseText(elem.text), sortedItems(elem), has_children,
+                   batch, parentNode, plan, frame.node, frame.index)
+        yield batch
+
+        # the element is done with; drop its content, and the siblings
+        # before it (not the element itself: the parser still appends its
+        # tail text to it). The root's siblings are the prolog's comments
+        # and processing instructions, which have no parent element.
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+        if subtree_done is not None and len(stack) == 1:
+            subtree_done()
+
+def iterStreamTriples(source, schema_data, target_namespace = "", plan = None, **kwargs):
+    """Yields the triples of the XML document at `source` as parseXMLStream
+       produces them, parsing incrementally. Extra keyword arguments are
+       passed on to iterparse."""
+    if plan is None:
+        plan = ConversionPlan(schema_data, target_namespace)
+    for batch in iterStreamBatches(source, plan, **kwargs):
+        for triple in batch:
+            yield triple
+
+def parseXMLStream(source, graph, schema_data, target_namespace = "", plan = None, subtree_done = None, **kwargs):
+    """Converts the XML document at `source` (a file name or file object)
+       incrementally, using lxml.etree.iterparse.
+
+       Produces the same triples as `parseXMLDocument`, but finished elements
+       are cleared and detached as soon as their triples have been emitted,
+       so memory use depends on the depth of the document rather than its
+       size. `subtree_done` is as for parseXMLDocument (the root's own
+       triples come last here). Extra keyword arguments are passed on to
+       iterparse."""
+
+    if plan is None:
+        plan = ConversionPlan(schema_data, target_namespace)
+
+    addBatches(graph, iterStreamBatches(source, plan, graph.bind, subtree_done, **kwargs))
@@ -7,6 +7,9 @@ import os
 import re
 import argparse
 import urlparse
+from multiprocessing.pool import ThreadPool
+
+import instrumentation
 
 builtInDatatypeNames = set(['{http://www.w3.org/2001/XMLSchema}' + n for n in [
     'string',
@@ -80,8 +83,15 @@ def processRawNode(tag, data):
             if tag_qn.localname in data:
                 data[tag_qn.localname].append(child)
 
-def processSimpleType(tag, typeMap, nsMap, targetNS = "#"):
-    name = "{{{0}}}{1}".format(targetNS, tag.get('name'))
+def anonymousTypeName(name):
+    """Names the anonymous type defined inside the element or attribute
+       `name` ({ns}name); elements and types have separate names in XML
+       Schema, so the type can't simply take the element's name."""
+    return name + '.type'
+
+def processSimpleType(tag, typeMap, nsMap, targetNS = "#", name = None):
+    if name is None:
+        name = "{{{0}}}{1}".format(targetNS, tag.get('name'))
     for child in tag.getchildren():
         # ignore annotations for now
         if child.tag == "{http://www.w3.org/2001/XMLSchema}annotation":
@@ -101,8 +111,9 @@ def processSimpleType(tag, typeMap, nsMap, targetNS = "#"):
 
         #raise NotImplementedError('unhandled tag {0} in simpleType {1}'.format(child.tag, name))
 
-def processComplexType(tag, complexTypeMap, nsMap, targetNS = "#"):
-    name = "{{{0}}}{1}".format(targetNS, tag.get('name'))
+def processComplexType(tag, complexTypeMap, nsMap, targetNS = "#", name = None):
+    if name is None:
+        name = "{{{0}}}{1}".format(targetNS, tag.get('name'))
     tagDescriptor = ComplexTypeDescriptor(name)
 
     def processChild(child, name, tagDescriptor, nsMap, targetNS):
@@ -140,13 +151,19 @@ def processComplexType(tag, complexTypeMap, nsMap, targetNS = "#"):
     complexTypeMap[name] = tagDescriptor.parentName
 
 
-def processAttribute(tag, attributeMap, nsMap, targetNS = "#"):
+def processAttribute(tag, attributeMap, nsMap, targetNS = "#", simpleTypeMap = None):
     name = "{{{0}}}{1}".format(targetNS, tag.get('name'))
     attrType = tag.get('type')
     for child in tag.getchildren():
         # ignore annotations for now
         if child.tag == "{http://www.w3.org/2001/XMLSchema}annotation":
             continue
+        # anonymous simple type
+        if child.tag == "{http://www.w3.org/2001/XMLSchema}simpleType" and not attrType and simpleTypeMap is not None:
+            attrType = anonymousTypeName(name)
+            processSimpleType(child, simpleTypeMap, nsMap, targetNS, attrType)
+            attributeMap[name] = attrType
+            return
         #raise NotImplementedError('unhandled tag {0} in attribute {1}'.format(child.tag, name))
     if attrType:
         attributeMap[name] = nsExpand(attrType, nsMap)
@@ -159,16 +176,25 @@ def processAttributeGroup(tag, attributeGroupMap, nsMap, targetNS = "#"):
             continue
         #raise NotImplementedError('unhandled tag {0} in attributeGroup {1}'.format(child.tag, name))
 
-def processElement(tag, elementMap, nsMap, targetNS = "#"):
+def processElement(tag, elementMap, nsMap, targetNS = "#", simpleTypeMap = None, complexTypeMap = None):
     name = "{{{0}}}{1}".format(targetNS, tag.get('name'))
-    # TODO: Some elements define anonymous simpleType or complexType types;
-    # it's not clear how we want to handle these.
     elemType = tag.get('type')
     for child in tag.getchildren():
         # ignore annotations for now
         #print child
         if child.tag == "{http://www.w3.org/2001/XMLSchema}annotation":
             continue
+        # anonymous types get a name of their own (see anonymousTypeName)
+        if elemType or simpleTypeMap is None:
+            continue
+        if child.tag == "{http://www.w3.org/2001/XMLSchema}simpleType":
+            elementMap[name] = anonymousTypeName(name)
+            processSimpleType(child, simpleTypeMap, nsMap, targetNS, elementMap[name])
+            return
+        if child.tag == "{http://www.w3.org/2001/XMLSchema}complexType":
+            elementMap[name] = anonymousTypeName(name)
+            processComplexType(child, complexTypeMap, nsMap, targetNS, elementMap[name])
+            return
         #raise NotImplementedError('unhandled tag {0} in element {1}'.format(child.tag, name))
     if elemType:
         elementMap[name] = nsExpand(elemType, nsMap)
@@ -201,38 +227,146 @@ def extractMappingsFromSchema(schema_root_node, schema_data):
         processSimpleType(t, simpleTypeMap, nsMap, targetNS)
 
     for t in z['attribute']:
-        processAttribute(t, attributeMap, nsMap, targetNS)
+        processAttribute(t, attributeMap, nsMap, targetNS, simpleTypeMap)
 
     for t in z['complexType']:
         processComplexType(t, complexTypeMap, nsMap, targetNS)
 
     for t in z['element']:
-        processElement(t, elementMap, nsMap, targetNS)
+        processElement(t, elementMap, nsMap, targetNS, simpleTypeMap, complexTypeMap)
 
     schema_data.simpleTypeMap.update(simpleTypeMap)
     schema_data.complexTypeMap.update(complexTypeMap)
     schema_data.attributeMap.update(attributeMap)
     schema_data.elementMap.update(elementMap)
 
-def reduceSimpleTypeMap(typeMap):
-    """Reduces type map entries to XML built-in datatypes where possible,
-       or to xsd:string where not.
+xsdString = '{http://www.w3.org/2001/XMLSchema}string'
 
-       Done in place.
+def resolveSimpleTypes(typeMap, cycles = None):
+    """Returns a dict mapping each simple type in `typeMap` (type -> base
+       type) to the built-in datatype it derives from, or to xsd:string if it
+       derives from none.
 
-       Expects that all linked schemata have already been recursively explored;
-       otherwise it may well turn everything into xsd:string."""
+       Each chain of base types is walked once: every type on it gets the
+       result, so later walks stop where they meet a resolved type. Types on
+       a cycle of base types get xsd:string, and are added to the set
+       `cycles` if given."""
 
+    resolved = {}
     for k in typeMap:
+        if k in resolved:
+            continue
+
         # trace upwards through the type map
-        cur = typeMap[k]
-        while cur in typeMap:
+        path = []
+        onPath = set()
+        cur = k
+        while cur in typeMap and cur not in resolved:
+            if cur in onPath:
+                if cycles is not None:
+                    cycles.update(path[path.index(cur):])
+                cur = xsdString
+                break
+            path.append(cur)
+            onPath.add(cur)
             cur = typeMap[cur]
 
-        if cur not in builtInDatatypeNames:
-            cur = '{http://www.w3.org/2001/XMLSchema}string'
+        if cur in resolved:
+            cur = resolved[cur]
+        elif cur not in builtInDatatypeNames:
+            cur = xsdString
+
+        for t in path:
+            resolved[t] = cur
+    return resolved
+
+def reduceSimpleTypeMap(typeMap):
+    """Reduces type map entries to XML built-in datatypes where possible,
+       or to xsd:string where not (see resolveSimpleTypes).
+
+       Done in place. Returns the set of types found on cycles.
 
-        typeMap[k] = cur
+       Expects that all linked schemata have already been recursively explored;
+       otherwise it may well turn everything into xsd:string."""
+
+    cycles = set()
+    typeMap.update(resolveSimpleTypes(typeMap, cycles))
+    return cycles
+
+class TypeResolver:
+    """Type lookups over a SchemaData: the built-in datatype of a type,
+       found through the base types of complex types with simple content.
+
+       Everything is computed up front from the maps as they are, so a
+       resolver should be made after all schemata are loaded. Cycles among
+       base types are broken and their types recorded in `cycles`."""
+
+    def __init__(self, schema_data):
+        self.cycles = set()
+        self.simpleTypes = resolveSimpleTypes(schema_data.simpleTypeMap, self.cycles)
+        self.complexTypeMap = schema_data.complexTypeMap
+
+        # complex type -> tuple of its base types, nearest first
+        self.supertypes = {}
+        for name in self.complexTypeMap:
+            if name not in self.supertypes:
+                self.resolveSupertypes(name)
+
+        self.datatypes = {}
+
+    def resolveSupertypes(self, name):
+        complexTypeMap = self.complexTypeMap
+        supertypes = self.supertypes
+        path = []
+        onPath = set()
+        cur = name
+        cyclic = False
+        while cur is not None and cur in complexTypeMap and cur not in supertypes:
+            if cur in onPath:
+                # drop the edge that closes the cycle
+                self.cycles.update(path[path.index(cur):])
+                cyclic = True
+                break
+            path.append(cur)
+            onPath.add(cur)
+            cur = complexTypeMap[cur]
+
+        if cur is None or cyclic:
+            tail = ()
+        elif cur in supertypes:
+            tail = (cur,) + supertypes[cur]
+        else:
+            # a simple or built-in type, or one we don't know
+            tail = (cur,)
+
+        for t in reversed(path):
+            supertypes[t] = tail
+            tail = (t,) + tail
+
+    def datatype(self, name):
+        """Returns the built-in datatype of the values of type `name`, or
+           None if it has no simple content (or is unknown)."""
+        try:
+            return self.datatypes[name]
+        except KeyError:
+            pass
+
+        if name in self.simpleTypes:
+            ret = self.simpleTypes[name]
+        elif name in builtInDatatypeNames:
+            ret = name
+        else:
+            ret = None
+            # complex types with simple content derive from a simple type
+            for t in self.supertypes.get(name, ()):
+                if t in self.simpleTypes:
+                    ret = self.simpleTypes[t]
+                    break
+                if t in builtInDatatypeNames:
+                    ret = t
+                    break
+        self.datatypes[name] = ret
+        return ret
 
 def getPathRelativeToReferencePath(path, ref_path):
     return urlparse.urljoin(ref_path, path)
@@ -256,96 +390,215 @@ def adjustNamespaceShortName(n):
     else:
         return n
 
-def parseXMLSchemaRecursive(schema_loc, schema_graph, schema_data):
-
-    #print "parsing schema at", schema_loc
+def resolveSchemaLocation(loc, namespace, catalog):
+    if catalog is None:
+        return loc
+    return catalog.resolve(loc, namespace)
 
-    t = lxml.etree.parse(schema_loc)
-    r = t.getroot()
-
-    for k, v in r.nsmap.iteritems():
-        schema_graph.bind(adjustNamespaceShortName(k), normalizeNamespace(v))
-
-    extractMappingsFromSchema(r, schema_data)
-
-    schema_data.schemataVisited.append(schema_loc)
+def loadSchemaDocument(schema_loc):
+    return lxml.etree.parse(schema_loc).getroot()
 
+def findSchemaImports(r, schema_loc, catalog):
+    """Returns the (resolved) locations of the schemata imported by the
+       schema `r` loaded from `schema_loc`."""
+    ret = []
     for c in r.getchildren():
         if c.tag == "{http://www.w3.org/2001/XMLSchema}import":
             newloc = c.get('schemaLocation')
-            newloc_uri = getPathRelativeToReferencePath(newloc, schema_loc)
-            if newloc_uri not in schema_data.schemataVisited:
-                parseXMLSchemaRecursive(newloc_uri, schema_graph, schema_data)
+            if newloc:
+                newloc = getPathRelativeToReferencePath(newloc, schema_loc)
+            newloc = resolveSchemaLocation(newloc, c.get('namespace'), catalog)
+            if newloc:
+                ret.append(newloc)
+    return ret
+
+def loadSchemaClosure(schema_locs, schema_graph, schema_data, catalog = None, threads = None):
+    """Loads the schemata at `schema_locs` and everything they import into
+       `schema_data`, skipping schemata visited before.
+
+       Locations are resolved through `catalog` (a catalog.SchemaCatalog), if
+       given. Their namespace prefixes are bound on `schema_graph` unless it
+       is None. The schemata are parsed one level of imports at a time, each
+       level on a pool of `threads` threads (lxml parses without holding the
+       GIL); their mappings are then extracted in order."""
+
+    visited = schema_data.schemataVisited
+
+    pending = []
+    for schema_loc in schema_locs:
+        schema_loc = resolveSchemaLocation(schema_loc, None, catalog)
+        if schema_loc not in visited:
+            visited.add(schema_loc)
+            pending.append(schema_loc)
+
+    pool = None
+    try:
+        while pending:
+            #print "parsing schemata at", pending
+            with instrumentation.phase('schema.parse'):
+                if len(pending) > 1 and threads != 1:
+                    if pool is None:
+                        pool = ThreadPool(threads)
+                    roots = pool.map(loadSchemaDocument, pending)
+                else:
+                    roots = map(loadSchemaDocument, pending)
+            instrumentation.count('schemata.parsed', len(pending))
+
+            imported = []
+            with instrumentation.phase('schema.extract'):
+                for schema_loc, r in zip(pending, roots):
+                    if schema_graph is not None:
+                        for k, v in r.nsmap.iteritems():
+                            schema_graph.bind(adjustNamespaceShortName(k), normalizeNamespace(v))
+
+                    extractMappingsFromSchema(r, schema_data)
+
+                    for newloc in findSchemaImports(r, schema_loc, catalog):
+                        if newloc not in visited:
+                            visited.add(newloc)
+                            imported.append(newloc)
+            pending = imported
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def parseXMLSchemaRecursive(schema_loc, schema_graph, schema_data, catalog = None):
+    loadSchemaClosure([schema_loc], schema_graph, schema_data, catalog, 1)
 
 def decomposeLongTagName(tn):
     """Convert {foo}bar to (foo, bar)."""
     # quick and dirty
     return tn[1:].split('}')
 
-def parseXMLSchema(schema_loc, schema_graph, schema_data):
+def iterPropertyTriples(n, vreal):
+    # k-node a rdfs:Property;
+    yield (n, rdflib.namespace.RDF.type, rdflib.namespace.RDF.Property)
 
-    parseXMLSchemaRecursive(schema_loc, schema_graph, schema_data)
+    if vreal:
+        v_dec = decomposeLongTagName(vreal)
 
-    #print "reducing type map"
+        nbasetype = constructURIRef(v_dec[0], v_dec[1])
+
+        #   rdfs:range v-node;
+        yield (n, rdflib.namespace.RDFS.range, nbasetype)
+
+def emitPropertyTriples(n, vreal, schema_graph):
+    for triple in iterPropertyTriples(n, vreal):
+        schema_graph.add(triple)
 
-    reduceSimpleTypeMap(schema_data.simpleTypeMap)
+def iterRDFSTriples(schema_data, stale = None):
+    """Yields the RDFS triples for the definitions in `schema_data` that have
+       not been emitted yet (or whose type has changed since).
 
+       What was emitted is tracked in schema_data.rdfsEmitted, keyed on the
+       kind and name of each definition; a definition counts as emitted once
+       its triples have been yielded. When a definition's type has changed,
+       `stale` (if given) is called with each triple emitted for its old type
+       that no longer holds, so that the caller can remove it."""
+
+    emitted = schema_data.rdfsEmitted
+    notEmitted = object()
+
+    def typeNode(v):
+        v_dec = decomposeLongTagName(v)
+        return constructURIRef(v_dec[0], v_dec[1])
 
     #print "building RDFS"
     # build RDFS graph triples
     # for complex types
     for k, v in schema_data.complexTypeMap.iteritems():
+        old = emitted.get(('complexType', k), notEmitted)
+        if old == v:
+            continue
+
         k_dec = decomposeLongTagName(k)
         n = constructURIRef(k_dec[0], k_dec[1])
 
+        if old is not notEmitted and old and stale is not None:
+            stale((n, rdflib.namespace.RDFS.subClassOf, typeNode(old)))
+
         # k-node a rdfs:Class;
-        schema_graph.add((n, rdflib.namespace.RDF.type, rdflib.namespace.RDFS.Class))
+        yield (n, rdflib.namespace.RDF.type, rdflib.namespace.RDFS.Class)
 
         if v:
-            v_dec = decomposeLongTagName(v)
-            nbasetype = constructURIRef(v_dec[0], v_dec[1])
             #   subClassOf v-node
-            schema_graph.add((n, rdflib.namespace.RDFS.subClassOf, nbasetype))
+            yield (n, rdflib.namespace.RDFS.subClassOf, typeNode(v))
 
-    # for element types
-    for k, v in schema_data.elementMap.iteritems():
-        k_dec = decomposeLongTagName(k)
+        emitted[('complexType', k)] = v
 
-        n = constructURIRef(k_dec[0], k_dec[1])
+    # for element and attribute types
+    for kind, other, typeMap in (('element', 'attribute', schema_data.elementMap),
+                                 ('attribute', 'element', schema_data.attributeMap)):
+        for k, v in typeMap.iteritems():
+            vreal = schema_data.simpleTypeMap.get(v, v)
+            old = emitted.get((kind, k), notEmitted)
+            if old == vreal:
+                continue
 
-        # k-node a rdfs:Property;
-        schema_graph.add((n, rdflib.namespace.RDF.type, rdflib.namespace.RDF.Property))
+            k_dec = decomposeLongTagName(k)
+            n = constructURIRef(k_dec[0], k_dec[1])
 
-        if v in schema_data.simpleTypeMap:
-            vreal = schema_data.simpleTypeMap[v]
-        else:
-            vreal = v
+            # an element and an attribute of the same name share their
+            # property, so the old range may still be the other one's
+            if old is not notEmitted and old and stale is not None and emitted.get((other, k), notEmitted) != old:
+                stale((n, rdflib.namespace.RDFS.range, typeNode(old)))
 
-        if vreal:
-            v_dec = decomposeLongTagName(vreal)
+            for triple in iterPropertyTriples(n, vreal):
+                yield triple
 
-            nbasetype = constructURIRef(v_dec[0], v_dec[1])
+            emitted[(kind, k)] = vreal
 
-            #   rdfs:range v-node;
-            schema_graph.add((n, rdflib.namespace.RDFS.range, nbasetype))
+def emitRDFS(schema_graph, schema_data):
+    """Adds the RDFS triples for the definitions in `schema_data` that have
+       not been emitted yet to `schema_graph`, and removes the ones that
+       changed definitions replace if it supports removal; see
+       iterRDFSTriples."""
 
-    # for attribute types
-    for k, v in schema_data.attributeMap.iteritems():
-        k_dec = decomposeLongTagName(k)
+    add = schema_graph.add
+    for triple in iterRDFSTriples(schema_data, getattr(schema_graph, 'remove', None)):
+        add(triple)
 
-        n = constructURIRef(k_dec[0], k_dec[1])
-        # k-node a rdfs:Property;
-        schema_graph.add((n, rdflib.namespace.RDF.type, rdflib.namespace.RDF.Property))
+def iterSchemaTriples(schema_locs, schema_data, catalog = None, threads = None, namespaces = None, stale = None):
+    """Loads the schemata at `schema_locs` and their imports into
+       `schema_data` like parseXMLSchemata, then yields the RDFS triples for
+       all definitions not emitted before, as they are built. `stale` is
+       passed on to iterRDFSTriples.
 
-        if v in schema_data.simpleTypeMap:
-            vreal = schema_data.simpleTypeMap[v]
-        else:
-            vreal = v
+       The schemata's namespace prefixes are bound on `namespaces` (a graph
+       or sink), if given. Loading happens on the first call to next()."""
+
+    loadSchemaClosure(schema_locs, namespaces, schema_data, catalog, threads)
+
+    #print "reducing type map"
+
+    with instrumentation.phase('schema.reduce'):
+        cycles = reduceSimpleTypeMap(schema_data.simpleTypeMap)
+    if cycles:
+        instrumentation.count('types.cyclic', len(cycles))
+
+    with instrumentation.phase('schema.rdfs'):
+        for triple in iterRDFSTriples(schema_data, stale):
+            yield triple
+
+def parseXMLSchemata(schema_locs, schema_graph, schema_data, catalog = None, threads = None):
+    """Loads the schemata at `schema_locs` and their imports into
+       `schema_data`, and adds the RDFS triples for all definitions not
+       emitted before to `schema_graph`, which may be an rdflib.Graph or any
+       other sink (see sinks.py). Triples emitted earlier for definitions
+       that have changed since are removed from `schema_graph` if it has a
+       `remove` method; sinks that write triples out can't take them back.
+
+       All schemata are loaded before the simple type map is reduced and the
+       RDFS triples are built, so both happen once however many schemata
+       there are. See loadSchemaClosure for `catalog` and `threads`."""
 
-        if vreal:
-            v_dec = decomposeLongTagName(vreal)
+    add = schema_graph.add
+    for triple in iterSchemaTriples(schema_locs, schema_data, catalog, threads, schema_graph,
+                                    getattr(schema_graph, 'remove', None)):
+        add(triple)
 
-            nbasetype = constructURIRef(v_dec[0], v_dec[1])
+def parseXMLSchema(schema_loc, schema_graph, schema_data, catalog = None, threads = None):
+    """Loads the schema at `schema_loc`; see parseXMLSchemata."""
 
-            #   rdfs:range v-node;
-            schema_graph.add((n, rdflib.namespace.RDFS.range, nbasetype))
+    parseXMLSchemata([schema_loc], schema_graph, schema_data, catalog, threads)